@@ -0,0 +1,29 @@
+"""Version manifest
+
+Revision ID: 197c67c82c31
+Revises: daf7afa00aa3
+Create Date: 2026-10-19 10:02:11.730452
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '197c67c82c31'
+down_revision = 'daf7afa00aa3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('versions', sa.Column('module', sa.String(255), nullable=True))
+    op.add_column('versions', sa.Column('description', sa.String(255), nullable=True))
+    op.create_index('ix_versions_module', 'versions', ['module'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_versions_module', 'versions')
+    with op.batch_alter_table('versions') as batch_op:
+        batch_op.drop_column('description')
+        batch_op.drop_column('module')
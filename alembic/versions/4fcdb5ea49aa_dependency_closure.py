@@ -0,0 +1,36 @@
+"""Dependency closure
+
+Revision ID: 4fcdb5ea49aa
+Revises: c475f8611ab4
+Create Date: 2026-10-19 16:27:51.640932
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4fcdb5ea49aa'
+down_revision = 'c475f8611ab4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'version_dependencies',
+        sa.Column('version_id', sa.Integer, sa.ForeignKey('versions.id'), primary_key=True),
+        sa.Column('dependency_name', sa.String(255), primary_key=True, index=True),
+    )
+
+    op.create_table(
+        'plugin_closure',
+        sa.Column('plugin_name', sa.String(255), primary_key=True),
+        sa.Column('dependency_name', sa.String(255), primary_key=True, index=True),
+        sa.Column('depth', sa.Integer, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('plugin_closure')
+    op.drop_table('version_dependencies')
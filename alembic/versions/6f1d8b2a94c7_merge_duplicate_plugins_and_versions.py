@@ -0,0 +1,56 @@
+"""Merge duplicate plugins and versions
+
+Revision ID: 6f1d8b2a94c7
+Revises: 8c2d51e7a3f0
+Create Date: 2026-10-19 19:02:17.334861
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f1d8b2a94c7'
+down_revision = '8c2d51e7a3f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Runs before the catalog is built from the plugins, as its names are
+    # unique, and before the unique constraints are added in e5a07c3d9b14
+    connection = op.get_bind()
+
+    # Plugins created twice by concurrent requests are merged into the first
+    # one, which is the one the routes resolved their name to
+    duplicate_plugins = connection.execute(sa.text(
+        'SELECT p.id, MIN(o.id) FROM plugins p JOIN plugins o ON o.name = p.name AND o.id < p.id GROUP BY p.id'
+    )).all()
+    for duplicate_id, plugin_id in duplicate_plugins:
+        params = {'duplicate_id': duplicate_id, 'plugin_id': plugin_id}
+        for table in ('versions', 'uploads'):
+            connection.execute(
+                sa.text(f'UPDATE {table} SET plugin_id = :plugin_id WHERE plugin_id = :duplicate_id'), params,
+            )
+        connection.execute(sa.text(
+            'INSERT OR IGNORE INTO plugins_maintainers_association (plugin_id, maintainer_id) '
+            'SELECT :plugin_id, maintainer_id FROM plugins_maintainers_association WHERE plugin_id = :duplicate_id'
+        ), params)
+        connection.execute(
+            sa.text('DELETE FROM plugins_maintainers_association WHERE plugin_id = :duplicate_id'), params,
+        )
+        connection.execute(sa.text('DELETE FROM plugins WHERE id = :duplicate_id'), params)
+
+    # Versions published twice share the same tarball, that of the last one
+    duplicate_versions = sa.text(
+        'SELECT v.id FROM versions v JOIN versions o '
+        'ON o.plugin_id = v.plugin_id AND o.version = v.version AND o.id > v.id'
+    )
+    for table in ('version_dependencies', 'scrub_findings'):
+        connection.execute(sa.text(f'DELETE FROM {table} WHERE version_id IN ({duplicate_versions.text})'))
+    connection.execute(sa.text(f'DELETE FROM versions WHERE id IN ({duplicate_versions.text})'))
+
+
+def downgrade() -> None:
+    # Merged rows cannot be split again
+    pass
@@ -0,0 +1,45 @@
+"""Integrity scrubber
+
+Revision ID: 8c2d51e7a3f0
+Revises: 4fcdb5ea49aa
+Create Date: 2026-10-19 18:02:14.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2d51e7a3f0'
+down_revision = '4fcdb5ea49aa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'scrub_state',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('last_version_id', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('pass_started_at', sa.DateTime, nullable=True),
+        sa.Column('last_pass_finished_at', sa.DateTime, nullable=True),
+        sa.Column('checked', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('bytes_read', sa.Integer, nullable=False, server_default='0'),
+    )
+
+    op.create_table(
+        'scrub_findings',
+        sa.Column('version_id', sa.Integer, primary_key=True),
+        sa.Column('plugin_name', sa.String(255), nullable=False),
+        sa.Column('version', sa.String(20), nullable=False),
+        sa.Column('problem', sa.String(20), nullable=False),
+        sa.Column('expected', sa.String(64), nullable=True),
+        sa.Column('actual', sa.String(64), nullable=True),
+        sa.Column('quarantine_path', sa.String(1024), nullable=True),
+        sa.Column('found_at', sa.DateTime, nullable=False, index=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('scrub_findings')
+    op.drop_table('scrub_state')
@@ -0,0 +1,47 @@
+"""Maintainer key fingerprint
+
+Revision ID: 9d52fb42c30f
+Revises: d75c69adb558
+Create Date: 2026-10-19 13:41:07.295518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from cli_registry.utils import key_fingerprint
+
+
+# revision identifiers, used by Alembic.
+revision = '9d52fb42c30f'
+down_revision = 'd75c69adb558'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('maintainers', sa.Column('fingerprint', sa.String(64), nullable=True))
+
+    maintainers = sa.table(
+        'maintainers',
+        sa.column('id', sa.Integer),
+        sa.column('ssh_key', sa.String),
+        sa.column('fingerprint', sa.String),
+    )
+    connection = op.get_bind()
+    for maintainer_id, ssh_key in connection.execute(sa.select(maintainers.c.id, maintainers.c.ssh_key)):
+        connection.execute(
+            maintainers
+            .update()
+            .where(maintainers.c.id == maintainer_id)
+            .values(fingerprint=key_fingerprint(ssh_key))
+        )
+
+    with op.batch_alter_table('maintainers') as batch_op:
+        batch_op.alter_column('fingerprint', existing_type=sa.String(64), nullable=False)
+        batch_op.create_index('ix_maintainers_fingerprint', ['fingerprint'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('maintainers') as batch_op:
+        batch_op.drop_index('ix_maintainers_fingerprint')
+        batch_op.drop_column('fingerprint')
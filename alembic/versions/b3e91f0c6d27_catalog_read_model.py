@@ -0,0 +1,68 @@
+"""Catalog read model
+
+Revision ID: b3e91f0c6d27
+Revises: 6f1d8b2a94c7
+Create Date: 2026-10-19 19:12:40.518733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e91f0c6d27'
+down_revision = '6f1d8b2a94c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'catalog',
+        sa.Column('plugin_id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.String(255), nullable=False, unique=True),
+        sa.Column('latest_version', sa.String(20), nullable=True),
+        sa.Column('version_count', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('maintainers', sa.JSON, nullable=False),
+        sa.Column('versions', sa.JSON, nullable=False),
+    )
+
+    # Filled as `catalog.rebuild` does at this revision, without depending on the models of the app.
+    # Upload dates are formatted as datetime.isoformat does, without microseconds when they are 0.
+    upload_date = (
+        "CASE WHEN substr(v.upload_date, 21) = '000000' THEN substr(replace(v.upload_date, ' ', 'T'), 1, 19) "
+        "ELSE replace(v.upload_date, ' ', 'T') END"
+    )
+    op.execute(f"""
+        INSERT INTO catalog (plugin_id, name, latest_version, version_count, maintainers, versions)
+        SELECT
+            p.id,
+            p.name,
+            (
+                SELECT v.version FROM versions v
+                WHERE v.plugin_id = p.id AND v.upload_date IS NOT NULL
+                ORDER BY v.upload_date DESC, v.id LIMIT 1
+            ),
+            (SELECT COUNT(*) FROM versions v WHERE v.plugin_id = p.id),
+            (
+                SELECT json_group_array(email) FROM (
+                    SELECT m.email FROM plugins_maintainers_association a
+                    JOIN maintainers m ON m.id = a.maintainer_id
+                    WHERE a.plugin_id = p.id ORDER BY m.id
+                )
+            ),
+            (
+                SELECT json_group_array(json(version)) FROM (
+                    SELECT json_object(
+                        'id', v.id, 'plugin_id', v.plugin_id, 'upload_date', {upload_date}, 'version', v.version,
+                        'size', v.size, 'digest', v.digest, 'module', v.module, 'description', v.description
+                    ) AS version
+                    FROM versions v WHERE v.plugin_id = p.id ORDER BY v.id
+                )
+            )
+        FROM plugins p
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('catalog')
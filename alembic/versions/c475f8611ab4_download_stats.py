@@ -0,0 +1,39 @@
+"""Download stats
+
+Revision ID: c475f8611ab4
+Revises: 9d52fb42c30f
+Create Date: 2026-10-19 15:02:36.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c475f8611ab4'
+down_revision = '9d52fb42c30f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'download_stats',
+        sa.Column('plugin_name', sa.String(255), primary_key=True),
+        sa.Column('version', sa.String(20), primary_key=True),
+        sa.Column('day', sa.Date, primary_key=True),
+        sa.Column('downloads', sa.Integer, nullable=False),
+    )
+
+    op.create_table(
+        'popular_plugins',
+        sa.Column('rank', sa.Integer, primary_key=True),
+        sa.Column('plugin_name', sa.String(255), nullable=False),
+        sa.Column('downloads', sa.Integer, nullable=False),
+        sa.Column('computed_at', sa.DateTime, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('popular_plugins')
+    op.drop_table('download_stats')
@@ -0,0 +1,44 @@
+"""Change log and replication
+
+Revision ID: d75c69adb558
+Revises: 197c67c82c31
+Create Date: 2026-10-19 11:24:52.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd75c69adb558'
+down_revision = '197c67c82c31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'changes',
+        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column('created_at', sa.DateTime, nullable=False),
+        sa.Column('action', sa.String(32), nullable=False),
+        sa.Column('plugin_name', sa.String(255), nullable=False, index=True),
+        sa.Column('version', sa.String(20), nullable=True),
+        sa.Column('data', sa.Text, nullable=False),
+        sqlite_autoincrement=True,
+    )
+
+    op.create_table(
+        'replication_state',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('primary_url', sa.String(255), nullable=False),
+        sa.Column('last_change_id', sa.Integer, nullable=False),
+        sa.Column('last_change_at', sa.DateTime, nullable=True),
+        sa.Column('primary_last_change_id', sa.Integer, nullable=False),
+        sa.Column('last_polled_at', sa.DateTime, nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('replication_state')
+    op.drop_table('changes')
@@ -0,0 +1,37 @@
+"""Resumable uploads
+
+Revision ID: daf7afa00aa3
+Revises: 4ba8066d8250
+Create Date: 2026-10-19 09:12:40.118274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'daf7afa00aa3'
+down_revision = '4ba8066d8250'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('versions', sa.Column('size', sa.Integer, nullable=True))
+    op.add_column('versions', sa.Column('digest', sa.String(64), nullable=True))
+
+    op.create_table(
+        'uploads',
+        sa.Column('id', sa.String(32), primary_key=True),
+        sa.Column('version', sa.String(20), nullable=False),
+        sa.Column('created_at', sa.DateTime, nullable=False),
+        sa.Column('expires_at', sa.DateTime, nullable=False, index=True),
+        sa.Column('plugin_id', sa.Integer, sa.ForeignKey('plugins.id'), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('uploads')
+    with op.batch_alter_table('versions') as batch_op:
+        batch_op.drop_column('digest')
+        batch_op.drop_column('size')
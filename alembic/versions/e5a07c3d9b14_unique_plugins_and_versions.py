@@ -0,0 +1,29 @@
+"""Unique plugins and versions
+
+Revision ID: e5a07c3d9b14
+Revises: b3e91f0c6d27
+Create Date: 2026-10-19 20:04:31.907152
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a07c3d9b14'
+down_revision = 'b3e91f0c6d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('plugins') as batch_op:
+        batch_op.create_unique_constraint('uq_plugins_name', ['name'])
+    with op.batch_alter_table('versions') as batch_op:
+        batch_op.create_unique_constraint('uq_versions_plugin_id_version', ['plugin_id', 'version'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('versions') as batch_op:
+        batch_op.drop_constraint('uq_versions_plugin_id_version', type_='unique')
+    with op.batch_alter_table('plugins') as batch_op:
+        batch_op.drop_constraint('uq_plugins_name', type_='unique')
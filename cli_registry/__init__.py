@@ -3,17 +3,103 @@ Registry for the CLI app
 '''
 __version__ = '1.0.0'
 
+import argparse
+from pathlib import Path
+import sys
+
 from alembic.config import Config
 from alembic import command
 import uvicorn
 
 from cli_registry.app import app
-from cli_registry.config import HOST, PORT, RUN_MIGRATIONS, ALEMBIC_INI_PATH
+from cli_registry import backup, catalog
+from cli_registry.config import HOST, PORT, RUN_MIGRATIONS, ALEMBIC_INI_PATH, REPLICA_OF
+from cli_registry.db import SessionLocal
+from cli_registry.storage_migration import migrate
 
 
-def main():
+def serve():
     if RUN_MIGRATIONS:
         alembic_cfg = Config(ALEMBIC_INI_PATH)
         command.upgrade(alembic_cfg, "head")
+    elif REPLICA_OF:
+        # Replicas bootstrap their database themselves, then follow the primary
+        alembic_cfg = Config(ALEMBIC_INI_PATH)
+        command.upgrade(alembic_cfg, "head")
+        uvicorn.run(app, host=HOST, port=PORT)
     else:
         uvicorn.run(app, host=HOST, port=PORT)
+
+
+def migrate_storage(batch_size: int):
+    db = SessionLocal()
+    try:
+        moved = migrate(db, batch_size)
+    finally:
+        db.close()
+    print(f'Moved {moved} tarballs to the sharded layout.')
+
+
+def rebuild_catalog():
+    db = SessionLocal()
+    try:
+        count = catalog.rebuild(db)
+        db.commit()
+    finally:
+        db.close()
+    print(f'Rebuilt the catalog of {count} plugins.')
+
+
+def export(path: str):
+    if path == '-':
+        manifest = backup.export(sys.stdout.buffer)
+    else:
+        with open(path, 'wb') as out:
+            manifest = backup.export(out)
+    # Printed to stderr, as the archive may be written to stdout
+    print(
+        f"Exported {len(manifest['versions'])} versions, {len(manifest['missing'])} deleted during the export.",
+        file=sys.stderr,
+    )
+
+
+def import_(path: str, workers: int | None):
+    try:
+        manifest = backup.restore(Path(path), workers=workers)
+    except backup.BackupError as e:
+        sys.exit(f'Import failed: {e}')
+    print(f"Imported {len(manifest['versions'])} versions.")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='app', description=__doc__)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('serve', help='Run the registry (the default).')
+    migrate_parser = subparsers.add_parser(
+        'migrate-storage', help='Move the stored tarballs to the sharded layout, while the registry runs.'
+    )
+    migrate_parser.add_argument('--batch-size', type=int, default=1000)
+    subparsers.add_parser(
+        'rebuild-catalog', help='Rebuild the read model of the catalog from the plugins, versions and maintainers.'
+    )
+    export_parser = subparsers.add_parser(
+        'export', help='Write a snapshot of the database and tarballs to an archive, while the registry runs.'
+    )
+    export_parser.add_argument('path', help='Path of the archive, - for stdout.')
+    import_parser = subparsers.add_parser(
+        'import', help='Restore an archive written by export into an empty registry.'
+    )
+    import_parser.add_argument('path', help='Path of the archive.')
+    import_parser.add_argument('--workers', type=int, default=None, help='Number of tarballs restored at once.')
+    args = parser.parse_args()
+
+    if args.command == 'migrate-storage':
+        migrate_storage(args.batch_size)
+    elif args.command == 'rebuild-catalog':
+        rebuild_catalog()
+    elif args.command == 'export':
+        export(args.path)
+    elif args.command == 'import':
+        import_(args.path, args.workers)
+    else:
+        serve()
@@ -0,0 +1,4 @@
+from cli_registry import main
+
+
+main()
@@ -1,22 +1,39 @@
+import asyncio
 from base64 import b85decode
 from datetime import datetime
+import hashlib
 from http import HTTPStatus
 import logging
 from logging.config import dictConfig
 import os
-from textwrap import shorten
+from pathlib import Path
 from typing import Optional
 
-from fastapi import FastAPI, Depends, Header, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import (
+    FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse,
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
-from cli_registry.config import BASE_PATH
-from cli_registry.models.maintainer import MaintainerOrm, MaintainerModel
+from cli_registry.config import BULK_MAX_VERSIONS, POPULAR_SIZE, REPLICA_OF
+from cli_registry.models.catalog import CatalogEntryOrm
+from cli_registry.models.maintainer import MaintainerOrm, MaintainerModel, association_table
 from cli_registry.models.plugin import (
     PluginOrm, PluginVersionOrm, PluginModel, PluginVersionModel,
 )
+from cli_registry.models.session import SessionModel
+from cli_registry.models.upload import UploadOrm, UploadFinalizeModel
 from cli_registry import dependancies as deps
+from cli_registry import (
+    catalog, changes, closure, deltas, events, permissions, pipeline, profiling, replication, retention, scrubber,
+    sessions, stats, storage, tarball_cache, tasks, uploads, validation, workers,
+)
+from cli_registry.budgets import budget
+from cli_registry.utils import file_digest, key_fingerprint
 
 
 log_config = {
@@ -47,59 +64,371 @@ app = FastAPI()
 logger = logging.getLogger('cli_registry')
 
 
+@app.on_event('startup')
+async def init_storage():
+    await run_in_threadpool(storage.init_layout)
+
+
+@app.on_event('startup')
+async def start_background_tasks():
+    tasks.start()
+
+
+@app.on_event('shutdown')
+async def stop_background_tasks():
+    await tasks.stop()
+    workers.shutdown()
+    pipeline.shutdown()
+    events.shutdown()
+    # The downloads counted since the last flush would be lost otherwise
+    await run_in_threadpool(stats.flush_task)
+
+
+@app.middleware('http')
+async def redirect_writes_to_primary(request: Request, call_next):
+    '''Replicas are read-only, writes are redirected to their primary.'''
+    if REPLICA_OF and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        url = REPLICA_OF + request.url.path
+        if request.url.query:
+            url += '?' + request.url.query
+        return RedirectResponse(url, HTTPStatus.TEMPORARY_REDIRECT)
+    return await call_next(request)
+
+
+app.middleware('http')(profiling.profile_request)
+
+
+async def validate_tarball(path: Path, version: str) -> tuple[dict, list[str]]:
+    '''
+    Validates the tarball at `path` in the process pool, and returns its
+    manifest along with warnings about it.
+    '''
+    try:
+        manifest = await workers.run_in_process(validation.validate_tarball, str(path))
+    except validation.InvalidTarball as e:
+        raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY, str(e))
+    return manifest, validation.manifest_warnings(manifest, version)
+
+
+def check_version(version: str):
+    '''Rejects versions which are not a single path segment, as they are joined to the path of their tarball'''
+    max_length = validation.MAX_FIELD_LENGTHS['version']
+    if not storage.is_path_segment(version) or len(version) > max_length:
+        raise HTTPException(
+            HTTPStatus.UNPROCESSABLE_ENTITY,
+            f'Version {version!r} is not valid, it must be a single path segment of at most {max_length} characters.'
+        )
+
+
+def add_version(
+    db: Session, plugin: PluginOrm, version: str, size: int, digest: str, manifest: dict,
+) -> PluginVersionOrm:
+    '''Adds a validated version of the plugin to the session, and records its publication'''
+    try:
+        closure.check(db, plugin.name, manifest['dependencies'])
+    except closure.DependencyError as e:
+        raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY, f'Version {version}: {e}')
+    version_orm = PluginVersionOrm()
+    version_orm.version = version
+    version_orm.plugin = plugin
+    version_orm.upload_date = datetime.now()
+    version_orm.size = size
+    version_orm.digest = digest
+    version_orm.module = manifest['module']
+    version_orm.description = manifest['description']
+    db.add(version_orm)
+    changes.version_published(db, version_orm, manifest['dependencies'])
+    closure.version_published(db, version_orm, manifest['dependencies'])
+    return version_orm
+
+
+async def publish_versions(
+    versions: list[tuple[PluginOrm, str, dict, Path, int, str]], upload_id: str | None = None,
+) -> list[dict]:
+    '''
+    Publishes validated versions, given as (plugin, version, manifest, staged
+    tarball, size, digest), in the next group commit, along with deleting the
+    upload they come from. Their tarballs are moved in place before the commit,
+    and back if it fails. Returns the versions, as dicts.
+    '''
+    versions = [(plugin.id, *version) for plugin, *version in versions]
+    moved: list[tuple[Path, Path]] = []
+
+    def undo():
+        while moved:
+            file_path, staged_path = moved.pop()
+            os.replace(file_path, staged_path)
+
+    def apply(db: Session) -> list[dict]:
+        data = []
+        plugin_names = set()
+        try:
+            for plugin_id, version, manifest, staged_path, size, digest in versions:
+                plugin = db.get(PluginOrm, plugin_id)
+                plugin_name = plugin.name
+                plugin_names.add(plugin_name)
+                try:
+                    version_orm = add_version(db, plugin, version, size, digest, manifest)
+                    # Before its tarball is moved in place, so that a concurrent publish of the same
+                    # version conflicts on the unique constraint rather than overwriting the tarball
+                    db.flush()
+                except IntegrityError:
+                    raise HTTPException(
+                        HTTPStatus.NOT_ACCEPTABLE, f'Version {plugin_name}/{version} already exists.'
+                    )
+                data.append(version_orm.dict(with_file=False))
+                logger.debug('Saving version to path %s', version_orm.file_path)
+                version_orm.file_path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(staged_path, version_orm.file_path)
+                moved.append((version_orm.file_path, staged_path))
+            catalog.refresh(db, plugin_names)
+            if upload_id is not None:
+                db.query(UploadOrm).filter(UploadOrm.id == upload_id).delete()
+        except Exception:
+            undo()
+            raise
+        return data
+
+    data = await pipeline.submit(apply, undo)
+    events.notify()
+    # The tarballs were synced when staged, their renames are once committed
+    await run_in_threadpool(lambda: {storage.fsync_path(path.parent) for path, _ in moved})
+    return data
+
+
 @app.get('/v1/plugins')
-async def list_plugins(page: int = 1, page_size: int = 10, db: Session = Depends(deps.db)):
-    '''Lists available plugins on this registry.'''
-    plugins: list[PluginOrm] = (
+@budget(queries=1, memory=1 * 1024 * 1024)
+async def list_plugins(
+    page: int = 1, page_size: int = 10,
+    db: Session = Depends(deps.db),
+    fields: tuple[str, ...] = Depends(deps.plugin_fields),
+):
+    '''Lists available plugins on this registry, with the comma separated `fields` only, if given.'''
+    entries: list[CatalogEntryOrm] = (
         db
-        .query(PluginOrm)
+        .query(CatalogEntryOrm)
+        .options(CatalogEntryOrm.load_fields(fields))
+        .order_by(CatalogEntryOrm.plugin_id)
         .limit(page_size)
         .offset(page_size * (page - 1))
         .all()
     )
     return {
         'status': 'ok',
-        'data': [plugin.dict() for plugin in plugins],
+        'data': [entry.dict(fields) for entry in entries],
     }
 
 
 @app.get('/v1/plugins/{plugin_name}')
-async def get_plugin(plugin: PluginOrm = Depends(deps.plugin)):
-    '''Get a specific plugin definition by name.'''
+@budget(queries=1)
+async def get_plugin(
+    entry: CatalogEntryOrm = Depends(deps.catalog_plugin),
+    fields: tuple[str, ...] = Depends(deps.plugin_fields),
+):
+    '''Get a specific plugin definition by name, with the comma separated `fields` only, if given.'''
     return {
         'status': 'ok',
-        'data': plugin.dict(),
+        'data': entry.dict(fields),
     }
 
 
 @app.get('/v1/plugins/{plugin_name}/versions')
-async def list_plugin_versions(plugin: PluginOrm = Depends(deps.plugin)):
-    '''List available versions of a given plugin.'''
+@budget(queries=1)
+async def list_plugin_versions(
+    entry: CatalogEntryOrm = Depends(deps.catalog_versions),
+    fields: deps.VersionFields = Depends(deps.version_fields),
+):
+    '''
+    List available versions of a given plugin, with the comma separated
+    `fields` only, if given, and their tarball with include=file.
+    '''
     return {
         'status': 'ok',
-        'data': [version.dict(with_file=False) for version in plugin.versions]
+        'data': [
+            catalog.version_dict(entry.name, version, fields.fields, fields.file) for version in entry.versions
+        ],
     }
 
 
 @app.get('/v1/plugins/{plugin_name}/versions/latest')
-async def get_plugin_version_latest(plugin: PluginOrm = Depends(deps.plugin)):
-    '''Gets the latest version of a given plugin.'''
+@budget(queries=2)
+async def get_plugin_version_latest(
+    plugin_version: PluginVersionOrm = Depends(deps.latest_plugin_version),
+    fields: deps.VersionFields = Depends(deps.version_fields),
+):
+    '''
+    Gets the latest version of a given plugin, with the comma separated
+    `fields` only, if given, and its tarball with include=file.
+    '''
+    if fields.file:
+        stats.record_download(plugin_version.plugin.name, plugin_version.version)
     return {
         'status': 'ok',
-        'data': plugin.latest_version.dict()
+        'data': plugin_version.dict(with_file=fields.file, fields=fields.fields)
     }
 
 
 @app.get('/v1/plugins/{plugin_name}/versions/{version}')
-async def get_plugin_version(plugin_version: PluginVersionOrm = Depends(deps.plugin_version)):
-    '''Gets a specific version of a given plugin.'''
+@budget(queries=2)
+async def get_plugin_version(
+    plugin_version: PluginVersionOrm = Depends(deps.plugin_version_fields),
+    fields: deps.VersionFields = Depends(deps.version_fields),
+):
+    '''
+    Gets a specific version of a given plugin, with the comma separated
+    `fields` only, if given, and its tarball with include=file.
+    '''
+    if fields.file:
+        stats.record_download(plugin_version.plugin.name, plugin_version.version)
     return {
         'status': 'ok',
-        'data': plugin_version.dict()
+        'data': plugin_version.dict(with_file=fields.file, fields=fields.fields)
     }
 
 
+@app.get('/v1/plugins/{plugin_name}/versions/{version}/download')
+@budget(queries=2)
+async def download_plugin_version(
+    plugin_version: PluginVersionOrm = Depends(deps.plugin_version),
+    from_version: str | None = Query(default=None, alias='from'),
+    if_none_match: str | None = Header(default=None),
+):
+    '''
+    Downloads the tarball of a specific version of a given plugin, or the
+    delta from the version `from` when one was computed. The ETag of a
+    tarball is its digest, so that clients revalidate the tarballs they cache.
+    '''
+    plugin_name = plugin_version.plugin.name
+    etag = f'"{plugin_version.digest}"' if plugin_version.digest else None
+    if etag is not None and if_none_match is not None:
+        if etag in (tag.strip() for tag in if_none_match.split(',')) or if_none_match.strip() == '*':
+            # Installing from a cache is still an install
+            stats.record_download(plugin_name, plugin_version.version)
+            return Response(status_code=HTTPStatus.NOT_MODIFIED, headers={'ETag': etag})
+    if from_version is not None:
+        # Joined to the path of the delta, so it must be a single path segment
+        if not storage.is_path_segment(from_version):
+            raise HTTPException(
+                HTTPStatus.UNPROCESSABLE_ENTITY,
+                f'Version {from_version!r} is not a valid version to download a delta from.'
+            )
+        delta_path = deltas.delta_path(plugin_name, from_version, plugin_version.version)
+        if delta_path.exists():
+            stats.record_download(plugin_name, plugin_version.version)
+            return FileResponse(
+                delta_path, media_type=deltas.MEDIA_TYPE,
+                filename=f'{plugin_name}-{from_version}-{plugin_version.version}.delta',
+            )
+    file_path = plugin_version.file_path
+    try:
+        content = tarball_cache.cache.get(file_path)
+    except FileNotFoundError:
+        raise HTTPException(
+            HTTPStatus.NOT_FOUND,
+            f'Tarball of version {plugin_version.version} not found.'
+        )
+    stats.record_download(plugin_version.plugin.name, plugin_version.version)
+    filename = f'{plugin_version.plugin.name}-{plugin_version.version}.tar.gz'
+    etag_headers = {'ETag': etag} if etag is not None else {}
+    if content is None:
+        return FileResponse(file_path, media_type='application/gzip', filename=filename, headers=etag_headers)
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"', 'Content-Length': str(len(content)),
+        **etag_headers,
+    }
+    if isinstance(content, bytes):
+        return Response(content, media_type='application/gzip', headers=headers)
+    return StreamingResponse(tarball_cache.iter_chunks(content), media_type='application/gzip', headers=headers)
+
+
+@app.get('/v1/plugins/{plugin_name}/versions/{version}/closure')
+@budget(queries=5)
+async def get_plugin_version_closure(
+    db: Session = Depends(deps.db),
+    plugin_version: PluginVersionOrm = Depends(deps.plugin_version),
+):
+    '''Gets the transitive dependencies of a specific version, resolved to their latest versions.'''
+    return {
+        'status': 'ok',
+        'data': closure.resolve(db, plugin_version),
+    }
+
+
+@app.get('/v1/plugins/{plugin_name}/stats')
+@budget(queries=2)
+async def get_plugin_stats(days: int = 30, db: Session = Depends(deps.db), plugin: PluginOrm = Depends(deps.plugin)):
+    '''Gets the downloads of a plugin over the last days, by day and by version.'''
+    return {
+        'status': 'ok',
+        'data': stats.plugin_stats(db, plugin.name, min(max(days, 1), 366)),
+    }
+
+
+@app.get('/v1/popular')
+@budget(queries=1)
+async def list_popular_plugins(limit: int = 10, db: Session = Depends(deps.db)):
+    '''Lists the most downloaded plugins, as last ranked.'''
+    return {
+        'status': 'ok',
+        'data': [plugin.dict() for plugin in stats.popular(db, min(max(limit, 1), POPULAR_SIZE))],
+    }
+
+
+@app.get('/v1/changes')
+@budget(queries=2)
+async def list_changes(since: int = 0, limit: int = 500, db: Session = Depends(deps.db)):
+    '''Lists the changes made to the registry after the change `since`, for replicas to follow.'''
+    return {
+        'status': 'ok',
+        'data': [change.dict() for change in changes.since(db, since, min(limit, 1000))],
+        'last_id': changes.last_id(db),
+    }
+
+
+@app.get('/v1/events')
+@budget(queries=2)
+async def stream_events(
+    plugin: list[str] | None = Query(default=None),
+    last_event_id: int | None = Header(default=None),
+):
+    '''
+    Streams the creation and deletion of plugins and versions as server-sent
+    events, optionally about some plugins only. Streams resume after the event
+    whose id is sent in the Last-Event-ID header.
+    '''
+    return StreamingResponse(
+        events.stream(plugin, last_event_id), media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.get('/v1/replication')
+@budget(queries=1)
+async def get_replication_status(db: Session = Depends(deps.db)):
+    '''Gets the role of this registry and, for a replica, its replication lag.'''
+    return {'status': 'ok', 'data': replication.status(db)}
+
+
+@app.post('/v1/sessions')
+@budget(queries=0)
+async def create_session(data: SessionModel | None = None, fingerprint: str = Depends(deps.signature)):
+    '''
+    Exchange a signature of this path for a short-lived session token, to send
+    as `Authorization: Bearer <token>` instead of signing every request.
+    '''
+    token, expires_at = sessions.issue(fingerprint, data.plugins if data else None)
+    return JSONResponse(
+        {
+            'status': 'ok',
+            'data': {'token': token, 'expires_at': datetime.fromtimestamp(expires_at).isoformat()},
+        },
+        HTTPStatus.CREATED
+    )
+
+
 @app.post('/v1/plugins')
+# Five more queries to refresh the catalog
+@budget(queries=11)
 async def create_plugin(
     plugin_data: PluginModel, db: Session = Depends(deps.db),
     x_maintainer_email: str | None = Header(default=None),
@@ -112,22 +441,24 @@ async def create_plugin(
             'Authorization header not provided.'
         )
 
-    existing_plugin = (
-        db
-        .query(PluginOrm)
-        .filter(PluginOrm.name == plugin_data.name)
-        .first()
+    # The name is claimed by the insert itself, so that only one of concurrent creations succeeds
+    inserted = db.execute(
+        insert(PluginOrm).values(name=plugin_data.name).on_conflict_do_nothing(index_elements=['name'])
     )
-    if existing_plugin is not None:
+    if not inserted.rowcount:
+        # Nothing was written, but the insert took the write lock, released right away rather than
+        # once the session is closed
+        db.commit()
         raise HTTPException(
             HTTPStatus.NOT_ACCEPTABLE,
             'A plugin with this name already exists.'
         )
+    plugin_orm: PluginOrm = db.get(PluginOrm, inserted.inserted_primary_key[0])
 
     maintainer: Optional[MaintainerOrm] = (
         db
         .query(MaintainerOrm)
-        .filter(MaintainerOrm.ssh_key == authorization)
+        .filter(MaintainerOrm.fingerprint == key_fingerprint(authorization))
         .first()
     )
     if maintainer is None:
@@ -136,15 +467,19 @@ async def create_plugin(
         maintainer.ssh_key = authorization
         maintainer.email = x_maintainer_email
         db.add(maintainer)
-    plugin_orm = PluginOrm()
-    plugin_orm.name = plugin_data.name
-    plugin_orm.maintainers.append(maintainer)
-    db.add(plugin_orm)
+    changes.plugin_created(db, plugin_orm, maintainer)
+    db.execute(association_table.insert().values(plugin_id=plugin_orm.id, maintainer_id=maintainer.id))
+    catalog.refresh(db, [plugin_orm.name])
+    # The id of a deleted plugin may be reused
+    plugin_id = plugin_orm.id
     db.commit()
+    permissions.cache.invalidate(plugin_id)
+    events.notify()
     return JSONResponse({'status': 'ok'}, HTTPStatus.CREATED)
 
 
 @app.get('/v1/plugins/{plugin_name}/maintainers')
+@budget(queries=2)
 async def list_plugin_maintainers(
     plugin: PluginOrm = Depends(deps.plugin),
 ):
@@ -153,6 +488,8 @@ async def list_plugin_maintainers(
 
 
 @app.post('/v1/plugins/{plugin_name}/maintainers', dependencies=[Depends(deps.authentication)])
+# Five more queries to refresh the catalog
+@budget(queries=11)
 async def add_maintainer_to_plugin(
     maintainer: MaintainerModel,
     db: Session = Depends(deps.db),
@@ -163,7 +500,7 @@ async def add_maintainer_to_plugin(
     maintainer_orm = (
         db
         .query(MaintainerOrm)
-        .filter(MaintainerOrm.ssh_key == maintainer.ssh_key)
+        .filter(MaintainerOrm.fingerprint == key_fingerprint(maintainer.ssh_key))
         .first()
     )
     status = HTTPStatus.OK
@@ -173,8 +510,13 @@ async def add_maintainer_to_plugin(
         maintainer_orm.email = maintainer.email
         status = HTTPStatus.CREATED
         db.add(maintainer_orm)
-    plugin.maintainers.append(maintainer_orm)
+    changes.maintainer_added(db, plugin, maintainer_orm)
+    # Insert the association directly rather than loading every maintainer of the plugin
+    db.execute(association_table.insert().values(plugin_id=plugin.id, maintainer_id=maintainer_orm.id))
+    catalog.refresh(db, [plugin.name])
+    plugin_id = plugin.id
     db.commit()
+    permissions.cache.invalidate(plugin_id)
     return JSONResponse({'status': 'ok'}, status)
 
 
@@ -182,37 +524,232 @@ async def add_maintainer_to_plugin(
     '/v1/plugins/{plugin_name}/versions/{version}',
     dependencies=[Depends(deps.authentication)]
 )
+# Four more queries when the dependencies of the plugin change, to update the closures,
+# five to refresh the catalog, and one after the response to find the previous version
+# to compute a delta from
+@budget(queries=16)
 async def create_plugin_version(
     version: str, data: PluginVersionModel,
     db: Session = Depends(deps.db),
     plugin: PluginOrm = Depends(deps.plugin),
 ):
     '''Publish a new version of the plugin to the registry.'''
-    print(
-        'Creating a new plugin version for plugin %s (%s)' % (plugin.name, version)
+    check_version(version)
+    logger.debug('Creating a new plugin version for plugin %s (%s)', plugin.name, version)
+    tarball = b85decode(data.tarball)
+    staged_path = await run_in_threadpool(uploads.stage_tarball, tarball)
+    try:
+        manifest, warnings = await validate_tarball(staged_path, version)
+        [version_data] = await publish_versions([
+            (plugin, version, manifest, staged_path, len(tarball), hashlib.sha256(tarball).hexdigest()),
+        ])
+    finally:
+        staged_path.unlink(missing_ok=True)
+    return JSONResponse(
+        {'status': 'ok', 'data': {**version_data, 'warnings': warnings}}, HTTPStatus.CREATED,
+        background=BackgroundTask(deltas.build, [version_data['id']]),
     )
-    version_orm = PluginVersionOrm()
-    version_orm.version = version
-    version_orm.plugin = plugin
-    version_orm.upload_date = datetime.now()
-    db.add(version_orm)
+
+
+@app.post('/v1/bulk/versions')
+# A query, a savepoint, then two inserts per version (two versions in the budget tests),
+# one more per version to check the closures, and three more when they change, five to
+# refresh the catalog, then one after the response to find the previous versions to
+# compute deltas from
+@budget(queries=18, memory=1024 * 1024)
+async def create_plugin_versions(
+    request: Request,
+    db: Session = Depends(deps.db),
+    credentials: dict = Depends(deps.credentials),
+):
+    '''
+    Publish many versions at once, from a multipart body with one tarball per
+    field named `<plugin name>/<version>`. Either every version is published,
+    or none of them is.
+    '''
+    stager: uploads.MultipartStager | None = None
+    try:
+        # Each tarball is written to its staged file as the body is received
+        try:
+            stager = uploads.MultipartStager(request.headers.get('content-type', ''), BULK_MAX_VERSIONS)
+            async for chunk in request.stream():
+                await run_in_threadpool(stager.write, chunk)
+            stager.finish()
+        except uploads.MalformedMultipart as e:
+            raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY, str(e))
+        if credentials.get('sha256') not in (None, stager.body_digest.hexdigest()):
+            raise HTTPException(
+                HTTPStatus.FORBIDDEN,
+                'Request body does not match X-Content-SHA256.'
+            )
+        entries: dict[tuple[str, str], uploads.StagedPart] = {}
+        for part in stager.parts:
+            plugin_name, _, version = part.field.partition('/')
+            if not plugin_name or not version or part.path is None:
+                raise HTTPException(
+                    HTTPStatus.UNPROCESSABLE_ENTITY,
+                    f'Field {part.field} is not a tarball named <plugin name>/<version>.'
+                )
+            check_version(version)
+            if (plugin_name, version) in entries:
+                raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY, f'Version {part.field} is sent twice.')
+            entries[plugin_name, version] = part
+        if not entries:
+            raise HTTPException(
+                HTTPStatus.UNPROCESSABLE_ENTITY,
+                f'Between 1 and {BULK_MAX_VERSIONS} versions can be published at once.'
+            )
+
+        # Authorization of every plugin is checked once, in a single query
+        names = sorted({plugin_name for plugin_name, _ in entries})
+        out_of_scope = [name for name in names if not sessions.allows(credentials, name)]
+        if out_of_scope:
+            raise HTTPException(
+                HTTPStatus.FORBIDDEN,
+                f'Session token is not valid for plugins {", ".join(out_of_scope)}.'
+            )
+        plugins = permissions.maintained_plugins(db, names, credentials['fp'])
+        unauthorized = [name for name in names if name not in plugins]
+        if unauthorized:
+            raise HTTPException(
+                HTTPStatus.FORBIDDEN,
+                f'Key not in maintainers whitelist of plugins {", ".join(unauthorized)}.'
+            )
+
+        # The staged tarballs are validated in parallel
+        validate_results = await asyncio.gather(
+            *(validate_tarball(part.path, version) for (_, version), part in entries.items()),
+            return_exceptions=True,
+        )
+        errors = [
+            f'{plugin_name}/{version}: {result.detail}'
+            for (plugin_name, version), result in zip(entries, validate_results)
+            if isinstance(result, HTTPException)
+        ]
+        if errors:
+            raise HTTPException(HTTPStatus.UNPROCESSABLE_ENTITY, errors)
+        for result in validate_results:
+            if isinstance(result, BaseException):
+                raise result
+
+        # Committed together, nothing is published unless every version is
+        data = await publish_versions([
+            (plugins[plugin_name], version, manifest, part.path, part.size, part.digest)
+            for ((plugin_name, version), part), (manifest, _) in zip(entries.items(), validate_results)
+        ])
+        for version_data, (_, warnings) in zip(data, validate_results):
+            version_data['warnings'] = warnings
+    finally:
+        if stager is not None:
+            await run_in_threadpool(stager.close)
+    return JSONResponse(
+        {'status': 'ok', 'data': data}, HTTPStatus.CREATED,
+        background=BackgroundTask(deltas.build, [version_data['id'] for version_data in data]),
+    )
+
+
+@app.post(
+    '/v1/plugins/{plugin_name}/versions/{version}/uploads',
+    dependencies=[Depends(deps.authentication)]
+)
+@budget(queries=4)
+async def create_plugin_version_upload(
+    version: str,
+    db: Session = Depends(deps.db),
+    plugin: PluginOrm = Depends(deps.plugin),
+):
+    '''Start a resumable upload of a new version of the plugin.'''
+    check_version(version)
+    upload = uploads.create_upload(db, plugin, version)
     db.commit()
-    print('Plugin version created and committed successfully.')
-
-    plugin_path = BASE_PATH / f'{plugin.name}/'
-    print('Saving version to path %s' % plugin_path)
-    plugin_path.mkdir(parents=True, exist_ok=True)
-    print('Making the directory if it does not exist...')
-    with open(plugin_path / f'{version}.tar.gz', 'wb') as fp:
-        print(
-            'Opened file pointer to %s and writing...' % str(plugin_path / f'{version}.tar.gz')
+    return JSONResponse({'status': 'ok', 'data': upload.dict()}, HTTPStatus.CREATED)
+
+
+@app.get('/v1/plugins/{plugin_name}/uploads/{upload_id}')
+@budget(queries=2)
+async def get_plugin_version_upload(upload: UploadOrm = Depends(deps.upload)):
+    '''Gets the state of an upload, including the offset to resume it from.'''
+    return {
+        'status': 'ok',
+        'data': upload.dict(uploads.current_offset(upload)),
+    }
+
+
+@app.put(
+    '/v1/plugins/{plugin_name}/uploads/{upload_id}',
+    dependencies=[Depends(deps.authentication)]
+)
+@budget(queries=5)
+async def write_plugin_version_upload(
+    request: Request,
+    upload_offset: int = Header(...),
+    db: Session = Depends(deps.db),
+    upload: UploadOrm = Depends(deps.upload),
+):
+    '''
+    Write a chunk of the tarball, sent as the raw request body, starting
+    at the offset given in the Upload-Offset header.
+    '''
+    try:
+        offset = await uploads.write_chunk(upload, upload_offset, request.stream())
+    except uploads.OffsetMismatch as e:
+        raise HTTPException(HTTPStatus.CONFLICT, str(e))
+    db.commit()
+    return {'status': 'ok', 'data': upload.dict(offset)}
+
+
+@app.post(
+    '/v1/plugins/{plugin_name}/uploads/{upload_id}/finalize',
+    dependencies=[Depends(deps.authentication)]
+)
+# Four more queries when the dependencies of the plugin change, to update the closures,
+# five to refresh the catalog, and one after the response to find the previous version
+# to compute a delta from
+@budget(queries=18, memory=2 * 1024 * 1024)
+async def finalize_plugin_version_upload(
+    data: UploadFinalizeModel,
+    db: Session = Depends(deps.db),
+    plugin: PluginOrm = Depends(deps.plugin),
+    upload: UploadOrm = Depends(deps.upload),
+):
+    '''Verify the digest of an upload and publish it as a new version of the plugin.'''
+    part_path = uploads.upload_path(upload.id)
+    size, digest = await run_in_threadpool(file_digest, part_path)
+    if digest != data.digest:
+        raise HTTPException(
+            HTTPStatus.UNPROCESSABLE_ENTITY,
+            f'Digest {digest} of the uploaded file does not match {data.digest}.'
         )
-        print('Raw data : %s' % shorten(data.tarball, 50))
-        fp.write(b85decode(data.tarball))
-    return JSONResponse({'status': 'ok'}, HTTPStatus.CREATED)
+    manifest, warnings = await validate_tarball(part_path, upload.version)
+    await run_in_threadpool(storage.fsync_path, part_path)
+    [version_data] = await publish_versions(
+        [(plugin, upload.version, manifest, part_path, size, digest)], upload_id=upload.id,
+    )
+    return JSONResponse(
+        {'status': 'ok', 'data': {**version_data, 'warnings': warnings}}, HTTPStatus.CREATED,
+        background=BackgroundTask(deltas.build, [version_data['id']]),
+    )
+
+
+@app.delete(
+    '/v1/plugins/{plugin_name}/uploads/{upload_id}',
+    dependencies=[Depends(deps.authentication)]
+)
+@budget(queries=4)
+async def delete_plugin_version_upload(
+    db: Session = Depends(deps.db),
+    upload: UploadOrm = Depends(deps.upload),
+):
+    '''Abort an upload and discard the chunks received so far.'''
+    uploads.discard_upload(db, upload)
+    db.commit()
+    return Response(status_code=HTTPStatus.NO_CONTENT)
 
 
 @app.delete('/v1/plugins/{plugin_name}', dependencies=[Depends(deps.authentication)])
+# Five more queries to remove the dependencies of the plugin, and update the closures,
+# and two to remove it from the catalog
+@budget(queries=15)
 async def delete_plugin(
     db: Session = Depends(deps.db),
     plugin: PluginOrm = Depends(deps.plugin),
@@ -220,21 +757,83 @@ async def delete_plugin(
     '''Delete a plugin and all its versions from the registry.'''
     for version in plugin.versions:
         os.remove(version.file_path)
+    deltas.discard_plugin(plugin.name)
+    closure.plugin_deleted(db, plugin)
     db.delete(plugin)
+    changes.plugin_deleted(db, plugin)
+    catalog.refresh(db, [plugin.name])
+    plugin_id = plugin.id
     db.commit()
-    return JSONResponse({'status': 'ok'}, HTTPStatus.NO_CONTENT)
+    permissions.cache.invalidate(plugin_id)
+    events.notify()
+    return Response(status_code=HTTPStatus.NO_CONTENT)
 
 
 @app.delete(
     '/v1/plugins/{plugin_name}/versions/{version}',
     dependencies=[Depends(deps.authentication)]
 )
+# Three more queries to remove the dependencies of the version, and check the closures,
+# and five to refresh the catalog
+@budget(queries=13)
 async def delete_plugin_version(
     plugin_version: PluginVersionOrm = Depends(deps.plugin_version),
     db: Session = Depends(deps.db),
 ):
     '''Delete a plugin's version from the registry'''
     os.remove(plugin_version.file_path)
+    deltas.discard(plugin_version.plugin.name, plugin_version.version)
     db.delete(plugin_version)
+    changes.version_deleted(db, plugin_version)
+    closure.version_deleted(db, plugin_version)
+    catalog.refresh(db, [plugin_version.plugin.name])
     db.commit()
-    return JSONResponse({'status': 'ok'}, HTTPStatus.NO_CONTENT)
+    events.notify()
+    return Response(status_code=HTTPStatus.NO_CONTENT)
+
+
+@app.get('/v1/admin/profiles', dependencies=[Depends(deps.operator)])
+@budget(queries=0)
+async def list_profiles():
+    '''Lists the profiles of the profiled requests, most recent first.'''
+    return {'status': 'ok', 'data': await run_in_threadpool(profiling.list_profiles)}
+
+
+@app.get('/v1/admin/profiles/{profile_id}', dependencies=[Depends(deps.operator)])
+@budget(queries=0)
+async def get_profile(profile_id: str, format: str = 'json'):
+    '''Downloads a profile, as JSON or in the folded format of flamegraph.pl with format=folded.'''
+    profile = await run_in_threadpool(profiling.load_profile, profile_id)
+    if profile is None:
+        raise HTTPException(HTTPStatus.NOT_FOUND, f'Profile {profile_id} not found.')
+    if format == 'folded':
+        return PlainTextResponse(profiling.folded(profile))
+    return {'status': 'ok', 'data': profile}
+
+
+@app.get('/v1/admin/slow-queries', dependencies=[Depends(deps.operator)])
+@budget(queries=0)
+async def list_slow_queries():
+    '''Lists the most recent SQL statements slower than the SLOW_QUERY_THRESHOLD.'''
+    return {'status': 'ok', 'data': list(profiling.slow_queries)}
+
+
+@app.get('/v1/admin/retention', dependencies=[Depends(deps.operator)])
+@budget(queries=1)
+async def get_retention_status(db: Session = Depends(deps.db)):
+    '''Gets the retention policies, the size of the stored tarballs, and the report of the last collection.'''
+    return {
+        'status': 'ok',
+        'data': {
+            'policies': retention.policies(),
+            'usage': retention.usage(db),
+            'last_collection': retention.last_collection,
+        },
+    }
+
+
+@app.get('/v1/admin/scrub', dependencies=[Depends(deps.operator)])
+@budget(queries=4)
+async def get_scrub_status(limit: int = 100, db: Session = Depends(deps.db)):
+    '''Gets the progress of the integrity scrubber through the tarballs, and its most recent findings.'''
+    return {'status': 'ok', 'data': scrubber.status(db, min(max(limit, 1), 1000))}
@@ -0,0 +1,219 @@
+'''
+Export and import of the whole registry, as a single tar archive.
+
+An export is a consistent snapshot taken while the registry runs: the
+database is copied with the online backup API of SQLite, which only holds a
+read lock for the time of the copy, and the versions to export are read from
+that copy. Published tarballs are never modified, so they are then streamed
+into the archive one at a time, in chunks, whatever the size of the
+registry. Versions deleted after the snapshot, before their tarball was
+read, are listed as missing in the manifest.
+
+The archive holds, in that order:
+- DATABASE_MEMBER, the copy of the database,
+- a `tarballs/<plugin name>/<version>.tar.gz` member per version,
+- MANIFEST_MEMBER, listing the size and sha256 digest of every other member.
+
+An import restores the tarballs in parallel, reading their members directly
+at their offsets in the archive, and checks their digests against the
+manifest. The database is restored last, and only if every tarball was, so
+that a failed import never leaves a database referring to missing tarballs.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import tarfile
+from typing import BinaryIO, Iterator
+import uuid
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from cli_registry.config import BASE_PATH, SQL_DATABASE_PATH
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+from cli_registry import storage
+
+
+logger = logging.getLogger('cli_registry')
+
+FORMAT = 1
+DATABASE_MEMBER = 'database.sqlite3'
+MANIFEST_MEMBER = 'manifest.json'
+CHUNK_SIZE = 1024 * 1024
+
+
+class BackupError(Exception):
+    '''Raised when an archive cannot be imported'''
+
+
+class _HashingReader:
+    '''File object computing the sha256 digest of what is read from it'''
+    def __init__(self, fp: BinaryIO):
+        self.fp = fp
+        self.digest = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fp.read(size)
+        self.digest.update(data)
+        return data
+
+
+def tarball_member(plugin_name: str, version: str) -> str:
+    return f'tarballs/{plugin_name}/{version}{storage.TARBALL_SUFFIX}'
+
+
+def _snapshot(database_path: str, snapshot_path: Path):
+    '''Copies a database being written to, with the online backup API of SQLite'''
+    source = sqlite3.connect(database_path)
+    target = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def _versions(snapshot_path: Path) -> Iterator[tuple[str, str, str | None]]:
+    '''Yields the plugin name, version and digest of every version of a database copy'''
+    engine = create_engine(f'sqlite:///{snapshot_path}')
+    db = Session(bind=engine)
+    try:
+        yield from (
+            db
+            .query(PluginOrm.name, PluginVersionOrm.version, PluginVersionOrm.digest)
+            .join(PluginOrm)
+            .order_by(PluginVersionOrm.id)
+            .yield_per(1000)
+        )
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def _add(archive: tarfile.TarFile, name: str, path: Path) -> dict:
+    '''Streams a file into the archive, and returns its manifest entry'''
+    with open(path, 'rb') as fp:
+        info = tarfile.TarInfo(name)
+        stat = os.fstat(fp.fileno())
+        info.size = stat.st_size
+        info.mtime = int(stat.st_mtime)
+        reader = _HashingReader(fp)
+        archive.addfile(info, reader)
+    return {'name': name, 'size': info.size, 'digest': reader.digest.hexdigest()}
+
+
+def export(out: BinaryIO, database_path: str | None = None) -> dict:
+    '''
+    Writes a snapshot of the registry to `out`, which does not need to be
+    seekable, and returns its manifest.
+    '''
+    snapshot_path = storage.staging_path('export')
+    manifest = {
+        'format': FORMAT,
+        'created_at': datetime.now().isoformat(),
+        'versions': [],
+        'missing': [],
+    }
+    try:
+        _snapshot(database_path or SQL_DATABASE_PATH, snapshot_path)
+        with tarfile.open(fileobj=out, mode='w|', format=tarfile.PAX_FORMAT) as archive:
+            manifest['database'] = _add(archive, DATABASE_MEMBER, snapshot_path)
+            for plugin_name, version, digest in _versions(snapshot_path):
+                try:
+                    entry = _add(
+                        archive, tarball_member(plugin_name, version),
+                        storage.resolve_tarball(plugin_name, version),
+                    )
+                except FileNotFoundError:
+                    manifest['missing'].append({'plugin_name': plugin_name, 'version': version})
+                    continue
+                if digest is not None and digest != entry['digest']:
+                    logger.warning('Tarball of %s %s does not match its digest.', plugin_name, version)
+                manifest['versions'].append({'plugin_name': plugin_name, 'version': version, **entry})
+            data = json.dumps(manifest).encode('utf8')
+            info = tarfile.TarInfo(MANIFEST_MEMBER)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    finally:
+        snapshot_path.unlink(missing_ok=True)
+    return manifest
+
+
+def _restore(archive_path: Path, member: tarfile.TarInfo, digest: str, destination: Path) -> bool:
+    '''
+    Copies a member of the archive to `destination`, if its digest matches.
+    Run by several threads at once, each reading the archive with its own file.
+    '''
+    # Staged next to the destination, the database may be on another filesystem than the tarballs
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    staged = destination.with_name(f'{destination.name}.{uuid.uuid4().hex}.part')
+    try:
+        actual = hashlib.sha256()
+        with open(archive_path, 'rb') as src, open(staged, 'wb') as dst:
+            src.seek(member.offset_data)
+            remaining = member.size
+            while remaining:
+                chunk = src.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise BackupError(f'Archive is truncated in {member.name}.')
+                actual.update(chunk)
+                dst.write(chunk)
+                remaining -= len(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        if actual.hexdigest() != digest:
+            return False
+        os.replace(staged, destination)
+        return True
+    finally:
+        staged.unlink(missing_ok=True)
+
+
+def restore(archive_path: Path, database_path: str | None = None, workers: int | None = None) -> dict:
+    '''
+    Imports an archive written by `export` into an empty registry, restoring
+    its tarballs with `workers` threads, and returns its manifest.
+    '''
+    database_path = Path(database_path or SQL_DATABASE_PATH)
+    if database_path.exists():
+        raise BackupError(f'Database {database_path} already exists, import into an empty registry.')
+    # Only the headers are read, the members are read by _restore
+    with tarfile.open(archive_path, 'r:') as archive:
+        members = {member.name: member for member in archive}
+        try:
+            manifest = json.load(archive.extractfile(members[MANIFEST_MEMBER]))
+        except KeyError:
+            raise BackupError('Archive has no manifest, it may be truncated.') from None
+    if manifest.get('format') != FORMAT:
+        raise BackupError(f'Unsupported archive format {manifest.get("format")}.')
+
+    def restore_version(entry: dict) -> bool:
+        member = members.get(entry['name'])
+        return member is not None and _restore(
+            archive_path, member, entry['digest'], storage.tarball_path(entry['plugin_name'], entry['version']),
+        )
+
+    with ThreadPoolExecutor(workers) as executor:
+        restored = list(executor.map(restore_version, manifest['versions']))
+    corrupted = [
+        f"{entry['plugin_name']} {entry['version']}"
+        for entry, ok in zip(manifest['versions'], restored) if not ok
+    ]
+    if corrupted:
+        raise BackupError(
+            f'Tarballs are missing from the archive or do not match their digests: {", ".join(corrupted)}.'
+        )
+
+    if not _restore(archive_path, members[DATABASE_MEMBER], manifest['database']['digest'], database_path):
+        raise BackupError('Database does not match its digest.')
+    # Every tarball was written to the sharded layout
+    (BASE_PATH / storage.MIGRATED_MARKER).touch()
+    for entry in manifest['missing']:
+        logger.warning('Tarball of %s %s was missing from the export.', entry['plugin_name'], entry['version'])
+    return manifest
@@ -0,0 +1,35 @@
+'''
+Performance budgets of the routes.
+
+Every route declares the maximum number of SQL statements it may run and
+the peak memory it may allocate to serve a request, next to its definition:
+
+    @app.get('/v1/plugins')
+    @budget(queries=1, memory=1 * 1024 * 1024)
+    async def list_plugins(...):
+
+tests/test_budgets.py runs every route against seeded datasets of
+increasing size, and fails when a route exceeds its budget, or when its
+number of queries grows with the size of the dataset (e.g. lazy loading a
+relationship for each item of a list).
+'''
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass(frozen=True)
+class Budget:
+    queries: int
+    memory: int
+
+
+def budget(queries: int, memory: int = 512 * 1024) -> Callable:
+    '''Declares the budget of a route, `memory` is the peak allocation in bytes'''
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.budget = Budget(queries, memory)
+        return endpoint
+    return decorator
+
+
+def get_budget(endpoint: Callable) -> Budget | None:
+    return getattr(endpoint, 'budget', None)
@@ -0,0 +1,95 @@
+'''
+Read model of the catalog: a row per plugin in the `catalog` table, with its
+latest version, version count, maintainer emails, and the list of its
+versions as JSON, so that listing plugins and their versions reads a single
+row per plugin, instead of joining the plugins, versions and maintainers.
+
+Every write to the plugins, their versions or maintainers refreshes the rows
+of the plugins it touched with `refresh`, in the same transaction, and
+`app rebuild-catalog` rebuilds the whole table from the normalized ones.
+'''
+from collections import defaultdict
+from typing import Iterable
+
+from sqlalchemy.orm import Session
+
+from cli_registry.models.catalog import CatalogEntryOrm
+from cli_registry.models.maintainer import MaintainerOrm, association_table
+from cli_registry.models.plugin import VERSION_FIELDS, PluginOrm, PluginVersionOrm
+from cli_registry import storage, tarball_cache
+
+
+REBUILD_BATCH_SIZE = 500
+
+
+def _latest(versions: list[dict]) -> str | None:
+    '''Returns the most recently uploaded version, as version strings do not sort'''
+    uploaded = [version for version in versions if version['upload_date'] is not None]
+    return max(uploaded, key=lambda version: version['upload_date'])['version'] if uploaded else None
+
+
+def refresh(db: Session, plugin_names: Iterable[str]):
+    '''
+    Recomputes the catalog rows of the given plugins from the pending state of
+    the session, removing those of the plugins deleted. A constant number of
+    queries is run, however many plugins are refreshed.
+    '''
+    plugin_names = set(plugin_names)
+    if not plugin_names:
+        return
+    db.flush()
+    plugins = db.query(PluginOrm.id, PluginOrm.name).filter(PluginOrm.name.in_(plugin_names)).all()
+    db.query(CatalogEntryOrm).filter(CatalogEntryOrm.name.in_(plugin_names)).delete(synchronize_session=False)
+    if not plugins:
+        # All deleted
+        return
+    plugin_ids = [plugin_id for plugin_id, _ in plugins]
+    versions = defaultdict(list)
+    for row in (
+        db
+        .query(*(getattr(PluginVersionOrm, field) for field in VERSION_FIELDS))
+        .filter(PluginVersionOrm.plugin_id.in_(plugin_ids))
+        .order_by(PluginVersionOrm.id)
+    ):
+        version = dict(zip(VERSION_FIELDS, row))
+        if version['upload_date'] is not None:
+            version['upload_date'] = version['upload_date'].isoformat()
+        versions[version['plugin_id']].append(version)
+    maintainers = defaultdict(list)
+    for plugin_id, email in (
+        db
+        .query(association_table.c.plugin_id, MaintainerOrm.email)
+        .join(MaintainerOrm, MaintainerOrm.id == association_table.c.maintainer_id)
+        .filter(association_table.c.plugin_id.in_(plugin_ids))
+        .order_by(MaintainerOrm.id)
+    ):
+        maintainers[plugin_id].append(email)
+    db.execute(CatalogEntryOrm.__table__.insert(), [
+        {
+            'plugin_id': plugin_id,
+            'name': name,
+            'latest_version': _latest(versions[plugin_id]),
+            'version_count': len(versions[plugin_id]),
+            'maintainers': maintainers[plugin_id],
+            'versions': versions[plugin_id],
+        }
+        for plugin_id, name in plugins
+    ])
+
+
+def rebuild(db: Session) -> int:
+    '''Rebuilds the whole catalog in the transaction of the session, and returns the number of plugins in it'''
+    db.flush()
+    db.query(CatalogEntryOrm).delete(synchronize_session=False)
+    names = [name for name, in db.query(PluginOrm.name).order_by(PluginOrm.id)]
+    for start in range(0, len(names), REBUILD_BATCH_SIZE):
+        refresh(db, names[start:start + REBUILD_BATCH_SIZE])
+    return len(names)
+
+
+def version_dict(plugin_name: str, version: dict, fields: Iterable[str], with_file: bool) -> dict:
+    '''Returns the given fields of a version of the catalog, as `PluginVersionOrm.dict` does'''
+    data = {field: version[field] for field in VERSION_FIELDS if field in fields}
+    if with_file:
+        data['file'] = tarball_cache.cache.encoded(storage.resolve_tarball(plugin_name, version['version']))
+    return data
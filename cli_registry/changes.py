@@ -0,0 +1,91 @@
+'''
+Recording of the changes made by the write routes into the change log.
+
+Changes must be recorded in the same transaction as the change itself, so
+that the log never contains changes that were rolled back, or misses some.
+'''
+from datetime import datetime
+import json
+
+from sqlalchemy.orm import Session
+
+from cli_registry.models.change import ChangeOrm
+from cli_registry.models.maintainer import MaintainerOrm
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+
+
+PLUGIN_CREATED = 'plugin-created'
+PLUGIN_DELETED = 'plugin-deleted'
+MAINTAINER_ADDED = 'maintainer-added'
+VERSION_PUBLISHED = 'version-published'
+VERSION_DELETED = 'version-deleted'
+
+
+def record(
+    db: Session, action: str, plugin_name: str, version: str | None = None, data: dict | None = None,
+) -> ChangeOrm:
+    change = ChangeOrm()
+    change.created_at = datetime.now()
+    change.action = action
+    change.plugin_name = plugin_name
+    change.version = version
+    change.data = json.dumps(data or {})
+    db.add(change)
+    return change
+
+
+def plugin_created(db: Session, plugin: PluginOrm, maintainer: MaintainerOrm) -> ChangeOrm:
+    # Flush so that the ids are known, replicas reuse them
+    db.flush()
+    return record(
+        db, PLUGIN_CREATED, plugin.name,
+        data={'plugin_id': plugin.id, 'maintainer': maintainer.dict()},
+    )
+
+
+def maintainer_added(db: Session, plugin: PluginOrm, maintainer: MaintainerOrm) -> ChangeOrm:
+    db.flush()
+    return record(db, MAINTAINER_ADDED, plugin.name, data={'maintainer': maintainer.dict()})
+
+
+def version_published(db: Session, version: PluginVersionOrm, dependencies: list[str]) -> ChangeOrm:
+    db.flush()
+    return record(
+        db, VERSION_PUBLISHED, version.plugin.name, version.version,
+        data={'version': version.dict(with_file=False), 'dependencies': dependencies},
+    )
+
+
+def version_deleted(db: Session, version: PluginVersionOrm) -> ChangeOrm:
+    return record(db, VERSION_DELETED, version.plugin.name, version.version)
+
+
+def plugin_deleted(db: Session, plugin: PluginOrm) -> ChangeOrm:
+    return record(db, PLUGIN_DELETED, plugin.name)
+
+
+def mirror(db: Session, change: dict) -> ChangeOrm:
+    '''
+    Records a change pulled from the primary under its id, so that the log of
+    a replica, and the events streamed from it, are those of its primary.
+    '''
+    mirrored = record(db, change['action'], change['plugin_name'], change['version'], change['data'])
+    mirrored.id = change['id']
+    mirrored.created_at = datetime.fromisoformat(change['created_at'])
+    return mirrored
+
+
+def since(db: Session, change_id: int, limit: int) -> list[ChangeOrm]:
+    return (
+        db
+        .query(ChangeOrm)
+        .filter(ChangeOrm.id > change_id)
+        .order_by(ChangeOrm.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def last_id(db: Session) -> int:
+    last: ChangeOrm | None = db.query(ChangeOrm).order_by(ChangeOrm.id.desc()).first()
+    return 0 if last is None else last.id
@@ -0,0 +1,324 @@
+'''
+Client of the registry, for the CLI app and the other consumers of its API.
+
+    with Client('https://registry.example.com', private_key=Path('~/.ssh/id_ed25519')) as client:
+        client.publish('spam', '1.0.0', Path('spam-1.0.0.tar.gz'))
+        paths = client.download_many([('spam', '1.0.0'), ('eggs', 'latest')])
+
+Requests reuse the connections of a pool of up to `max_connections`
+persistent connections, which is also the number of requests `plugins` and
+`download_many` send at once. Authenticated requests are sent with a session
+token, obtained with a single signature and renewed before it expires, so
+that the private key is only used once per session.
+
+Downloaded tarballs are kept under `cache_dir`, as
+`<plugin>/<version>/<digest>.tar.gz`. A cached tarball is revalidated with
+its digest in an If-None-Match header, so the registry only sends it again
+when the version was republished with another tarball. Downloads are
+verified against the digest the registry sends as their ETag.
+'''
+from base64 import b64encode, b85encode
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+import hashlib
+import http.client
+import json
+import os
+from pathlib import Path
+import queue
+import threading
+import time
+from typing import Iterable, Iterator
+from urllib.parse import quote, urlencode, urlsplit
+import uuid
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+
+
+CHUNK_SIZE = 1024 * 1024
+TARBALL_SUFFIX = '.tar.gz'
+# Session tokens are renewed this many seconds before they expire
+TOKEN_RENEWAL_MARGIN = 30
+# Errors of a request sent on a connection the server closed while it was idle
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class RegistryError(Exception):
+    '''Raised when the registry answers a request with an error'''
+    def __init__(self, status: int, detail: str):
+        super().__init__(f'{status}: {detail}')
+        self.status = status
+        self.detail = detail
+
+
+def load_private_key(data: bytes, password: bytes | None = None):
+    '''Loads an RSA or Ed25519 private key, in the PEM or OpenSSH format'''
+    if b'OPENSSH PRIVATE KEY' in data:
+        key = serialization.load_ssh_private_key(data, password)
+    else:
+        key = serialization.load_pem_private_key(data, password)
+    if not isinstance(key, (ed25519.Ed25519PrivateKey, rsa.RSAPrivateKey)):
+        raise ValueError('Only RSA and Ed25519 keys are supported.')
+    return key
+
+
+def sign(private_key, message: bytes) -> str:
+    '''Returns the base64 encoded signature of a message, as verified by the registry'''
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        signature = private_key.sign(message)
+    else:
+        signature = private_key.sign(
+            message,
+            padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
+            hashes.SHA256(),
+        )
+    return b64encode(signature).decode('utf8')
+
+
+class ConnectionPool:
+    '''Persistent HTTP connections to a host, each used by one thread at a time'''
+    def __init__(self, url: str, size: int = 10, timeout: float = 30):
+        parts = urlsplit(url)
+        self.connection_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        )
+        self.host = parts.netloc
+        self.size = size
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+
+    @contextmanager
+    def connection(self) -> Iterator[tuple[http.client.HTTPConnection, bool]]:
+        '''Yields an idle connection, or a new one, and whether it was reused'''
+        try:
+            connection, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            connection, reused = self.connection_class(self.host, timeout=self.timeout), False
+        try:
+            yield connection, reused
+        except BaseException:
+            # The response may not have been read entirely
+            connection.close()
+            raise
+        if self._idle.qsize() < self.size:
+            self._idle.put(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Client:
+    '''Client of a registry, safe to share between threads'''
+    def __init__(
+        self, url: str, private_key: Path | bytes | None = None, cache_dir: Path | None = None,
+        max_connections: int = 10, timeout: float = 30,
+    ):
+        self.url = url.rstrip('/')
+        self.base_path = urlsplit(self.url).path
+        self.pool = ConnectionPool(self.url, max_connections, timeout)
+        self.cache_dir = Path(cache_dir or Path.home() / '.cache/cli_registry').expanduser()
+        self._executor = ThreadPoolExecutor(max_connections, thread_name_prefix='cli_registry')
+        self._private_key = None
+        self.public_key = None
+        if private_key is not None:
+            if isinstance(private_key, Path):
+                private_key = private_key.expanduser().read_bytes()
+            self._private_key = load_private_key(private_key)
+            self.public_key = self._private_key.public_key().public_bytes(
+                serialization.Encoding.OpenSSH, serialization.PublicFormat.OpenSSH,
+            ).decode('utf8')
+        self._token: str | None = None
+        self._token_expiry = 0.0
+        self._token_lock = threading.Lock()
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+        self.pool.close()
+
+    def _path(self, *segments: str, **query) -> str:
+        path = self.base_path + '/v1/' + '/'.join(quote(segment, safe='') for segment in segments)
+        query = {key: value for key, value in query.items() if value is not None}
+        return f'{path}?{urlencode(query)}' if query else path
+
+    @contextmanager
+    def _send(
+        self, method: str, path: str, body: bytes | None = None, headers: dict | None = None,
+    ) -> Iterator[http.client.HTTPResponse]:
+        '''Sends a request on a pooled connection, and yields the response, to read before returning'''
+        headers = {**(headers or {}), 'Content-Length': str(len(body or b''))}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            with self.pool.connection() as (connection, reused):
+                try:
+                    connection.request(method, path, body, headers)
+                    response = connection.getresponse()
+                except _STALE_CONNECTION_ERRORS:
+                    if not reused or attempt:
+                        raise
+                    # Closed by the server while idle, sent again once the connection is reopened
+                    connection.close()
+                    continue
+                yield response
+                # Drained, so that the connection can be reused
+                response.read()
+                return
+
+    def request(
+        self, method: str, path: str, payload=None, headers: dict | None = None, authenticated: bool = False,
+    ) -> dict:
+        '''Sends a request with a JSON payload, and returns the JSON response'''
+        body = json.dumps(payload).encode('utf8') if payload is not None else None
+        for attempt in range(2):
+            request_headers = {**(headers or {}), **(self._session_headers() if authenticated else {})}
+            with self._send(method, path, body, request_headers) as response:
+                data = response.read()
+            if response.status == 403 and authenticated and not attempt:
+                # The token was issued by a worker which does not know it anymore, renewed once
+                self._token = None
+                continue
+            break
+        content = json.loads(data) if data else {}
+        if response.status >= 400:
+            raise RegistryError(response.status, content.get('detail', data.decode('utf8', 'replace')))
+        return content
+
+    def _signed_headers(self, path: str) -> dict:
+        if self._private_key is None:
+            raise ValueError('A private key is required for authenticated requests.')
+        return {
+            'Authorization': self.public_key,
+            'X-Signature': sign(self._private_key, urlsplit(path).path.encode('utf8')),
+        }
+
+    def _timestamped_headers(self, method: str, path: str, body: bytes = b'') -> dict:
+        '''Headers signing the method, path, body digest and time of a request, as exchanged for a session'''
+        headers = self._signed_headers(path)
+        digest = hashlib.sha256(body).hexdigest()
+        timestamp = str(int(time.time()))
+        message = '\n'.join((method, urlsplit(path).path, digest, timestamp)).encode('utf8')
+        headers.update({
+            'X-Signature': sign(self._private_key, message),
+            'X-Timestamp': timestamp,
+            'X-Content-SHA256': digest,
+        })
+        return headers
+
+    def _session_headers(self) -> dict:
+        '''Authorization header of a session token, signing a request for a new one when it expires'''
+        with self._token_lock:
+            if self._token is None or time.time() > self._token_expiry - TOKEN_RENEWAL_MARGIN:
+                path = self._path('sessions')
+                with self._send('POST', path, headers=self._timestamped_headers('POST', path)) as response:
+                    content = json.loads(response.read())
+                if response.status >= 400:
+                    raise RegistryError(response.status, content.get('detail', ''))
+                self._token = content['data']['token']
+                self._token_expiry = datetime.fromisoformat(content['data']['expires_at']).timestamp()
+            return {'Authorization': f'Bearer {self._token}'}
+
+    def plugin(self, plugin_name: str, fields: Iterable[str] | None = None) -> dict:
+        fields = ','.join(fields) if fields is not None else None
+        return self.request('GET', self._path('plugins', plugin_name, fields=fields))['data']
+
+    def plugins(self, plugin_names: Iterable[str], fields: Iterable[str] | None = None) -> dict[str, dict | None]:
+        '''Fetches plugins concurrently, and returns them by name, unknown plugins being None'''
+        def fetch(plugin_name: str) -> dict | None:
+            try:
+                return self.plugin(plugin_name, fields)
+            except RegistryError as e:
+                if e.status != 404:
+                    raise
+                return None
+        plugin_names = list(plugin_names)
+        return dict(zip(plugin_names, self._executor.map(fetch, plugin_names)))
+
+    def versions(self, plugin_name: str, fields: Iterable[str] | None = None) -> list[dict]:
+        fields = ','.join(fields) if fields is not None else None
+        return self.request('GET', self._path('plugins', plugin_name, 'versions', fields=fields))['data']
+
+    def version(self, plugin_name: str, version: str = 'latest', fields: Iterable[str] | None = None) -> dict:
+        fields = ','.join(fields) if fields is not None else None
+        return self.request('GET', self._path('plugins', plugin_name, 'versions', version, fields=fields))['data']
+
+    def _cached(self, plugin_name: str, version: str) -> Path | None:
+        for path in (self.cache_dir / plugin_name / version).glob(f'*{TARBALL_SUFFIX}'):
+            return path
+        return None
+
+    def download(self, plugin_name: str, version: str) -> Path:
+        '''
+        Returns the path of the tarball of a version in the cache, downloading
+        it unless the cached one is still the published one.
+        '''
+        if version == 'latest':
+            version = self.version(plugin_name, fields=['version'])['version']
+        cached = self._cached(plugin_name, version)
+        headers = {}
+        if cached is not None:
+            headers['If-None-Match'] = f'"{cached.name.removesuffix(TARBALL_SUFFIX)}"'
+        version_dir = self.cache_dir / plugin_name / version
+        with self._send('GET', self._path('plugins', plugin_name, 'versions', version, 'download'), None, headers) \
+                as response:
+            if response.status == 304:
+                return cached
+            if response.status >= 400:
+                content = response.read()
+                raise RegistryError(response.status, json.loads(content).get('detail', '') if content else '')
+            version_dir.mkdir(parents=True, exist_ok=True)
+            staged = version_dir / f'.{uuid.uuid4().hex}.part'
+            digest = hashlib.sha256()
+            try:
+                with open(staged, 'wb') as fp:
+                    while chunk := response.read(CHUNK_SIZE):
+                        digest.update(chunk)
+                        fp.write(chunk)
+                etag = response.getheader('ETag')
+                if etag is not None and etag.strip('"') != digest.hexdigest():
+                    raise RegistryError(
+                        response.status, f'Tarball of {plugin_name} {version} does not match its digest.',
+                    )
+                path = version_dir / f'{digest.hexdigest()}{TARBALL_SUFFIX}'
+                os.replace(staged, path)
+            finally:
+                staged.unlink(missing_ok=True)
+        if cached is not None and cached != path:
+            cached.unlink(missing_ok=True)
+        return path
+
+    def download_many(self, versions: Iterable[tuple[str, str]]) -> dict[tuple[str, str], Path]:
+        '''Downloads tarballs in parallel, and returns their paths by (plugin name, version)'''
+        versions = list(versions)
+        return dict(zip(versions, self._executor.map(lambda args: self.download(*args), versions)))
+
+    def create_plugin(self, plugin_name: str, email: str | None = None) -> dict:
+        # Plugins are created with the public key of their first maintainer, rather than a session token
+        path = self._path('plugins')
+        headers = self._signed_headers(path)
+        if email is not None:
+            headers['X-Maintainer-Email'] = email
+        return self.request('POST', path, {'name': plugin_name}, headers)
+
+    def publish(self, plugin_name: str, version: str, tarball: Path) -> dict:
+        '''Publishes a version, and returns the warnings about its manifest'''
+        payload = {'tarball': b85encode(tarball.read_bytes()).decode('utf8')}
+        return self.request(
+            'POST', self._path('plugins', plugin_name, 'versions', version), payload, authenticated=True,
+        )
+
+    def delete_version(self, plugin_name: str, version: str):
+        self.request('DELETE', self._path('plugins', plugin_name, 'versions', version), authenticated=True)
@@ -0,0 +1,215 @@
+'''
+Transitive dependencies of the plugins.
+
+Versions declare the plugins they depend on in their manifest, which are
+stored in the version_dependencies table. A plugin depends on what its latest
+version depends on, and the transitive closure of these dependencies is
+precomputed in the plugin_closure table, with the depth at which each
+dependency is first reached. The closure of a version is then read with two
+indexed queries, rather than walked on each request.
+
+The closure is maintained in the transaction of the changes to the latest
+versions: the closures of the plugin whose latest version changed, and of
+the plugins depending on it, are recomputed. Publishing a version closing a
+dependency cycle is refused, but cycles may still appear when the latest
+version of a plugin is deleted, so walks never revisit a plugin.
+'''
+from collections import deque
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from cli_registry.models.dependency import PluginClosureOrm, VersionDependencyOrm
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+
+
+class DependencyError(Exception):
+    '''Raised when a version depends on unknown plugins, or on plugins depending on its own'''
+
+
+def direct_dependencies(db: Session, version_id: int) -> list[str]:
+    return sorted(
+        name for name, in
+        db.query(VersionDependencyOrm.dependency_name).filter(VersionDependencyOrm.version_id == version_id)
+    )
+
+
+def _latest_dates(db: Session):
+    '''Subquery of the upload date of the latest version of each plugin'''
+    return (
+        db
+        .query(PluginVersionOrm.plugin_id, func.max(PluginVersionOrm.upload_date).label('upload_date'))
+        .group_by(PluginVersionOrm.plugin_id)
+        .subquery()
+    )
+
+
+def _latest_dependencies(db: Session, names: set[str]) -> dict[str, list[str]]:
+    '''Returns the dependencies of the latest versions of the given plugins, in a single query'''
+    latest_dates = _latest_dates(db)
+    rows = (
+        db
+        .query(PluginOrm.name, VersionDependencyOrm.dependency_name)
+        .join(PluginVersionOrm, PluginVersionOrm.plugin_id == PluginOrm.id)
+        .join(latest_dates, (latest_dates.c.plugin_id == PluginOrm.id)
+              & (latest_dates.c.upload_date == PluginVersionOrm.upload_date))
+        .join(VersionDependencyOrm, VersionDependencyOrm.version_id == PluginVersionOrm.id)
+        .filter(PluginOrm.name.in_(names))
+        .order_by(PluginOrm.name, VersionDependencyOrm.dependency_name)
+    )
+    dependencies: dict[str, list[str]] = {name: [] for name in names}
+    for name, dependency in rows:
+        dependencies[name].append(dependency)
+    return dependencies
+
+
+def _closures(db: Session, names: set[str]) -> set[str]:
+    '''Returns the plugins in the closures of the given plugins'''
+    return {
+        name for name, in
+        db.query(PluginClosureOrm.dependency_name).filter(PluginClosureOrm.plugin_name.in_(names)).distinct()
+    }
+
+
+def _walk(plugin_name: str, graph: dict[str, list[str]]) -> dict[str, tuple[int, str]]:
+    '''
+    Breadth-first walk of the dependencies of a plugin in `graph`, returning
+    the depth of each of them and the plugin it was reached from.
+    '''
+    reached: dict[str, tuple[int, str]] = {}
+    queue = deque([(plugin_name, 0)])
+    while queue:
+        name, depth = queue.popleft()
+        for dependency in graph.get(name, []):
+            if dependency != plugin_name and dependency not in reached:
+                reached[dependency] = (depth + 1, name)
+                queue.append((dependency, depth + 1))
+    return reached
+
+
+def check(db: Session, plugin_name: str, dependencies: list[str]):
+    '''Raises DependencyError if a new version of the plugin cannot depend on `dependencies`'''
+    if not dependencies:
+        return
+    if plugin_name in dependencies:
+        raise DependencyError(f'Plugin {plugin_name} cannot depend on itself.')
+    known = {name for name, in db.query(PluginOrm.name).filter(PluginOrm.name.in_(dependencies))}
+    unknown = [name for name in dependencies if name not in known]
+    if unknown:
+        raise DependencyError(f'Unknown dependencies: {", ".join(unknown)}.')
+    cyclic = (
+        db
+        .query(PluginClosureOrm.plugin_name)
+        .filter(PluginClosureOrm.plugin_name.in_(dependencies), PluginClosureOrm.dependency_name == plugin_name)
+        .order_by(PluginClosureOrm.depth, PluginClosureOrm.plugin_name)
+        .first()
+    )
+    if cyclic is not None:
+        start = cyclic.plugin_name
+        reached = _walk(start, _latest_dependencies(db, {start} | _closures(db, {start})))
+        path = [plugin_name]
+        while path[0] != start:
+            path.insert(0, reached[path[0]][1])
+        raise DependencyError(f'Dependency cycle: {" -> ".join([plugin_name, *path])}.')
+
+
+def refresh(db: Session, plugin_name: str, dependencies: list[str] | None = None):
+    '''
+    Recomputes the closures of a plugin whose latest version changed, and of
+    the plugins depending on it, unless its direct dependencies are the same.
+    `dependencies` are those of its new latest version, if already known.
+
+    Only the dependencies of the plugin changed, so the plugins reachable
+    from the affected ones are in their previous closures, or in the ones of
+    the new dependencies. Their dependencies are loaded at once, and walked
+    in memory, so that the number of queries does not depend on the depth
+    or on the breadth of the graph.
+    '''
+    db.flush()
+    if dependencies is None:
+        dependencies = _latest_dependencies(db, {plugin_name})[plugin_name]
+    ancestors = (
+        db
+        .query(PluginClosureOrm.plugin_name)
+        .filter(PluginClosureOrm.dependency_name == plugin_name)
+        .scalar_subquery()
+    )
+    rows = (
+        db
+        .query(PluginClosureOrm)
+        .filter(or_(
+            PluginClosureOrm.plugin_name == plugin_name,
+            PluginClosureOrm.plugin_name.in_(ancestors),
+            PluginClosureOrm.plugin_name.in_(dependencies),
+        ))
+        .all()
+    )
+    previous = {row.dependency_name for row in rows if row.plugin_name == plugin_name and row.depth == 1}
+    if previous == set(dependencies):
+        return
+    affected = {plugin_name} | {row.plugin_name for row in rows if row.dependency_name == plugin_name}
+    reachable = {row.dependency_name for row in rows} | set(dependencies)
+    graph = _latest_dependencies(db, (affected | reachable) - {plugin_name})
+    graph[plugin_name] = dependencies
+    db.query(PluginClosureOrm).filter(PluginClosureOrm.plugin_name.in_(affected)).delete(synchronize_session=False)
+    db.add_all(
+        PluginClosureOrm(plugin_name=name, dependency_name=dependency, depth=depth)
+        for name in sorted(affected)
+        for dependency, (depth, _) in _walk(name, graph).items()
+    )
+
+
+def version_published(db: Session, version: PluginVersionOrm, dependencies: list[str]):
+    '''Stores the dependencies of a new version, which is the latest of its plugin'''
+    db.flush()
+    db.add_all(VersionDependencyOrm(version_id=version.id, dependency_name=name) for name in dependencies)
+    refresh(db, version.plugin.name, dependencies)
+
+
+def version_deleted(db: Session, version: PluginVersionOrm):
+    '''Removes the dependencies of a version deleted from the session, and not flushed yet'''
+    plugin_name = version.plugin.name
+    db.query(VersionDependencyOrm).filter(VersionDependencyOrm.version_id == version.id).delete()
+    refresh(db, plugin_name)
+
+
+def plugin_deleted(db: Session, plugin: PluginOrm):
+    '''Removes the dependencies of the versions of a plugin, before it is deleted'''
+    version_ids = db.query(PluginVersionOrm.id).filter(PluginVersionOrm.plugin_id == plugin.id)
+    db.query(VersionDependencyOrm).filter(
+        VersionDependencyOrm.version_id.in_(version_ids.scalar_subquery())
+    ).delete(synchronize_session=False)
+    refresh(db, plugin.name, [])
+
+
+def resolve(db: Session, version: PluginVersionOrm) -> list[dict]:
+    '''
+    Returns the transitive dependencies of a version, with their depth and
+    their latest version, which is None for plugins deleted since.
+    '''
+    plugin_name = version.plugin.name
+    depths = {name: 1 for name in direct_dependencies(db, version.id)}
+    for row in db.query(PluginClosureOrm).filter(PluginClosureOrm.plugin_name.in_(depths)):
+        depth = row.depth + 1
+        if depths.get(row.dependency_name, depth) >= depth:
+            depths[row.dependency_name] = depth
+    depths.pop(plugin_name, None)
+    latest_dates = _latest_dates(db)
+    latest: dict[str, PluginVersionOrm] = {
+        name: latest_version for name, latest_version in
+        db
+        .query(PluginOrm.name, PluginVersionOrm)
+        .join(PluginVersionOrm, PluginVersionOrm.plugin_id == PluginOrm.id)
+        .join(latest_dates, (latest_dates.c.plugin_id == PluginOrm.id)
+              & (latest_dates.c.upload_date == PluginVersionOrm.upload_date))
+        .filter(PluginOrm.name.in_(depths))
+    }
+    return [
+        {
+            'plugin_name': name,
+            'depth': depth,
+            'version': None if name not in latest else latest[name].version,
+            'digest': None if name not in latest else latest[name].digest,
+            'size': None if name not in latest else latest[name].size,
+        }
+        for name, depth in sorted(depths.items(), key=lambda item: (item[1], item[0]))
+    ]
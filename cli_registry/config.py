@@ -9,3 +9,105 @@ PORT = int(os.getenv('PORT', '8000'))
 HOST = os.getenv('HOST', '0.0.0.0')
 RUN_MIGRATIONS = os.getenv('RUN_MIGRATIONS', 'false') == 'true'
 ALEMBIC_INI_PATH = os.getenv('ALEMBIC_INI_PATH', './alembic.ini')
+
+# Resumable uploads: sessions expire after UPLOAD_EXPIRY seconds without
+# receiving a chunk, and are garbage collected every UPLOAD_GC_INTERVAL seconds.
+UPLOAD_EXPIRY = int(os.getenv('UPLOAD_EXPIRY', '86400'))
+UPLOAD_GC_INTERVAL = int(os.getenv('UPLOAD_GC_INTERVAL', '3600'))
+
+# Validation of the published tarballs, run in a pool of PROCESS_POOL_WORKERS
+# processes (defaults to the number of CPUs).
+PROCESS_POOL_WORKERS = int(os.getenv('PROCESS_POOL_WORKERS', '0')) or None
+MAX_UNCOMPRESSED_SIZE = int(os.getenv('MAX_UNCOMPRESSED_SIZE', str(1024 ** 3)))
+MAX_COMPRESSION_RATIO = int(os.getenv('MAX_COMPRESSION_RATIO', '100'))
+MAX_TARBALL_MEMBERS = int(os.getenv('MAX_TARBALL_MEMBERS', '10000'))
+# Maximum number of versions published by a single bulk request.
+BULK_MAX_VERSIONS = int(os.getenv('BULK_MAX_VERSIONS', '100'))
+# Publishes are committed in groups of up to WRITE_BATCH_SIZE, gathered for
+# WRITE_BATCH_WINDOW seconds after the first one.
+WRITE_BATCH_WINDOW = float(os.getenv('WRITE_BATCH_WINDOW', '0.002'))
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '100'))
+
+# Replica mode: when REPLICA_OF is set to the URL of a primary registry, this
+# registry is read-only and pulls the changes of the primary every
+# REPLICA_POLL_INTERVAL seconds.
+REPLICA_OF = os.getenv('REPLICA_OF', '').rstrip('/')
+REPLICA_POLL_INTERVAL = float(os.getenv('REPLICA_POLL_INTERVAL', '5'))
+REPLICA_BATCH_SIZE = int(os.getenv('REPLICA_BATCH_SIZE', '500'))
+
+# Profiling: requests carrying the PROFILE_SECRET in their X-Profile-Secret
+# header, or 1 in PROFILE_SAMPLE_RATE requests, are profiled by sampling their
+# stacks every PROFILE_INTERVAL seconds. Profiles are kept under PROFILES_PATH,
+# the oldest being removed beyond PROFILES_MAX.
+PROFILE_SECRET = os.getenv('PROFILE_SECRET', '')
+PROFILE_SAMPLE_RATE = int(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+PROFILES_PATH = Path(os.getenv('PROFILES_PATH', str(BASE_PATH / 'profiles'))).resolve()
+PROFILES_MAX = int(os.getenv('PROFILES_MAX', '1000'))
+# SQL statements running for longer than SLOW_QUERY_THRESHOLD milliseconds are
+# logged, 0 disables the slow query log.
+SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', '200'))
+
+# Authorized (plugin, key fingerprint) pairs are cached for AUTH_CACHE_TTL
+# seconds, up to AUTH_CACHE_SIZE pairs.
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '60'))
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+
+# Session tokens, exchanged for a signature on POST /v1/sessions. Set
+# SESSION_SECRET when running several workers or replicas, otherwise each
+# process generates its own and only accepts the tokens it issued.
+SESSION_SECRET = os.getenv('SESSION_SECRET', '')
+SESSION_TTL = int(os.getenv('SESSION_TTL', '900'))
+# Signatures of POST /v1/sessions and /v1/bulk/versions cover a timestamp,
+# and are rejected when it is more than SIGNATURE_MAX_AGE seconds off.
+SIGNATURE_MAX_AGE = int(os.getenv('SIGNATURE_MAX_AGE', '300'))
+
+# Download counters are flushed to the daily stats every STATS_FLUSH_INTERVAL
+# seconds. The POPULAR_SIZE most downloaded plugins over the last
+# POPULAR_WINDOW_DAYS days are ranked every POPULAR_REFRESH_INTERVAL seconds.
+STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', '10'))
+POPULAR_REFRESH_INTERVAL = float(os.getenv('POPULAR_REFRESH_INTERVAL', '300'))
+POPULAR_WINDOW_DAYS = int(os.getenv('POPULAR_WINDOW_DAYS', '30'))
+POPULAR_SIZE = int(os.getenv('POPULAR_SIZE', '100'))
+
+# The most requested tarballs are cached in memory, up to TARBALL_CACHE_SIZE
+# bytes (0 disables the cache). Tarballs larger than
+# TARBALL_CACHE_MMAP_THRESHOLD bytes are memory-mapped rather than read.
+TARBALL_CACHE_SIZE = int(os.getenv('TARBALL_CACHE_SIZE', str(256 * 1024 ** 2)))
+TARBALL_CACHE_MMAP_THRESHOLD = int(os.getenv('TARBALL_CACHE_MMAP_THRESHOLD', str(1024 ** 2)))
+
+# Server-sent events: the change log is polled every EVENTS_POLL_INTERVAL
+# seconds for the changes committed by other workers. Subscribers lagging
+# EVENTS_QUEUE_SIZE events behind are disconnected, as is every subscriber
+# after EVENTS_MAX_DURATION seconds, to resume with the Last-Event-ID header.
+# Idle streams send a comment every EVENTS_KEEPALIVE seconds.
+EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', '1'))
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '100'))
+EVENTS_KEEPALIVE = float(os.getenv('EVENTS_KEEPALIVE', '15'))
+EVENTS_MAX_DURATION = float(os.getenv('EVENTS_MAX_DURATION', '3600'))
+
+# Retention of the old versions, enforced every RETENTION_GC_INTERVAL seconds:
+# versions beyond the RETENTION_KEEP_VERSIONS last ones of their plugin and
+# older than RETENTION_KEEP_DAYS days are pruned, then the least recently
+# downloaded ones while the tarballs take more than DISK_QUOTA bytes. 0
+# disables a policy. Versions are deleted in batches of RETENTION_BATCH_SIZE,
+# RETENTION_BATCH_PAUSE seconds apart.
+RETENTION_KEEP_VERSIONS = int(os.getenv('RETENTION_KEEP_VERSIONS', '0'))
+RETENTION_KEEP_DAYS = int(os.getenv('RETENTION_KEEP_DAYS', '0'))
+DISK_QUOTA = int(os.getenv('DISK_QUOTA', '0'))
+RETENTION_GC_INTERVAL = float(os.getenv('RETENTION_GC_INTERVAL', '3600'))
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '100'))
+RETENTION_BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', '1'))
+
+# Binary deltas from the previous version are computed after each publish,
+# for tarballs up to DELTA_MAX_SIZE bytes uncompressed (0 disables them), and
+# kept when smaller than DELTA_MAX_RATIO times the tarball.
+DELTA_MAX_SIZE = int(os.getenv('DELTA_MAX_SIZE', str(64 * 1024 ** 2)))
+DELTA_MAX_RATIO = float(os.getenv('DELTA_MAX_RATIO', '0.5'))
+
+# The integrity scrubber checks the tarballs of SCRUB_BATCH_SIZE versions every
+# SCRUB_INTERVAL seconds against their recorded size and digest, reading at most
+# SCRUB_RATE bytes per second (0 disables it).
+SCRUB_INTERVAL = float(os.getenv('SCRUB_INTERVAL', '10'))
+SCRUB_BATCH_SIZE = int(os.getenv('SCRUB_BATCH_SIZE', '100'))
+SCRUB_RATE = int(os.getenv('SCRUB_RATE', str(8 * 1024 ** 2)))
@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -10,3 +11,28 @@ engine = create_engine(
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+
+def create_writer_engine(url: str) -> Engine:
+    '''
+    Creates an engine whose transactions begin with BEGIN IMMEDIATE. pysqlite
+    only begins one before the first DML statement, and SQLite commits a
+    savepoint released outside of a transaction, so savepoints would not nest
+    in the transaction otherwise.
+    '''
+    writer_engine = create_engine(url, connect_args={"check_same_thread": False})
+
+    @event.listens_for(writer_engine, 'connect')
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(writer_engine, 'begin')
+    def begin_immediate(connection):
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+    return writer_engine
+
+
+WriterSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=create_writer_engine(SQLALCHEMY_DATABASE_URL),
+)
@@ -0,0 +1,247 @@
+'''
+Binary deltas between consecutive versions of a plugin.
+
+Once a version is published, the delta from the previous version of its
+plugin is computed in the process pool, and stored next to the tarballs.
+`GET .../download?from=<version>` serves it instead of the tarball when it
+exists.
+
+Tarballs are compressed, so a change to a file changes most of the bytes
+following it in the tarball. Deltas are thus computed between the
+uncompressed tar archives, whose members are aligned on 512 bytes blocks:
+the blocks of the new archive found in the previous one are copied from it,
+the others are inserted. Clients decompress the tarball they have, apply
+the delta, and check the digest of the archive they get against the one
+stored in the delta, before compressing it again if they keep tarballs.
+
+A delta is a gzip stream of:
+- MAGIC,
+- a header, as the 4 bytes length of a JSON object holding the digest of
+  the source tarball and the sha256 digests of both uncompressed archives,
+- operations: `C` with an offset and a length of 8 bytes each, copying from
+  the source archive, or `I` with a length of 4 bytes followed by as many
+  bytes to insert, and a final `E`.
+
+Deltas are not kept for archives larger than DELTA_MAX_SIZE bytes, nor when
+they are larger than DELTA_MAX_RATIO times the tarball.
+'''
+from glob import escape
+import gzip
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import struct
+from typing import Callable
+import uuid
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from cli_registry.config import DELTA_MAX_RATIO, DELTA_MAX_SIZE
+from cli_registry.db import SessionLocal
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+from cli_registry.utils import file_digest
+from cli_registry import storage, workers
+
+
+logger = logging.getLogger('cli_registry')
+
+MAGIC = b'CLIDELTA\x01'
+MEDIA_TYPE = 'application/vnd.cli-registry.delta'
+BLOCK_SIZE = 512
+_COPY = struct.Struct('>QQ')
+_LENGTH = struct.Struct('>I')
+
+session_factory: Callable[[], Session] = SessionLocal
+
+
+class DeltaError(Exception):
+    '''Raised when a delta is malformed, or does not apply to an archive'''
+
+
+def _read_archive(path: Path, max_size: int) -> bytes | None:
+    '''Returns the uncompressed archive of a tarball, or None if larger than `max_size`'''
+    with gzip.open(path, 'rb') as f:
+        archive = f.read(max_size + 1)
+    return None if len(archive) > max_size else archive
+
+
+def diff(source: bytes, target: bytes) -> list[tuple[str, int, int] | tuple[str, bytes]]:
+    '''Returns the operations building the archive `target` from the archive `source`'''
+    index: dict[bytes, int] = {}
+    for offset in range(0, len(source) - BLOCK_SIZE + 1, BLOCK_SIZE):
+        index.setdefault(source[offset:offset + BLOCK_SIZE], offset)
+    operations = []
+    copy_start = copy_end = None
+    inserted = bytearray()
+    for offset in range(0, len(target), BLOCK_SIZE):
+        block = target[offset:offset + BLOCK_SIZE]
+        # Extending the current copy is preferred to jumping to another match
+        if copy_end is not None and source[copy_end:copy_end + len(block)] == block:
+            copy_end += len(block)
+            continue
+        match = index.get(block)
+        if copy_end is not None:
+            operations.append(('C', copy_start, copy_end - copy_start))
+            copy_start = copy_end = None
+        if match is None:
+            inserted += block
+            continue
+        if inserted:
+            operations.append(('I', bytes(inserted)))
+            inserted.clear()
+        copy_start, copy_end = match, match + len(block)
+    if copy_end is not None:
+        operations.append(('C', copy_start, copy_end - copy_start))
+    if inserted:
+        operations.append(('I', bytes(inserted)))
+    return operations
+
+
+def compute(
+    source_path: str, target_path: str, delta_path: str,
+    max_size: int = DELTA_MAX_SIZE, max_ratio: float = DELTA_MAX_RATIO,
+) -> int | None:
+    '''
+    Computes the delta between two tarballs, and stores it at `delta_path`.
+    Returns its size, or None if it is not worth keeping. Run in the process pool.
+    '''
+    source = _read_archive(Path(source_path), max_size)
+    target = _read_archive(Path(target_path), max_size)
+    if source is None or target is None:
+        return None
+    header = json.dumps({
+        'source': file_digest(Path(source_path))[1],
+        'source_content': hashlib.sha256(source).hexdigest(),
+        'target_content': hashlib.sha256(target).hexdigest(),
+    }).encode('utf8')
+    # Staged next to the delta, as the settings of the parent process may differ from the ones of the pool
+    staged = Path(f'{delta_path}.{uuid.uuid4().hex}.part')
+    staged.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with gzip.open(staged, 'wb') as f:
+            f.write(MAGIC + _LENGTH.pack(len(header)) + header)
+            for operation in diff(source, target):
+                if operation[0] == 'C':
+                    f.write(b'C' + _COPY.pack(*operation[1:]))
+                else:
+                    f.write(b'I' + _LENGTH.pack(len(operation[1])) + operation[1])
+            f.write(b'E')
+        size = os.path.getsize(staged)
+        if size > os.path.getsize(target_path) * max_ratio:
+            return None
+        os.replace(staged, delta_path)
+    finally:
+        staged.unlink(missing_ok=True)
+    return size
+
+
+def read_header(delta: bytes) -> tuple[dict, int]:
+    '''Returns the header of an uncompressed delta, and the offset of its operations'''
+    if not delta.startswith(MAGIC):
+        raise DeltaError('Not a delta.')
+    start = len(MAGIC) + _LENGTH.size
+    (length,) = _LENGTH.unpack_from(delta, len(MAGIC))
+    return json.loads(delta[start:start + length]), start + length
+
+
+def apply(source: bytes, delta: bytes) -> bytes:
+    '''
+    Applies a delta, as downloaded, to the uncompressed archive it was
+    computed from, and returns the uncompressed archive of the new version.
+    '''
+    delta = gzip.decompress(delta)
+    header, offset = read_header(delta)
+    if hashlib.sha256(source).hexdigest() != header['source_content']:
+        raise DeltaError('Delta was not computed from this archive.')
+    target = bytearray()
+    while True:
+        operation = delta[offset:offset + 1]
+        offset += 1
+        if operation == b'C':
+            start, length = _COPY.unpack_from(delta, offset)
+            offset += _COPY.size
+            target += source[start:start + length]
+        elif operation == b'I':
+            (length,) = _LENGTH.unpack_from(delta, offset)
+            offset += _LENGTH.size
+            target += delta[offset:offset + length]
+            offset += length
+        elif operation == b'E':
+            break
+        else:
+            raise DeltaError('Delta is truncated or malformed.')
+    if hashlib.sha256(target).hexdigest() != header['target_content']:
+        raise DeltaError('Patched archive does not match the digest of the delta.')
+    return bytes(target)
+
+
+def delta_path(plugin_name: str, source: str, target: str) -> Path:
+    source, target = storage.check_segment(source), storage.check_segment(target)
+    return storage.plugin_dir(plugin_name) / f'deltas/{source}/{target}.delta'
+
+
+def _previous_versions(db: Session, version_ids: list[int]) -> list[tuple[str, str, str]]:
+    '''Returns the plugin name, the previous version and the version, for those of `version_ids` having one'''
+    plugin_ids = db.query(PluginVersionOrm.plugin_id).filter(PluginVersionOrm.id.in_(version_ids))
+    ranked = (
+        db
+        .query(
+            PluginVersionOrm.id, PluginVersionOrm.plugin_id, PluginVersionOrm.version,
+            func.lag(PluginVersionOrm.version).over(
+                partition_by=PluginVersionOrm.plugin_id, order_by=PluginVersionOrm.upload_date,
+            ).label('previous'),
+        )
+        .filter(PluginVersionOrm.plugin_id.in_(plugin_ids.scalar_subquery()))
+        .subquery()
+    )
+    return (
+        db
+        .query(PluginOrm.name, ranked.c.previous, ranked.c.version)
+        .join(ranked, ranked.c.plugin_id == PluginOrm.id)
+        .filter(ranked.c.id.in_(version_ids), ranked.c.previous.isnot(None))
+        .all()
+    )
+
+
+def _read(func: Callable, *args):
+    db = session_factory()
+    try:
+        return func(db, *args)
+    finally:
+        db.close()
+
+
+async def build(version_ids: list[int]):
+    '''Computes the deltas from the previous versions to newly published ones, run after the response'''
+    if not DELTA_MAX_SIZE:
+        return
+    try:
+        pairs = await run_in_threadpool(_read, _previous_versions, version_ids)
+        for plugin_name, previous, version in pairs:
+            size = await workers.run_in_process(
+                compute,
+                str(storage.resolve_tarball(plugin_name, previous)),
+                str(storage.resolve_tarball(plugin_name, version)),
+                str(delta_path(plugin_name, previous, version)),
+                DELTA_MAX_SIZE, DELTA_MAX_RATIO,
+            )
+            logger.debug('Delta of %s from %s to %s: %s bytes.', plugin_name, previous, version, size)
+    except Exception:
+        logger.exception('Could not compute the deltas of versions %s.', version_ids)
+
+
+def discard(plugin_name: str, version: str):
+    '''Removes the deltas from and to a deleted version'''
+    deltas_dir = storage.plugin_dir(plugin_name) / 'deltas'
+    shutil.rmtree(deltas_dir / storage.check_segment(version), ignore_errors=True)
+    for path in deltas_dir.glob(f'*/{escape(version)}.delta'):
+        path.unlink(missing_ok=True)
+
+
+def discard_plugin(plugin_name: str):
+    shutil.rmtree(storage.plugin_dir(plugin_name) / 'deltas', ignore_errors=True)
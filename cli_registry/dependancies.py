@@ -1,11 +1,19 @@
+from dataclasses import dataclass
+from datetime import datetime
+import hashlib
 from http import HTTPStatus
+import time
 
-from fastapi import Depends, Path, HTTPException, Request, Header
-from sqlalchemy.orm import Session
+from fastapi import Depends, Path, HTTPException, Query, Request, Header
+from sqlalchemy.orm import Session, load_only
 
+from cli_registry.config import SIGNATURE_MAX_AGE
 from cli_registry.db import SessionLocal
-from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
-from cli_registry.utils import check_auth
+from cli_registry.models.catalog import CatalogEntryOrm
+from cli_registry.models.plugin import PLUGIN_FIELDS, VERSION_FIELDS, PluginOrm, PluginVersionOrm
+from cli_registry.models.upload import UploadOrm
+from cli_registry.utils import check_auth, key_fingerprint, request_message
+from cli_registry import permissions, profiling, sessions
 
 
 def db() -> Session:
@@ -34,50 +42,305 @@ def plugin(
     return plugin
 
 
+@dataclass
+class VersionFields:
+    fields: tuple[str, ...] = VERSION_FIELDS
+    # Whether the base85 encoded tarball is embedded
+    file: bool = False
+
+
+def _parse_fields(fields: str | None, allowed: tuple[str, ...]) -> tuple[str, ...]:
+    if fields is None:
+        return allowed
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if not names or unknown:
+        raise HTTPException(
+            HTTPStatus.UNPROCESSABLE_ENTITY,
+            f'Fields {", ".join(unknown) or "(none)"} are not valid, fields are {", ".join(allowed)}.'
+        )
+    return names
+
+
+def plugin_fields(fields: str | None = Query(default=None)) -> tuple[str, ...]:
+    '''Fields of the plugins to return, from a comma separated list'''
+    return _parse_fields(fields, PLUGIN_FIELDS)
+
+
+def version_fields(
+    fields: str | None = Query(default=None),
+    include: str | None = Query(default=None),
+) -> VersionFields:
+    '''Fields of the versions to return, and whether to embed their tarball with include=file'''
+    included = {name.strip() for name in include.split(',')} if include else set()
+    if included - {'file'}:
+        raise HTTPException(
+            HTTPStatus.UNPROCESSABLE_ENTITY,
+            f'Cannot include {", ".join(sorted(included - {"file"}))}, only file can be included.'
+        )
+    return VersionFields(_parse_fields(fields, VERSION_FIELDS), 'file' in included)
+
+
+def _catalog_entry(db: Session, plugin_name: str, *options) -> CatalogEntryOrm:
+    entry: CatalogEntryOrm | None = (
+        db
+        .query(CatalogEntryOrm)
+        .options(*options)
+        .filter(CatalogEntryOrm.name == plugin_name)
+        .first()
+    )
+    if entry is None:
+        raise HTTPException(
+            HTTPStatus.NOT_FOUND,
+            f'Plugin {plugin_name} not found.'
+        )
+    return entry
+
+
+def catalog_plugin(
+    plugin_name: str = Path(),
+    db: Session = Depends(db),
+    fields: tuple[str, ...] = Depends(plugin_fields),
+) -> CatalogEntryOrm:
+    '''Catalog entry of a plugin, loading only the columns of the requested fields'''
+    return _catalog_entry(db, plugin_name, CatalogEntryOrm.load_fields(fields))
+
+
+def catalog_versions(plugin_name: str = Path(), db: Session = Depends(db)) -> CatalogEntryOrm:
+    '''Catalog entry of a plugin, loading only its versions'''
+    return _catalog_entry(
+        db, plugin_name, load_only(CatalogEntryOrm.plugin_id, CatalogEntryOrm.name, CatalogEntryOrm.versions),
+    )
+
+
+def _version(db: Session, plugin: PluginOrm, version: str, fields: VersionFields | None = None) -> PluginVersionOrm:
+    query = db.query(PluginVersionOrm)
+    if fields is not None:
+        query = query.options(PluginVersionOrm.load_fields(fields.fields))
+    version_db: PluginVersionOrm | None = (
+        query
+        .filter(PluginVersionOrm.plugin_id == plugin.id, PluginVersionOrm.version == version)
+        .first()
+    )
+    if version_db is None:
+        raise HTTPException(
+            HTTPStatus.NOT_FOUND,
+            f'Version {version} not found for plugin {plugin.name}.'
+        )
+    return version_db
+
+
 def plugin_version(
     version: str = Path(),
     db: Session = Depends(db),
     plugin: PluginOrm = Depends(plugin),
 ):
+    return _version(db, plugin, version)
+
+
+def plugin_version_fields(
+    version: str = Path(),
+    db: Session = Depends(db),
+    plugin: PluginOrm = Depends(plugin),
+    fields: VersionFields = Depends(version_fields),
+) -> PluginVersionOrm:
+    '''Version of a plugin, loading only the columns of the requested fields'''
+    return _version(db, plugin, version, fields)
+
+
+def latest_plugin_version(
+    db: Session = Depends(db),
+    plugin: PluginOrm = Depends(plugin),
+    fields: VersionFields = Depends(version_fields),
+) -> PluginVersionOrm:
+    '''Latest version of a plugin, loading only the columns of the requested fields'''
     version_db: PluginVersionOrm | None = (
         db
         .query(PluginVersionOrm)
-        .filter(PluginVersionOrm.plugin_id == plugin.id, PluginVersionOrm.version == version)
+        .options(PluginVersionOrm.load_fields(fields.fields))
+        .filter(PluginVersionOrm.plugin_id == plugin.id)
+        .order_by(PluginVersionOrm.upload_date.desc())
         .first()
     )
     if version_db is None:
         raise HTTPException(
             HTTPStatus.NOT_FOUND,
-            f'Version {version} not found for plugin {plugin.name}.'
+            f'No version published for plugin {plugin.name}.'
         )
     return version_db
 
 
-def authentication(
-    request: Request,
+def upload(
+    upload_id: str = Path(),
+    db: Session = Depends(db),
     plugin: PluginOrm = Depends(plugin),
+) -> UploadOrm:
+    upload_db: UploadOrm | None = (
+        db
+        .query(UploadOrm)
+        .filter(UploadOrm.id == upload_id, UploadOrm.plugin_id == plugin.id)
+        .first()
+    )
+    if upload_db is None:
+        raise HTTPException(
+            HTTPStatus.NOT_FOUND,
+            f'Upload {upload_id} not found for plugin {plugin.name}.'
+        )
+    # Until the expired uploads are collected
+    if upload_db.expires_at < datetime.now():
+        raise HTTPException(
+            HTTPStatus.GONE,
+            f'Upload {upload_id} expired.'
+        )
+    return upload_db
+
+
+def _verify_signature(request: Request, authorization: str, x_signature: str | None):
+    if x_signature is None:
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            'X-Signature header not set.'
+        )
+    message = request.url.path.encode('utf8')
+    if not check_auth(message, authorization, x_signature):
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            f'Signature {x_signature} is not valid for public key {authorization}',
+        )
+
+
+def _verify_request_signature(
+    request: Request, authorization: str, x_signature: str | None,
+    x_timestamp: str | None, x_content_sha256: str | None,
+):
+    '''
+    Verifies the signature of the method, path, body digest and timestamp of
+    the request, rejecting timestamps more than SIGNATURE_MAX_AGE seconds off.
+    The body is checked against X-Content-SHA256 by the caller.
+    '''
+    if x_signature is None or x_timestamp is None or x_content_sha256 is None:
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            'X-Signature, X-Timestamp and X-Content-SHA256 headers must be set.'
+        )
+    try:
+        timestamp = int(x_timestamp)
+    except ValueError:
+        timestamp = None
+    if timestamp is None or abs(time.time() - timestamp) > SIGNATURE_MAX_AGE:
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            f'X-Timestamp {x_timestamp} is not valid or too far from the server time.'
+        )
+    message = request_message(request.method, request.url.path, x_content_sha256, x_timestamp)
+    if not check_auth(message, authorization, x_signature):
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            f'Signature {x_signature} is not valid for public key {authorization}',
+        )
+
+
+def _verify_session(token: str) -> dict:
+    session = sessions.verify(token)
+    if session is None:
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            'Session token is not valid or expired.'
+        )
+    return session
+
+
+async def signature(
+    request: Request,
     authorization: str | None = Header(default=None),
     x_signature: str | None = Header(default=None),
-):
+    x_timestamp: str | None = Header(default=None),
+    x_content_sha256: str | None = Header(default=None),
+) -> str:
+    '''
+    Verifies the SSH signature of the request and of its body, and returns the
+    fingerprint of the key.
+    '''
     if authorization is None:
         raise HTTPException(
             HTTPStatus.FORBIDDEN,
             'Authorization header not set.'
         )
-    if x_signature is None:
+    _verify_request_signature(request, authorization, x_signature, x_timestamp, x_content_sha256)
+    if hashlib.sha256(await request.body()).hexdigest() != x_content_sha256.lower():
         raise HTTPException(
             HTTPStatus.FORBIDDEN,
-            'X-Signature header not set.'
+            'Request body does not match X-Content-SHA256.'
+        )
+    return key_fingerprint(authorization)
+
+
+def credentials(
+    request: Request,
+    authorization: str | None = Header(default=None),
+    x_signature: str | None = Header(default=None),
+    x_timestamp: str | None = Header(default=None),
+    x_content_sha256: str | None = Header(default=None),
+) -> dict:
+    '''
+    Verifies the session token or the SSH signature of the request, and
+    returns the fingerprint of the key along with the plugins it is scoped to,
+    in the format of a session token. A signed request also returns the
+    digest of its body under `sha256`, for the route to check as it reads it.
+    '''
+    if authorization is None:
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            'Authorization header not set.'
+        )
+    token = authorization.removeprefix(sessions.BEARER_PREFIX)
+    if token != authorization:
+        return _verify_session(token)
+    _verify_request_signature(request, authorization, x_signature, x_timestamp, x_content_sha256)
+    return {'fp': key_fingerprint(authorization), 'plugins': None, 'sha256': x_content_sha256.lower()}
+
+
+def authentication(
+    request: Request,
+    db: Session = Depends(db),
+    plugin: PluginOrm = Depends(plugin),
+    authorization: str | None = Header(default=None),
+    x_signature: str | None = Header(default=None),
+):
+    if authorization is None:
+        raise HTTPException(
+            HTTPStatus.FORBIDDEN,
+            'Authorization header not set.'
         )
-    maintainers = [m.ssh_key for m in plugin.maintainers]
-    if authorization not in maintainers:
+    token = authorization.removeprefix(sessions.BEARER_PREFIX)
+    if token != authorization:
+        session = _verify_session(token)
+        if not sessions.allows(session, plugin.name):
+            raise HTTPException(
+                HTTPStatus.FORBIDDEN,
+                f'Session token is not valid for plugin {plugin.name}.'
+            )
+        fingerprint = session['fp']
+    else:
+        if x_signature is None:
+            raise HTTPException(
+                HTTPStatus.FORBIDDEN,
+                'X-Signature header not set.'
+            )
+        fingerprint = key_fingerprint(authorization)
+    if not permissions.is_maintainer(db, plugin.id, fingerprint):
         raise HTTPException(
             HTTPStatus.FORBIDDEN,
             'Key not in maintainers whitelist.'
         )
-    message = request.url.path.encode('utf8')
-    if not check_auth(message, authorization, x_signature):
+    if token == authorization:
+        # Verified last, as it is the most expensive check
+        _verify_signature(request, authorization, x_signature)
+
+
+def operator(x_profile_secret: str | None = Header(default=None)):
+    if not profiling.is_authorized(x_profile_secret):
         raise HTTPException(
             HTTPStatus.FORBIDDEN,
-            f'Signature {x_signature} is not valid for public key {authorization}',
+            'X-Profile-Secret header not set or not valid.'
         )
@@ -0,0 +1,188 @@
+'''
+Server-sent events of the changes to the registry, streamed on `/v1/events`.
+
+Events are the entries of the change log, and their ids are the ids of the
+changes. A hub thread tails the change log and fans the new entries out to
+the subscribers of the worker. It is woken up by the write routes as soon as
+they commit, and polls every EVENTS_POLL_INTERVAL seconds for the changes
+committed by the other workers, or pulled from the primary by a replica.
+
+Each subscriber has a queue of EVENTS_QUEUE_SIZE events. A subscriber too slow
+to keep up is disconnected when its queue is full, and resumes from the last
+event it received by sending its id in the Last-Event-ID header, as
+EventSource clients do when they reconnect. Those events are then replayed
+from the change log.
+'''
+import asyncio
+from dataclasses import dataclass, field
+import json
+import logging
+import threading
+import time
+from typing import AsyncIterator, Callable
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from cli_registry.config import (
+    EVENTS_KEEPALIVE, EVENTS_MAX_DURATION, EVENTS_POLL_INTERVAL, EVENTS_QUEUE_SIZE, REPLICA_BATCH_SIZE,
+)
+from cli_registry.db import SessionLocal
+from cli_registry import changes
+
+
+logger = logging.getLogger('cli_registry')
+
+ACTIONS = (changes.PLUGIN_CREATED, changes.PLUGIN_DELETED, changes.VERSION_PUBLISHED, changes.VERSION_DELETED)
+
+session_factory: Callable[[], Session] = SessionLocal
+
+
+@dataclass(eq=False)
+class Subscriber:
+    plugins: set[str] | None
+    loop: asyncio.AbstractEventLoop
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(EVENTS_QUEUE_SIZE))
+    overflowed: bool = False
+
+    def wants(self, event: dict) -> bool:
+        return self.plugins is None or event['plugin_name'] in self.plugins
+
+    def offer(self, event: dict):
+        '''Queues an event, from the event loop of the subscriber'''
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+def _read(func: Callable, *args):
+    db = session_factory()
+    try:
+        return func(db, *args)
+    finally:
+        db.close()
+
+
+def _fetch(db: Session, since: int, limit: int = REPLICA_BATCH_SIZE) -> list[dict]:
+    '''Returns the changes following the change `since`, as dicts'''
+    return [change.dict() for change in changes.since(db, since, limit)]
+
+
+class Hub:
+    '''Thread tailing the change log, and fanning new changes out to the subscribers'''
+    def __init__(self):
+        self._subscribers: set[Subscriber] = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._last_id = 0
+
+    def subscribe(self, subscriber: Subscriber, head: int):
+        '''Adds a subscriber, `head` being the id of the last change it will replay itself'''
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._last_id = head
+                # Changes notified before are replayed by the subscriber
+                self._wakeup.clear()
+                self._thread = threading.Thread(target=self._run, name='events', daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+        if not self._subscribers:
+            self._wakeup.set()
+
+    def notify(self):
+        '''Wakes the hub up, after a change was committed'''
+        self._wakeup.set()
+
+    def _dispatch(self, events: list[dict]):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            wanted = [event for event in events if event['action'] in ACTIONS and subscriber.wants(event)]
+            for event in wanted:
+                try:
+                    subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+                except RuntimeError:
+                    # The event loop of the subscriber was closed
+                    self.unsubscribe(subscriber)
+                    break
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(EVENTS_POLL_INTERVAL)
+            self._wakeup.clear()
+            with self._lock:
+                if not self._subscribers:
+                    # Started again by the next subscriber
+                    self._thread = None
+                    return
+            try:
+                while events := _read(_fetch, self._last_id):
+                    self._dispatch(events)
+                    self._last_id = events[-1]['id']
+            except Exception:
+                logger.exception('Could not read the change log for the events.')
+
+    def stop(self):
+        with self._lock:
+            self._subscribers.clear()
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+
+
+hub = Hub()
+
+
+def notify():
+    hub.notify()
+
+
+def format_event(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['action']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def stream(plugins: list[str] | None, last_event_id: int | None) -> AsyncIterator[str]:
+    '''
+    Yields the events following `last_event_id` (or the ones to come, if it
+    is None), about the given plugins (or about all of them), for at most
+    EVENTS_MAX_DURATION seconds.
+    '''
+    deadline = time.monotonic() + EVENTS_MAX_DURATION
+    head = await run_in_threadpool(_read, changes.last_id)
+    last = head if last_event_id is None else last_event_id
+    subscriber = Subscriber(set(plugins) if plugins else None, asyncio.get_running_loop())
+    # Subscribed before replaying, so that no change falls between the two
+    hub.subscribe(subscriber, head)
+    try:
+        while events := await run_in_threadpool(_read, _fetch, last):
+            for event in events:
+                if event['action'] in ACTIONS and subscriber.wants(event):
+                    yield format_event(event)
+            last = events[-1]['id']
+        while (timeout := deadline - time.monotonic()) > 0:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), min(timeout, EVENTS_KEEPALIVE))
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if subscriber.overflowed:
+                logger.info('Disconnected a subscriber to the events lagging behind.')
+                return
+            if event['id'] > last:
+                yield format_event(event)
+                last = event['id']
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+def shutdown():
+    hub.stop()
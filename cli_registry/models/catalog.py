@@ -0,0 +1,41 @@
+from typing import Collection
+
+from sqlalchemy import JSON, Column, Integer, String
+from sqlalchemy.orm import load_only
+
+from cli_registry.db import Base
+from cli_registry.models.plugin import PLUGIN_FIELDS
+
+
+class CatalogEntryOrm(Base):
+    '''
+    Denormalized plugin, with its derived fields and versions, as read by the
+    catalog routes. Maintained by `catalog` in the transactions writing the
+    plugins, their versions and their maintainers.
+    '''
+    __tablename__ = 'catalog'
+    plugin_id = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False, unique=True)
+    latest_version = Column(String(20), nullable=True)
+    version_count = Column(Integer, nullable=False, default=0)
+    maintainers = Column(JSON, nullable=False, default=list)
+    # Versions as returned by the version routes, in id order
+    versions = Column(JSON, nullable=False, default=list)
+
+    def dict(self, fields: Collection[str] = PLUGIN_FIELDS):
+        data = {}
+        if 'id' in fields:
+            data['id'] = self.plugin_id
+        for field in ('name', 'latest_version', 'version_count', 'maintainers'):
+            if field in fields:
+                data[field] = getattr(self, field)
+        return data
+
+    @staticmethod
+    def load_fields(fields: Collection[str]):
+        '''Returns the option loading only the columns of the given plugin fields'''
+        columns = {'id': CatalogEntryOrm.plugin_id, 'name': CatalogEntryOrm.name}
+        columns.update(
+            (field, getattr(CatalogEntryOrm, field)) for field in ('latest_version', 'version_count', 'maintainers')
+        )
+        return load_only(CatalogEntryOrm.plugin_id, *(columns[field] for field in fields))
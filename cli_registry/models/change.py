@@ -0,0 +1,30 @@
+import json
+
+from sqlalchemy import Column, Integer, String, DateTime, Text
+
+from cli_registry.db import Base
+
+
+class ChangeOrm(Base):
+    '''
+    Append-only log of the changes made to the registry, in commit order.
+    Replicas follow it to apply the same changes to their own database.
+    '''
+    __tablename__ = 'changes'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, nullable=False)
+    action = Column(String(32), nullable=False)
+    plugin_name = Column(String(255), nullable=False, index=True)
+    version = Column(String(20), nullable=True)
+    data = Column(Text, nullable=False, default='{}')
+
+    def dict(self):
+        return {
+            'id': self.id,
+            'created_at': self.created_at.isoformat(),
+            'action': self.action,
+            'plugin_name': self.plugin_name,
+            'version': self.version,
+            'data': json.loads(self.data),
+        }
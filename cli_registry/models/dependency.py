@@ -0,0 +1,21 @@
+from sqlalchemy import Column, ForeignKey, Integer, String
+
+from cli_registry.db import Base
+
+
+class VersionDependencyOrm(Base):
+    '''Plugin that a version of another plugin depends on, as declared in its manifest'''
+    __tablename__ = 'version_dependencies'
+    version_id = Column(Integer, ForeignKey('versions.id'), primary_key=True)
+    dependency_name = Column(String(255), primary_key=True, index=True)
+
+
+class PluginClosureOrm(Base):
+    '''
+    Transitive dependency of a plugin, through the latest versions of the
+    plugins along the way, at the given depth. Maintained by `closure`.
+    '''
+    __tablename__ = 'plugin_closure'
+    plugin_name = Column(String(255), primary_key=True)
+    dependency_name = Column(String(255), primary_key=True, index=True)
+    depth = Column(Integer, nullable=False)
@@ -3,6 +3,7 @@ from sqlalchemy import Column, ForeignKey, Integer, String, Table
 from sqlalchemy.orm import relationship
 
 from cli_registry.db import Base
+from cli_registry.utils import key_fingerprint
 
 
 association_table = Table(
@@ -18,6 +19,10 @@ class MaintainerOrm(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     email = Column(String(255), nullable=True)
     ssh_key = Column(String(400), nullable=False)
+    fingerprint = Column(
+        String(64), nullable=False, index=True,
+        default=lambda context: key_fingerprint(context.get_current_parameters()['ssh_key']),
+    )
 
     plugins = relationship(
         'PluginOrm', secondary=association_table, back_populates='maintainers'
@@ -1,18 +1,25 @@
 from pathlib import Path
-from typing import Optional
+from typing import Collection, Optional
 
-from pydantic import BaseModel, constr
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
-from sqlalchemy.orm import relationship
+from pydantic import BaseModel, constr, validator
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, UniqueConstraint
+from sqlalchemy.orm import load_only, relationship
 
 from cli_registry.db import Base
-from cli_registry.config import BASE_PATH
 from cli_registry.models.maintainer import association_table
-from cli_registry.utils import encode_file
+from cli_registry import tarball_cache
+from cli_registry import storage
+
+
+# Fields of the plugins and of the versions, as returned by the routes, which
+# may be narrowed with their `fields` query parameter
+PLUGIN_FIELDS = ('id', 'name', 'latest_version', 'version_count', 'maintainers')
+VERSION_FIELDS = ('id', 'plugin_id', 'upload_date', 'version', 'size', 'digest', 'module', 'description')
 
 
 class PluginOrm(Base):
     __tablename__ = 'plugins'
+    __table_args__ = (UniqueConstraint('name', name='uq_plugins_name'),)
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(255), nullable=False)
     versions = relationship('PluginVersionOrm', back_populates='plugin')
@@ -29,24 +36,33 @@ class PluginOrm(Base):
             break
         return latest_version
 
-    def dict(self):
-        if self.latest_version is None:
-            latest = None
-        else:
-            latest = self.latest_version.version
-        return {
-            'id': self.id,
-            'name': self.name,
-            'latest_version': latest,
-            'maintainers': [m.email for m in self.maintainers if m is not None],
-        }
+    def dict(self, fields: Collection[str] = PLUGIN_FIELDS):
+        '''Returns the given fields of the plugin, only loading the versions and maintainers if requested'''
+        data = {}
+        if 'id' in fields:
+            data['id'] = self.id
+        if 'name' in fields:
+            data['name'] = self.name
+        if 'latest_version' in fields:
+            data['latest_version'] = None if self.latest_version is None else self.latest_version.version
+        if 'version_count' in fields:
+            data['version_count'] = len(self.versions)
+        if 'maintainers' in fields:
+            data['maintainers'] = [m.email for m in self.maintainers if m is not None]
+        return data
 
 
 class PluginVersionOrm(Base):
     __tablename__ = 'versions'
+    # Concurrent publishes of a version conflict on it, rather than adding it twice
+    __table_args__ = (UniqueConstraint('plugin_id', 'version', name='uq_versions_plugin_id_version'),)
     id = Column(Integer, primary_key=True, autoincrement=True)
     upload_date = Column(DateTime)
     version = Column(String(20), nullable=False)
+    size = Column(Integer, nullable=True)
+    digest = Column(String(64), nullable=True)
+    module = Column(String(255), nullable=True, index=True)
+    description = Column(String(255), nullable=True)
 
     plugin_id = Column(Integer, ForeignKey('plugins.id'))
     plugin = relationship('PluginOrm', back_populates='versions')
@@ -56,20 +72,27 @@ class PluginVersionOrm(Base):
         '''
         Returns the path to the tarball for that plugin's version
         '''
-        return BASE_PATH / f'plugins/{self.plugin.name}/{self.version}.tar.gz'
-
-    def dict(self, with_file=True):
-        data = {
-            'id': self.id,
-            'plugin_id': self.plugin.id,
-            'upload_date': self.upload_date.isoformat(),
-            'version': self.version,
-        }
+        return storage.resolve_tarball(self.plugin.name, self.version)
+
+    def dict(self, with_file=True, fields: Collection[str] = VERSION_FIELDS):
+        data = {field: getattr(self, field) for field in VERSION_FIELDS if field in fields}
+        if data.get('upload_date') is not None:
+            data['upload_date'] = data['upload_date'].isoformat()
         if not with_file:
             return data
-        data['file'] = encode_file(self.file_path)
+        # None rather than an empty string when the tarball is missing, so that it is not installed as is
+        data['file'] = tarball_cache.cache.encoded(self.file_path)
         return data
 
+    @staticmethod
+    def load_fields(fields: Collection[str]):
+        '''
+        Returns the option loading only the columns of the given fields, and
+        the ones locating the version and its tarball.
+        '''
+        names = {'id', 'plugin_id', 'version', *fields}
+        return load_only(*(getattr(PluginVersionOrm, name) for name in VERSION_FIELDS if name in names))
+
 
 class PluginModel(BaseModel):
     class Config:
@@ -77,6 +100,13 @@ class PluginModel(BaseModel):
 
     name: constr(to_lower=True, max_length=255, strip_whitespace=True)
 
+    @validator('name')
+    def name_is_path_segment(cls, name: str) -> str:
+        # Joined to the paths of the tarballs of the plugin
+        if not storage.is_path_segment(name):
+            raise ValueError('must be a single path segment')
+        return name
+
 
 class PluginVersionModel(BaseModel):
     class Config:
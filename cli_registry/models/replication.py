@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, DateTime
+
+from cli_registry.db import Base
+
+
+class ReplicationStateOrm(Base):
+    '''
+    Position of a replica in the change log of its primary. It is updated in
+    the same transaction as the changes it applies.
+    '''
+    __tablename__ = 'replication_state'
+    id = Column(Integer, primary_key=True)
+    primary_url = Column(String(255), nullable=False)
+    last_change_id = Column(Integer, nullable=False, default=0)
+    last_change_at = Column(DateTime, nullable=True)
+    primary_last_change_id = Column(Integer, nullable=False, default=0)
+    last_polled_at = Column(DateTime, nullable=True)
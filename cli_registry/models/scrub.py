@@ -0,0 +1,54 @@
+from sqlalchemy import Column, DateTime, Integer, String
+
+from cli_registry.db import Base
+
+
+class ScrubStateOrm(Base):
+    '''
+    Progress of the integrity scrubber through the versions, in id order.
+    Workers claim the next batch by moving `last_version_id` forward.
+    '''
+    __tablename__ = 'scrub_state'
+    id = Column(Integer, primary_key=True)
+    last_version_id = Column(Integer, nullable=False, default=0)
+    pass_started_at = Column(DateTime, nullable=True)
+    last_pass_finished_at = Column(DateTime, nullable=True)
+    checked = Column(Integer, nullable=False, default=0)
+    bytes_read = Column(Integer, nullable=False, default=0)
+
+    def dict(self):
+        return {
+            'last_version_id': self.last_version_id,
+            'pass_started_at': self.pass_started_at and self.pass_started_at.isoformat(),
+            'last_pass_finished_at': self.last_pass_finished_at and self.last_pass_finished_at.isoformat(),
+            'checked': self.checked,
+            'bytes_read': self.bytes_read,
+        }
+
+
+class ScrubFindingOrm(Base):
+    '''
+    Tarball found missing, or not matching the size or digest recorded when
+    it was published. Removed once the tarball checks out again.
+    '''
+    __tablename__ = 'scrub_findings'
+    version_id = Column(Integer, primary_key=True)
+    plugin_name = Column(String(255), nullable=False)
+    version = Column(String(20), nullable=False)
+    problem = Column(String(20), nullable=False)
+    expected = Column(String(64), nullable=True)
+    actual = Column(String(64), nullable=True)
+    quarantine_path = Column(String(1024), nullable=True)
+    found_at = Column(DateTime, nullable=False, index=True)
+
+    def dict(self):
+        return {
+            'version_id': self.version_id,
+            'plugin_name': self.plugin_name,
+            'version': self.version,
+            'problem': self.problem,
+            'expected': self.expected,
+            'actual': self.actual,
+            'quarantine_path': self.quarantine_path,
+            'found_at': self.found_at.isoformat(),
+        }
@@ -0,0 +1,8 @@
+from typing import Optional
+
+from pydantic import BaseModel, constr
+
+
+class SessionModel(BaseModel):
+    # Plugins the session is scoped to, every plugin the key maintains if unset
+    plugins: Optional[list[constr(to_lower=True, max_length=255, strip_whitespace=True)]] = None
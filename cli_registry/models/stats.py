@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Date, DateTime, Integer, String
+
+from cli_registry.db import Base
+
+
+class DownloadStatOrm(Base):
+    '''
+    Number of downloads of a plugin version on a given day. Rows are keyed on
+    names rather than ids so that they outlive the versions they count.
+    '''
+    __tablename__ = 'download_stats'
+    plugin_name = Column(String(255), primary_key=True)
+    version = Column(String(20), primary_key=True)
+    day = Column(Date, primary_key=True)
+    downloads = Column(Integer, nullable=False, default=0)
+
+
+class PopularPluginOrm(Base):
+    '''Ranking of the most downloaded plugins, recomputed periodically from the download stats'''
+    __tablename__ = 'popular_plugins'
+    rank = Column(Integer, primary_key=True)
+    plugin_name = Column(String(255), nullable=False)
+    downloads = Column(Integer, nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+
+    def dict(self):
+        return {
+            'rank': self.rank,
+            'plugin_name': self.plugin_name,
+            'downloads': self.downloads,
+        }
@@ -0,0 +1,30 @@
+from pydantic import BaseModel, constr
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy.orm import relationship
+
+from cli_registry.db import Base
+
+
+class UploadOrm(Base):
+    __tablename__ = 'uploads'
+    id = Column(String(32), primary_key=True)
+    version = Column(String(20), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    plugin_id = Column(Integer, ForeignKey('plugins.id'), nullable=False)
+    plugin = relationship('PluginOrm')
+
+    def dict(self, offset: int = 0):
+        return {
+            'id': self.id,
+            'plugin_id': self.plugin_id,
+            'version': self.version,
+            'created_at': self.created_at.isoformat(),
+            'expires_at': self.expires_at.isoformat(),
+            'offset': offset,
+        }
+
+
+class UploadFinalizeModel(BaseModel):
+    digest: constr(to_lower=True, min_length=64, max_length=64, strip_whitespace=True)
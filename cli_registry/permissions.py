@@ -0,0 +1,93 @@
+'''
+Authorization of the maintainers of a plugin.
+
+Whether a key maintains a plugin is checked with an indexed existence query
+on the association table, joined to the maintainers on the fingerprint of
+their key, and the answer is cached for AUTH_CACHE_TTL seconds. The cache
+of a plugin is invalidated when its maintainers change in this process,
+other workers see the change once their cached answer expires.
+'''
+from collections import OrderedDict
+import threading
+import time
+
+from sqlalchemy import exists
+from sqlalchemy.orm import Session
+
+from cli_registry.config import AUTH_CACHE_TTL, AUTH_CACHE_SIZE
+from cli_registry.models.maintainer import MaintainerOrm, association_table
+from cli_registry.models.plugin import PluginOrm
+
+
+class AuthorizationCache:
+    '''LRU cache of whether (plugin id, key fingerprint) pairs are authorized'''
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, max_size: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[tuple[int, str], tuple[bool, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, plugin_id: int, fingerprint: str) -> bool | None:
+        key = (plugin_id, fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            authorized, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return authorized
+
+    def set(self, plugin_id: int, fingerprint: str, authorized: bool):
+        with self._lock:
+            self._entries[(plugin_id, fingerprint)] = (authorized, time.monotonic() + self.ttl)
+            self._entries.move_to_end((plugin_id, fingerprint))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, plugin_id: int):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == plugin_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = AuthorizationCache()
+
+
+def is_maintainer(db: Session, plugin_id: int, fingerprint: str) -> bool:
+    '''Checks whether the key with that fingerprint maintains the plugin'''
+    authorized = cache.get(plugin_id, fingerprint)
+    if authorized is None:
+        authorized = db.query(
+            exists().where(
+                association_table.c.plugin_id == plugin_id,
+                association_table.c.maintainer_id == MaintainerOrm.id,
+                MaintainerOrm.fingerprint == fingerprint,
+            )
+        ).scalar()
+        cache.set(plugin_id, fingerprint, authorized)
+    return authorized
+
+
+def maintained_plugins(db: Session, names: list[str], fingerprint: str) -> dict[str, PluginOrm]:
+    '''
+    Returns the plugins among `names` that the key with that fingerprint
+    maintains, by name, in a single query.
+    '''
+    plugins = (
+        db
+        .query(PluginOrm)
+        .join(association_table, association_table.c.plugin_id == PluginOrm.id)
+        .join(MaintainerOrm, association_table.c.maintainer_id == MaintainerOrm.id)
+        .filter(PluginOrm.name.in_(names), MaintainerOrm.fingerprint == fingerprint)
+        .all()
+    )
+    for plugin in plugins:
+        cache.set(plugin.id, fingerprint, True)
+    return {plugin.name: plugin for plugin in plugins}
@@ -0,0 +1,140 @@
+'''
+Group commit of the metadata written by the publish routes.
+
+On SQLite, every commit waits for the journal to be synced to disk, and
+concurrent writers queue on the database lock. Publishes are instead handed
+to a single writer thread, which gathers the ones submitted within
+WRITE_BATCH_WINDOW seconds and commits them together. Each publish runs in
+its own savepoint, so that a failing one is rolled back alone and only its
+caller gets the error, while the others are committed.
+
+The tarballs are staged and synced to disk by the routes beforehand, the
+writer thread only moves them in place.
+'''
+import asyncio
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable
+
+from sqlalchemy.orm import Session
+
+from cli_registry.config import WRITE_BATCH_SIZE, WRITE_BATCH_WINDOW
+from cli_registry.db import WriterSessionLocal
+
+
+logger = logging.getLogger('cli_registry')
+
+session_factory: Callable[[], Session] = WriterSessionLocal
+# Number of commits, and of writes they contained, since the process started
+stats = {'commits': 0, 'writes': 0}
+
+
+@dataclass
+class _Write:
+    apply: Callable[[Session], Any]
+    undo: Callable[[], None] | None
+    future: Future = field(default_factory=Future)
+
+
+_queue: 'queue.SimpleQueue[_Write | None]' = queue.SimpleQueue()
+_thread: threading.Thread | None = None
+_lock = threading.Lock()
+
+
+def _next_batch() -> list[_Write] | None:
+    '''Waits for a write, then gathers the ones following it within the window'''
+    first = _queue.get()
+    if first is None:
+        return None
+    batch = [first]
+    deadline = time.monotonic() + WRITE_BATCH_WINDOW
+    while len(batch) < WRITE_BATCH_SIZE:
+        try:
+            write = _queue.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            break
+        if write is None:
+            # Stop once this batch is committed
+            _queue.put(None)
+            break
+        batch.append(write)
+    return batch
+
+
+def _commit(db: Session, batch: list[_Write]):
+    applied: list[tuple[_Write, Any]] = []
+    for write in batch:
+        try:
+            with db.begin_nested():
+                result = write.apply(db)
+        except Exception as e:
+            write.future.set_exception(e)
+        else:
+            applied.append((write, result))
+    try:
+        db.commit()
+    except Exception as e:
+        logger.exception('Group commit of %d writes failed', len(applied))
+        db.rollback()
+        for write, _ in applied:
+            if write.undo is not None:
+                try:
+                    write.undo()
+                except Exception:
+                    logger.exception('Could not undo a write of the failed group commit')
+            write.future.set_exception(e)
+        return
+    stats['commits'] += 1
+    stats['writes'] += len(applied)
+    for write, result in applied:
+        write.future.set_result(result)
+
+
+def _run():
+    db = session_factory()
+    try:
+        while (batch := _next_batch()) is not None:
+            try:
+                _commit(db, batch)
+            except BaseException as e:
+                for write in batch:
+                    if not write.future.done():
+                        write.future.set_exception(e)
+                raise
+    finally:
+        db.close()
+
+
+def _start():
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name='group-commit', daemon=True)
+            _thread.start()
+
+
+async def submit(apply: Callable[[Session], Any], undo: Callable[[], None] | None = None) -> Any:
+    '''
+    Runs `apply(db)` in the next group commit, and returns its result once it
+    is committed. `apply` must not commit, and must only use the session it is
+    given. If it succeeds but the group commit fails, `undo()` is called to
+    revert what it did outside of the database.
+    '''
+    _start()
+    write = _Write(apply, undo)
+    _queue.put(write)
+    return await asyncio.wrap_future(write.future)
+
+
+def shutdown():
+    '''Commits the pending writes, and stops the writer thread'''
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            _queue.put(None)
+            _thread.join()
+        _thread = None
@@ -0,0 +1,227 @@
+'''
+Opt-in per-request profiling and slow query log.
+
+A profiled request is sampled by a background thread, which records the
+stacks of the threads busy running the registry (the event loop running the
+handler and the threadpool running the sync dependencies) every
+PROFILE_INTERVAL seconds. Samples of concurrent requests may show up in the
+profile as well, since threads cannot be attributed to a request.
+
+Profiles are stored as JSON under PROFILES_PATH, with their stacks in the
+folded format understood by flamegraph.pl and speedscope. Only the last
+PROFILES_MAX are kept, older ones being removed as new ones are saved.
+'''
+from collections import Counter, deque
+import contextvars
+from datetime import datetime
+import hmac
+import itertools
+import json
+import logging
+from pathlib import Path
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+
+from cli_registry.config import (
+    PROFILE_SECRET, PROFILE_SAMPLE_RATE, PROFILE_INTERVAL, PROFILES_MAX, PROFILES_PATH, SLOW_QUERY_THRESHOLD,
+)
+
+
+logger = logging.getLogger('cli_registry.slow_queries')
+
+PROFILE_HEADER = 'X-Profile-Secret'
+ADMIN_PREFIX = '/v1/admin/'
+# Packages whose frames mark a thread as busy running a request
+TRACKED_PACKAGES = ('cli_registry', 'sqlalchemy', 'fastapi', 'starlette')
+MAX_SLOW_QUERIES = 1000
+MAX_PARAMETERS_LENGTH = 1000
+
+current_request: contextvars.ContextVar[Request | None] = contextvars.ContextVar('current_request', default=None)
+slow_queries: deque[dict] = deque(maxlen=MAX_SLOW_QUERIES)
+_request_counter = itertools.count(1)
+
+
+def is_authorized(secret: str | None) -> bool:
+    '''Checks the secret sent by an operator, profiling is disabled when no secret is configured'''
+    return bool(PROFILE_SECRET) and secret is not None and hmac.compare_digest(secret, PROFILE_SECRET)
+
+
+def _is_tracked(frame) -> bool:
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.split('.', 1)[0] in TRACKED_PACKAGES:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def _fold(frame) -> str:
+    stack = [
+        f'{frame_summary.name} ({frame_summary.filename}:{frame_summary.lineno})'
+        for frame_summary in traceback.extract_stack(frame)
+    ]
+    return ';'.join(stack)
+
+
+class Sampler(threading.Thread):
+    '''Samples the stacks of the threads running the registry until stopped'''
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        super().__init__(name='cli_registry-profiler', daemon=True)
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        own_ident = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != own_ident and _is_tracked(frame):
+                self.stacks[_fold(frame)] += 1
+        self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def route_path(request: Request) -> str:
+    '''Returns the path template of the route matching a request, e.g. /v1/plugins/{plugin_name}'''
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return request.url.path
+
+
+def should_profile(request: Request) -> bool:
+    # The admin routes use the same secret, but are not worth profiling
+    if request.url.path.startswith(ADMIN_PREFIX):
+        return False
+    if is_authorized(request.headers.get(PROFILE_HEADER)):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and next(_request_counter) % PROFILE_SAMPLE_RATE == 0
+
+
+def save_profile(request: Request, sampler: Sampler, duration: float) -> str:
+    profile_id = uuid.uuid4().hex
+    profile = {
+        'id': profile_id,
+        'created_at': datetime.now().isoformat(),
+        'method': request.method,
+        'path': request.url.path,
+        'route': route_path(request),
+        'duration': duration,
+        'interval': sampler.interval,
+        'samples': sampler.samples,
+        'stacks': dict(sampler.stacks.most_common()),
+    }
+    PROFILES_PATH.mkdir(parents=True, exist_ok=True)
+    (PROFILES_PATH / f'{profile_id}.json').write_text(json.dumps(profile))
+    for path in _profile_paths()[PROFILES_MAX:]:
+        path.unlink(missing_ok=True)
+    return profile_id
+
+
+def _mtime(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        # Removed by a concurrent save
+        return 0
+
+
+def _profile_paths() -> list[Path]:
+    '''Paths of the stored profiles, from the newest'''
+    return sorted(PROFILES_PATH.glob('*.json'), key=_mtime, reverse=True)
+
+
+def list_profiles() -> list[dict]:
+    profiles = []
+    for path in _profile_paths():
+        try:
+            profile = json.loads(path.read_text())
+        except FileNotFoundError:
+            continue
+        del profile['stacks']
+        profiles.append(profile)
+    return profiles
+
+
+def load_profile(profile_id: str) -> dict | None:
+    # Profile ids are hex, anything else could escape PROFILES_PATH
+    if not all(c in '0123456789abcdef' for c in profile_id):
+        return None
+    try:
+        return json.loads((PROFILES_PATH / f'{profile_id}.json').read_text())
+    except FileNotFoundError:
+        return None
+
+
+def folded(profile: dict) -> str:
+    return ''.join(f'{stack} {count}\n' for stack, count in profile['stacks'].items())
+
+
+async def profile_request(request: Request, call_next):
+    '''Middleware tracking the current request, and profiling it if requested'''
+    token = current_request.set(request)
+    try:
+        if not should_profile(request):
+            return await call_next(request)
+        sampler = Sampler()
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            response = await call_next(request)
+        finally:
+            await run_in_threadpool(sampler.stop)
+        duration = time.perf_counter() - start
+        # Written and pruned in the threadpool, not to stall the requests being measured on the disk
+        response.headers['X-Profile-Id'] = await run_in_threadpool(save_profile, request, sampler, duration)
+        return response
+    finally:
+        current_request.reset(token)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    duration = (time.perf_counter() - conn.info['query_start_time'].pop()) * 1000
+    if not SLOW_QUERY_THRESHOLD or duration < SLOW_QUERY_THRESHOLD:
+        return
+    request = current_request.get()
+    query = {
+        'created_at': datetime.now().isoformat(),
+        'duration': duration,
+        'statement': statement,
+        'parameters': repr(parameters)[:MAX_PARAMETERS_LENGTH],
+        'route': None if request is None else f'{request.method} {route_path(request)}',
+    }
+    slow_queries.append(query)
+    logger.warning(
+        'Slow query (%.1f ms) from %s: %s %s',
+        duration, query['route'], statement, query['parameters'],
+    )
+
+
+@event.listens_for(Engine, 'handle_error')
+def _stop_query_timer(context):
+    # The timer of a failed query, which after_cursor_execute is not called for
+    if context.connection is not None and context.connection.info.get('query_start_time'):
+        context.connection.info['query_start_time'].pop()
@@ -0,0 +1,243 @@
+'''
+Read-only replicas following a primary registry.
+
+A replica polls the change log of its primary (`GET /v1/changes`) and
+applies the changes to its own database, along with the position reached in
+the log, in a single transaction. The changes are recorded in its own log
+too, under the ids they have on the primary, for `/v1/events`. Tarballs of the published versions are
+downloaded and verified against their digest before the transaction starts,
+so a replica never serves a version it does not have the tarball of.
+'''
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import urlopen
+
+from sqlalchemy.orm import Session
+
+from cli_registry.config import REPLICA_OF, REPLICA_POLL_INTERVAL, REPLICA_BATCH_SIZE
+from cli_registry.db import SessionLocal
+from cli_registry.models.maintainer import MaintainerOrm
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+from cli_registry.models.replication import ReplicationStateOrm
+from cli_registry import catalog, changes, closure, events, storage, tasks
+
+
+logger = logging.getLogger('cli_registry')
+
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = 30
+
+
+class ReplicationError(Exception):
+    '''Raised when the changes pulled from the primary cannot be applied'''
+
+
+def _get_json(url: str) -> dict:
+    with urlopen(url, timeout=TIMEOUT) as response:
+        return json.load(response)
+
+
+def _download(url: str, path: Path) -> str:
+    '''Downloads `url` to `path` and returns the sha256 digest of its content'''
+    digest = hashlib.sha256()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with urlopen(url, timeout=TIMEOUT) as response, open(path, 'wb') as fp:
+        while chunk := response.read(CHUNK_SIZE):
+            digest.update(chunk)
+            fp.write(chunk)
+    return digest.hexdigest()
+
+
+def get_state(db: Session) -> ReplicationStateOrm:
+    state: ReplicationStateOrm | None = db.query(ReplicationStateOrm).first()
+    if state is None:
+        state = ReplicationStateOrm(id=1, primary_url=REPLICA_OF, last_change_id=0, primary_last_change_id=0)
+        db.add(state)
+    return state
+
+
+def _fetch_tarball(primary_url: str, change: dict) -> Path | None:
+    plugin_name, version = quote(change['plugin_name']), quote(change['version'])
+    url = f'{primary_url}/v1/plugins/{plugin_name}/versions/{version}/download'
+    path = storage.staging_path('replicated')
+    try:
+        digest = _download(url, path)
+    except HTTPError as e:
+        if e.code != 404:
+            raise
+        # Deleted on the primary since, a later change in the log deletes it as well
+        logger.warning('Tarball of %s %s is gone from the primary.', change['plugin_name'], change['version'])
+        path.unlink(missing_ok=True)
+        return None
+    expected = change['data']['version']['digest']
+    if expected is not None and digest != expected:
+        path.unlink(missing_ok=True)
+        raise ReplicationError(
+            f'Digest {digest} of {change["plugin_name"]} {change["version"]} does not match {expected}.'
+        )
+    return path
+
+
+def _get_maintainer(db: Session, data: dict) -> MaintainerOrm:
+    maintainer = db.get(MaintainerOrm, data['id'])
+    if maintainer is None:
+        maintainer = MaintainerOrm(id=data['id'], email=data['email'], ssh_key=data['ssh_key'])
+        db.add(maintainer)
+    return maintainer
+
+
+def _get_plugin(db: Session, name: str) -> PluginOrm | None:
+    return db.query(PluginOrm).filter(PluginOrm.name == name).first()
+
+
+def _get_version(db: Session, plugin: PluginOrm | None, version: str) -> PluginVersionOrm | None:
+    if plugin is None:
+        return None
+    return (
+        db
+        .query(PluginVersionOrm)
+        .filter(PluginVersionOrm.plugin_id == plugin.id, PluginVersionOrm.version == version)
+        .first()
+    )
+
+
+def apply_change(
+    db: Session, change: dict, tarball: Path | None, removals: list[Path], moved: list[tuple[Path, Path]],
+):
+    '''
+    Applies a change pulled from the primary to the database. The tarball of
+    a published version is moved in place right away, and appended to `moved`
+    as (path, staged path) to be moved back if the commit fails, while the
+    files to remove are appended to `removals`, to be removed once committed.
+    '''
+    action = change['action']
+    plugin = _get_plugin(db, change['plugin_name'])
+    if action == changes.PLUGIN_CREATED:
+        if plugin is None:
+            plugin = PluginOrm(id=change['data']['plugin_id'], name=change['plugin_name'])
+            db.add(plugin)
+        plugin.maintainers.append(_get_maintainer(db, change['data']['maintainer']))
+    elif action == changes.MAINTAINER_ADDED:
+        maintainer = _get_maintainer(db, change['data']['maintainer'])
+        if maintainer not in plugin.maintainers:
+            plugin.maintainers.append(maintainer)
+    elif action == changes.VERSION_PUBLISHED:
+        data = change['data']['version']
+        version = PluginVersionOrm(
+            id=data['id'],
+            version=data['version'],
+            upload_date=datetime.fromisoformat(data['upload_date']),
+            size=data['size'],
+            digest=data['digest'],
+            module=data['module'],
+            description=data['description'],
+        )
+        version.plugin = plugin
+        db.add(version)
+        # Checked by the primary already
+        closure.version_published(db, version, change['data'].get('dependencies', []))
+        if tarball is not None:
+            version.file_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tarball, version.file_path)
+            moved.append((version.file_path, tarball))
+    elif action == changes.VERSION_DELETED:
+        version = _get_version(db, plugin, change['version'])
+        if version is not None:
+            removals.append(version.file_path)
+            db.delete(version)
+            closure.version_deleted(db, version)
+    elif action == changes.PLUGIN_DELETED:
+        if plugin is not None:
+            closure.plugin_deleted(db, plugin)
+            for version in plugin.versions:
+                removals.append(version.file_path)
+                db.delete(version)
+            db.delete(plugin)
+    else:
+        raise ReplicationError(f'Unknown action {action} in change {change["id"]}.')
+    # Later changes of the batch may query what this one added
+    db.flush()
+
+
+def pull_changes(db: Session, primary_url: str = REPLICA_OF) -> int:
+    '''
+    Pulls and applies the next batch of changes from the primary, and returns
+    the number of changes applied.
+    '''
+    state = get_state(db)
+    payload = _get_json(f'{primary_url}/v1/changes?since={state.last_change_id}&limit={REPLICA_BATCH_SIZE}')
+    pulled: list[dict] = payload['data']
+    tarballs: dict[int, Path | None] = {}
+    removals: list[Path] = []
+    moved: list[tuple[Path, Path]] = []
+    try:
+        for change in pulled:
+            if change['action'] == changes.VERSION_PUBLISHED:
+                tarballs[change['id']] = _fetch_tarball(primary_url, change)
+        for change in pulled:
+            apply_change(db, change, tarballs.get(change['id']), removals, moved)
+            changes.mirror(db, change)
+        catalog.refresh(db, {change['plugin_name'] for change in pulled})
+        if pulled:
+            state.last_change_id = pulled[-1]['id']
+            state.last_change_at = datetime.fromisoformat(pulled[-1]['created_at'])
+        state.primary_last_change_id = payload['last_id']
+        state.last_polled_at = datetime.now()
+        db.commit()
+    except Exception:
+        db.rollback()
+        # Moved back first, so that they are removed with the other fetched tarballs
+        while moved:
+            file_path, staged_path = moved.pop()
+            os.replace(file_path, staged_path)
+        for path in tarballs.values():
+            if path is not None:
+                path.unlink(missing_ok=True)
+        raise
+    for path in removals:
+        path.unlink(missing_ok=True)
+    if pulled:
+        events.notify()
+    return len(pulled)
+
+
+def status(db: Session) -> dict:
+    '''
+    Returns the role of this registry and, for replicas, their replication lag.
+    `lag_seconds` is an upper bound: the age of the last change applied when
+    the replica is behind, or the time since the last poll otherwise.
+    '''
+    if not REPLICA_OF:
+        return {'role': 'primary', 'last_change_id': changes.last_id(db)}
+    state = get_state(db)
+    now = datetime.now()
+    lag_changes = max(state.primary_last_change_id - state.last_change_id, 0)
+    since = state.last_polled_at if lag_changes == 0 else state.last_change_at or state.last_polled_at
+    return {
+        'role': 'replica',
+        'primary': state.primary_url,
+        'last_change_id': state.last_change_id,
+        'primary_last_change_id': state.primary_last_change_id,
+        'last_polled_at': state.last_polled_at and state.last_polled_at.isoformat(),
+        'lag_changes': lag_changes,
+        'lag_seconds': None if since is None else (now - since).total_seconds(),
+    }
+
+
+def follow_primary():
+    db = SessionLocal()
+    try:
+        while pull_changes(db) == REPLICA_BATCH_SIZE:
+            pass
+    finally:
+        db.close()
+
+
+if REPLICA_OF:
+    tasks.periodic(REPLICA_POLL_INTERVAL)(follow_primary)
@@ -0,0 +1,219 @@
+'''
+Retention of the old versions, enforced by a background collector.
+
+Every RETENTION_GC_INTERVAL seconds, the collector prunes:
+- the versions of a plugin older than its RETENTION_KEEP_VERSIONS last ones,
+  unless uploaded in the last RETENTION_KEEP_DAYS days,
+- the versions uploaded more than RETENTION_KEEP_DAYS days ago, unless among
+  the RETENTION_KEEP_VERSIONS last ones of their plugin,
+- then, while the tarballs left take more than DISK_QUOTA bytes, the versions
+  downloaded the least recently, those never downloaded first.
+
+Policies set to 0 are disabled. The latest version of a plugin is never
+pruned, so that plugins stay installable, and their dependency closures are
+left as is.
+
+Pruned versions are deleted in batches of RETENTION_BATCH_SIZE, each in its
+own transaction recording their deletion in the change log, so that replicas
+prune them too. The collector pauses RETENTION_BATCH_PAUSE seconds between
+batches, to leave the database to the routes, and removes the tarballs of a
+batch once it is committed.
+'''
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+import logging
+import os
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+
+from cli_registry.config import (
+    DISK_QUOTA, REPLICA_OF, RETENTION_BATCH_PAUSE, RETENTION_BATCH_SIZE, RETENTION_GC_INTERVAL,
+    RETENTION_KEEP_DAYS, RETENTION_KEEP_VERSIONS,
+)
+from cli_registry.db import SessionLocal
+from cli_registry.models.dependency import VersionDependencyOrm
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+from cli_registry.models.stats import DownloadStatOrm
+from cli_registry import catalog, changes, deltas, events, storage, tarball_cache, tasks
+
+
+logger = logging.getLogger('cli_registry')
+
+# Report of the last collection, for GET /v1/admin/retention
+last_collection: dict | None = None
+
+
+@dataclass
+class Candidate:
+    id: int
+    plugin_name: str
+    version: str
+    size: int
+    upload_date: datetime
+    last_download: date | None = None
+
+
+def policies() -> dict:
+    return {
+        'keep_versions': RETENTION_KEEP_VERSIONS,
+        'keep_days': RETENTION_KEEP_DAYS,
+        'disk_quota': DISK_QUOTA,
+    }
+
+
+def enabled() -> bool:
+    return any(policies().values())
+
+
+def _size(plugin_name: str, version: str, size: int | None) -> int:
+    '''Size of a tarball, read from the disk for the versions published before sizes were stored'''
+    if size is not None:
+        return size
+    try:
+        return os.path.getsize(storage.resolve_tarball(plugin_name, version))
+    except FileNotFoundError:
+        return 0
+
+
+def usage(db: Session) -> int:
+    '''Returns the size of the stored tarballs, as recorded when they were published'''
+    return db.query(func.coalesce(func.sum(PluginVersionOrm.size), 0)).scalar()
+
+
+def plan(db: Session, now: datetime | None = None) -> tuple[list[Candidate], int]:
+    '''
+    Returns the versions to prune under the current policies, oldest first,
+    and the size of the tarballs left once they are.
+    '''
+    now = now or datetime.now()
+    rows = (
+        db
+        .query(
+            PluginVersionOrm.id, PluginOrm.name, PluginVersionOrm.version,
+            PluginVersionOrm.size, PluginVersionOrm.upload_date,
+        )
+        .join(PluginOrm)
+        .order_by(PluginOrm.name, PluginVersionOrm.upload_date.desc())
+        .all()
+    )
+    pruned: list[Candidate] = []
+    # Versions that the quota may evict, that is every version but the latest ones
+    evictable: list[Candidate] = []
+    kept_size = 0
+    rank = 0
+    previous = None
+    for version_id, plugin_name, version, size, upload_date in rows:
+        rank = rank + 1 if plugin_name == previous else 1
+        previous = plugin_name
+        candidate = Candidate(
+            version_id, plugin_name, version, _size(plugin_name, version, size), upload_date or datetime.min,
+        )
+        if rank == 1:
+            kept_size += candidate.size
+            continue
+        if RETENTION_KEEP_VERSIONS or RETENTION_KEEP_DAYS:
+            within_count = RETENTION_KEEP_VERSIONS and rank <= RETENTION_KEEP_VERSIONS
+            within_age = RETENTION_KEEP_DAYS and now - candidate.upload_date <= timedelta(days=RETENTION_KEEP_DAYS)
+            if not within_count and not within_age:
+                pruned.append(candidate)
+                continue
+        kept_size += candidate.size
+        evictable.append(candidate)
+
+    if DISK_QUOTA and kept_size > DISK_QUOTA:
+        last_downloads = {
+            (plugin_name, version): day for plugin_name, version, day in
+            db
+            .query(DownloadStatOrm.plugin_name, DownloadStatOrm.version, func.max(DownloadStatOrm.day))
+            .group_by(DownloadStatOrm.plugin_name, DownloadStatOrm.version)
+        }
+        for candidate in evictable:
+            candidate.last_download = last_downloads.get((candidate.plugin_name, candidate.version))
+        evictable.sort(key=lambda c: (c.last_download or date.min, c.upload_date))
+        for candidate in evictable:
+            if kept_size <= DISK_QUOTA:
+                break
+            pruned.append(candidate)
+            kept_size -= candidate.size
+    pruned.sort(key=lambda c: c.upload_date)
+    return pruned, kept_size
+
+
+def prune(db: Session, version_ids: list[int]) -> tuple[int, int]:
+    '''
+    Deletes versions in a single transaction, then their tarballs, and
+    returns how many were deleted, and the number of bytes reclaimed.
+    '''
+    versions: list[PluginVersionOrm] = (
+        db
+        .query(PluginVersionOrm)
+        .options(joinedload(PluginVersionOrm.plugin))
+        .filter(PluginVersionOrm.id.in_(version_ids))
+        .all()
+    )
+    paths = [(version.plugin.name, version.version, version.file_path) for version in versions]
+    for version in versions:
+        db.delete(version)
+        changes.version_deleted(db, version)
+    db.query(VersionDependencyOrm).filter(
+        VersionDependencyOrm.version_id.in_(version_ids)
+    ).delete(synchronize_session=False)
+    catalog.refresh(db, {plugin_name for plugin_name, _, _ in paths})
+    db.commit()
+    events.notify()
+    reclaimed = 0
+    for plugin_name, version, path in paths:
+        deltas.discard(plugin_name, version)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        tarball_cache.cache.invalidate(path)
+        reclaimed += size
+    return len(versions), reclaimed
+
+
+def collect(db: Session, now: datetime | None = None) -> dict:
+    '''Prunes the versions that the policies do not retain, in batches, and returns a report'''
+    started_at = now or datetime.now()
+    pruned, kept_size = plan(db, started_at)
+    # The plan is read in its own transaction, released during the pauses
+    db.commit()
+    deleted = reclaimed = 0
+    for start in range(0, len(pruned), RETENTION_BATCH_SIZE):
+        if start:
+            time.sleep(RETENTION_BATCH_PAUSE)
+        count, size = prune(db, [candidate.id for candidate in pruned[start:start + RETENTION_BATCH_SIZE]])
+        deleted += count
+        reclaimed += size
+    return {
+        'started_at': started_at.isoformat(),
+        'finished_at': datetime.now().isoformat(),
+        'versions': deleted,
+        'reclaimed': reclaimed,
+        'usage': kept_size,
+    }
+
+
+def collect_task():
+    global last_collection
+    if not enabled():
+        return
+    db = SessionLocal()
+    try:
+        last_collection = collect(db)
+    finally:
+        db.close()
+    if last_collection['versions']:
+        logger.info(
+            'Pruned %d versions, reclaiming %d bytes.',
+            last_collection['versions'], last_collection['reclaimed'],
+        )
+
+
+# Replicas prune the versions their primary prunes
+if not REPLICA_OF:
+    tasks.periodic(RETENTION_GC_INTERVAL)(collect_task)
@@ -0,0 +1,254 @@
+'''
+Background scrubber checking the integrity of the stored tarballs.
+
+Every SCRUB_INTERVAL seconds, the scrubber checks the tarballs of the next
+SCRUB_BATCH_SIZE versions, in id order, against the size and digest recorded
+when they were published, reading at most SCRUB_RATE bytes per second. Its
+position is stored in the database, so that a pass over millions of tarballs
+spans as many runs as needed, across restarts, and each batch is claimed by
+moving the position forward, so that workers do not check the same versions.
+
+Tarballs which are missing, or do not match, are reported as findings on
+`GET /v1/admin/scrub`. Those which do not match are moved to the quarantine
+directory, so that they are not served anymore. Findings are removed once
+their tarball checks out again, e.g. after it was restored, or when their
+version is deleted.
+'''
+from dataclasses import dataclass
+from datetime import datetime
+import hashlib
+import logging
+import os
+from pathlib import Path
+import time
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from cli_registry.config import BASE_PATH, SCRUB_BATCH_SIZE, SCRUB_INTERVAL, SCRUB_RATE
+from cli_registry.db import SessionLocal
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+from cli_registry.models.scrub import ScrubFindingOrm, ScrubStateOrm
+from cli_registry import deltas, storage, tarball_cache, tasks
+
+
+logger = logging.getLogger('cli_registry')
+
+MISSING = 'missing'
+SIZE_MISMATCH = 'size'
+DIGEST_MISMATCH = 'digest'
+CHUNK_SIZE = 1024 * 1024
+QUARANTINE_DIR = 'quarantine'
+
+
+@dataclass
+class Check:
+    problem: str | None = None
+    expected: str | None = None
+    actual: str | None = None
+    bytes_read: int = 0
+
+
+class Throttle:
+    '''Sleeps as needed to read at most `rate` bytes per second'''
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.started_at = time.monotonic()
+        self.consumed = 0
+
+    def consume(self, size: int):
+        self.consumed += size
+        delay = self.consumed / self.rate - (time.monotonic() - self.started_at)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def check(path: Path, size: int | None, digest: str | None, throttle: Throttle) -> Check:
+    '''Checks a tarball against the size and digest recorded for its version, if any'''
+    try:
+        fp = open(path, 'rb')
+    except FileNotFoundError:
+        return Check(MISSING)
+    with fp:
+        actual_size = os.fstat(fp.fileno()).st_size
+        if size is not None and actual_size != size:
+            return Check(SIZE_MISMATCH, str(size), str(actual_size))
+        if digest is None:
+            return Check()
+        actual = hashlib.sha256()
+        bytes_read = 0
+        while chunk := fp.read(CHUNK_SIZE):
+            actual.update(chunk)
+            bytes_read += len(chunk)
+            throttle.consume(len(chunk))
+    if actual.hexdigest() != digest:
+        return Check(DIGEST_MISMATCH, digest, actual.hexdigest(), bytes_read)
+    return Check(bytes_read=bytes_read)
+
+
+def quarantine(plugin_name: str, version: str, path: Path) -> Path:
+    '''Moves a corrupted tarball out of the storage, and returns where to'''
+    name = f'{storage.check_segment(version)}-{int(time.time())}{storage.TARBALL_SUFFIX}'
+    destination = BASE_PATH / QUARANTINE_DIR / storage.check_segment(plugin_name) / name
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(path, destination)
+    tarball_cache.cache.invalidate(path)
+    deltas.discard(plugin_name, version)
+    return destination
+
+
+def get_state(db: Session) -> ScrubStateOrm:
+    state: ScrubStateOrm | None = db.query(ScrubStateOrm).get(1)
+    if state is None:
+        state = ScrubStateOrm(id=1, last_version_id=0, checked=0, bytes_read=0)
+        db.add(state)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Created by another worker meanwhile
+            db.rollback()
+            state = db.query(ScrubStateOrm).get(1)
+    return state
+
+
+def _claim(db: Session, now: datetime, batch_size: int) -> tuple[int, list[int]] | None:
+    '''
+    Moves the position of the scrubber past the next batch of versions, and
+    returns the previous position and the ids of the versions of the batch,
+    or None if another worker claimed it first.
+    '''
+    state = get_state(db)
+    start = state.last_version_id
+    version_ids = [
+        version_id for version_id, in
+        db
+        .query(PluginVersionOrm.id)
+        .filter(PluginVersionOrm.id > start)
+        .order_by(PluginVersionOrm.id)
+        .limit(batch_size)
+    ]
+    if version_ids:
+        values = {'last_version_id': version_ids[-1]}
+        if not start:
+            values.update(pass_started_at=now, checked=0, bytes_read=0)
+    else:
+        # End of the pass, the next batch starts the next one
+        values = {'last_version_id': 0, 'last_pass_finished_at': now}
+    claimed = (
+        db
+        .query(ScrubStateOrm)
+        .filter(ScrubStateOrm.id == 1, ScrubStateOrm.last_version_id == start)
+        .update(values, synchronize_session=False)
+    )
+    if claimed and not version_ids:
+        # Findings of the versions deleted since they were checked
+        db.query(ScrubFindingOrm).filter(ScrubFindingOrm.version_id > start).delete(synchronize_session=False)
+    db.commit()
+    return (start, version_ids) if claimed else None
+
+
+def scrub(
+    db: Session, now: datetime | None = None, batch_size: int = SCRUB_BATCH_SIZE, rate: int = SCRUB_RATE,
+) -> dict:
+    '''Checks the tarballs of the next batch of versions, and returns a report of the batch'''
+    now = now or datetime.now()
+    report = {'checked': 0, 'bytes_read': 0, 'findings': 0}
+    claim = _claim(db, now, batch_size)
+    if claim is None or not claim[1]:
+        return report
+    start, version_ids = claim
+    rows = (
+        db
+        .query(
+            PluginVersionOrm.id, PluginOrm.name, PluginVersionOrm.version,
+            PluginVersionOrm.size, PluginVersionOrm.digest,
+        )
+        .join(PluginOrm)
+        .filter(PluginVersionOrm.id.in_(version_ids))
+        .all()
+    )
+    # Not holding a transaction while reading the tarballs
+    db.commit()
+    throttle = Throttle(rate)
+    checks = {}
+    for version_id, plugin_name, version, size, digest in rows:
+        checks[version_id] = plugin_name, version, check(
+            storage.resolve_tarball(plugin_name, version), size, digest, throttle,
+        )
+        report['bytes_read'] += checks[version_id][2].bytes_read
+    report['checked'] = len(checks)
+
+    problems = [version_id for version_id, (_, _, result) in checks.items() if result.problem]
+    if problems:
+        # Versions deleted while they were checked are not reported
+        problems = [
+            version_id for version_id, in
+            db.query(PluginVersionOrm.id).filter(PluginVersionOrm.id.in_(problems))
+        ]
+    findings = {
+        finding.version_id: finding for finding in
+        db
+        .query(ScrubFindingOrm)
+        .filter(ScrubFindingOrm.version_id > start, ScrubFindingOrm.version_id <= version_ids[-1])
+    }
+    for version_id in problems:
+        plugin_name, version, result = checks[version_id]
+        finding = findings.pop(version_id, None)
+        if finding is not None and result.problem == MISSING:
+            # Already reported, missing or quarantined
+            continue
+        quarantine_path = None
+        if result.problem != MISSING:
+            quarantine_path = str(quarantine(plugin_name, version, storage.resolve_tarball(plugin_name, version)))
+            logger.error(
+                'Tarball of %s %s does not match its %s, moved to %s.',
+                plugin_name, version, result.problem, quarantine_path,
+            )
+        else:
+            logger.error('Tarball of %s %s is missing.', plugin_name, version)
+        db.merge(ScrubFindingOrm(
+            version_id=version_id, plugin_name=plugin_name, version=version, problem=result.problem,
+            expected=result.expected, actual=result.actual, quarantine_path=quarantine_path, found_at=now,
+        ))
+        report['findings'] += 1
+    # The others either check out now, or their version was deleted
+    for finding in findings.values():
+        db.delete(finding)
+    db.query(ScrubStateOrm).filter(ScrubStateOrm.id == 1).update({
+        'checked': ScrubStateOrm.checked + report['checked'],
+        'bytes_read': ScrubStateOrm.bytes_read + report['bytes_read'],
+    }, synchronize_session=False)
+    db.commit()
+    return report
+
+
+def status(db: Session, limit: int = 100) -> dict:
+    '''Returns the progress of the scrubber, and its most recent findings'''
+    state = db.query(ScrubStateOrm).get(1) or ScrubStateOrm(last_version_id=0, checked=0, bytes_read=0)
+    return {
+        'rate': SCRUB_RATE,
+        **state.dict(),
+        'remaining': db.query(func.count(PluginVersionOrm.id)).filter(
+            PluginVersionOrm.id > state.last_version_id
+        ).scalar(),
+        'findings_count': db.query(func.count(ScrubFindingOrm.version_id)).scalar(),
+        'findings': [
+            finding.dict() for finding in
+            db.query(ScrubFindingOrm).order_by(ScrubFindingOrm.found_at.desc()).limit(limit)
+        ],
+    }
+
+
+def scrub_task():
+    db = SessionLocal()
+    try:
+        report = scrub(db)
+    finally:
+        db.close()
+    if report['findings']:
+        logger.warning('Scrubbed %d tarballs, %d findings.', report['checked'], report['findings'])
+
+
+if SCRUB_RATE:
+    tasks.periodic(SCRUB_INTERVAL)(scrub_task)
@@ -0,0 +1,65 @@
+'''
+Short-lived session tokens.
+
+A maintainer exchanges a valid SSH signature for a token on
+`POST /v1/sessions`, then authenticates its next requests with an
+`Authorization: Bearer <token>` header, which only costs an HMAC to verify
+instead of an asymmetric signature. Tokens carry the fingerprint of the key
+they were issued for, an expiry, and optionally the plugins they are scoped
+to. Whether the key maintains the plugin is still checked on every request.
+'''
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import hashlib
+import hmac
+import json
+import secrets
+import time
+
+from cli_registry.config import SESSION_SECRET, SESSION_TTL
+
+
+BEARER_PREFIX = 'Bearer '
+
+_secret = SESSION_SECRET.encode('utf8') or secrets.token_bytes(32)
+
+
+def _encode(data: bytes) -> str:
+    return urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _decode(data: str) -> bytes:
+    return urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _encode(hmac.new(_secret, payload.encode('utf8'), hashlib.sha256).digest())
+
+
+def issue(fingerprint: str, plugins: list[str] | None = None, ttl: int = SESSION_TTL) -> tuple[str, int]:
+    '''
+    Returns a token for the key with that fingerprint, scoped to `plugins`
+    (or every plugin the key maintains), and the timestamp it expires at.
+    '''
+    expires_at = int(time.time()) + ttl
+    payload = _encode(json.dumps({'fp': fingerprint, 'plugins': plugins, 'exp': expires_at}).encode('utf8'))
+    return f'{payload}.{_sign(payload)}', expires_at
+
+
+def verify(token: str) -> dict | None:
+    '''Returns the payload of a token, or None if it is invalid or expired'''
+    payload, _, signature = token.partition('.')
+    # Compared as bytes, as compare_digest does not support non-ASCII strings
+    if not hmac.compare_digest(signature.encode('utf8'), _sign(payload).encode('utf8')):
+        return None
+    try:
+        data = json.loads(_decode(payload))
+    except ValueError:
+        return None
+    if data['exp'] < time.time():
+        return None
+    return data
+
+
+def allows(data: dict, plugin_name: str) -> bool:
+    '''Checks whether the scope of a verified token includes a plugin'''
+    return data['plugins'] is None or plugin_name in data['plugins']
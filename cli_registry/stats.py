@@ -0,0 +1,136 @@
+'''
+Download statistics.
+
+Downloads are counted in memory by each worker on the routes serving
+tarballs, and flushed to daily buckets in the download_stats table every
+STATS_FLUSH_INTERVAL seconds, in a single statement. The most downloaded
+plugins are ranked every POPULAR_REFRESH_INTERVAL seconds into the
+popular_plugins table, which is read as is by `GET /v1/popular`.
+'''
+from collections import Counter
+from datetime import date, datetime, timedelta
+import logging
+import threading
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from cli_registry.config import (
+    POPULAR_REFRESH_INTERVAL, POPULAR_SIZE, POPULAR_WINDOW_DAYS, STATS_FLUSH_INTERVAL,
+)
+from cli_registry.db import SessionLocal
+from cli_registry.models.plugin import PluginOrm
+from cli_registry.models.stats import DownloadStatOrm, PopularPluginOrm
+from cli_registry import tasks
+
+
+logger = logging.getLogger('cli_registry')
+
+_counts: Counter[tuple[str, str, date]] = Counter()
+_lock = threading.Lock()
+
+
+def record_download(plugin_name: str, version: str):
+    with _lock:
+        _counts[plugin_name, version, date.today()] += 1
+
+
+def flush(db: Session) -> int:
+    '''Adds the downloads counted since the last flush to the stats, and returns how many there were'''
+    with _lock:
+        counts = _counts.copy()
+        _counts.clear()
+    if not counts:
+        return 0
+    table = DownloadStatOrm.__table__
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.plugin_name, table.c.version, table.c.day],
+        set_={'downloads': table.c.downloads + statement.excluded.downloads},
+    )
+    try:
+        db.execute(statement, [
+            {'plugin_name': plugin_name, 'version': version, 'day': day, 'downloads': downloads}
+            for (plugin_name, version, day), downloads in counts.items()
+        ])
+        db.commit()
+    except Exception:
+        db.rollback()
+        # Kept for the next flush
+        with _lock:
+            _counts.update(counts)
+        raise
+    return sum(counts.values())
+
+
+def rank(db: Session, today: date | None = None) -> list[PopularPluginOrm]:
+    '''Recomputes the ranking of the most downloaded plugins over the last POPULAR_WINDOW_DAYS days'''
+    since = (today or date.today()) - timedelta(days=POPULAR_WINDOW_DAYS - 1)
+    downloads = func.sum(DownloadStatOrm.downloads)
+    rows = (
+        db
+        .query(DownloadStatOrm.plugin_name, downloads)
+        # Deleted plugins are not ranked
+        .join(PluginOrm, PluginOrm.name == DownloadStatOrm.plugin_name)
+        .filter(DownloadStatOrm.day >= since)
+        .group_by(DownloadStatOrm.plugin_name)
+        .order_by(downloads.desc(), DownloadStatOrm.plugin_name)
+        .limit(POPULAR_SIZE)
+        .all()
+    )
+    now = datetime.now()
+    ranking = [
+        PopularPluginOrm(rank=rank, plugin_name=plugin_name, downloads=count, computed_at=now)
+        for rank, (plugin_name, count) in enumerate(rows, start=1)
+    ]
+    db.query(PopularPluginOrm).delete()
+    db.add_all(ranking)
+    db.commit()
+    return ranking
+
+
+def popular(db: Session, limit: int) -> list[PopularPluginOrm]:
+    return db.query(PopularPluginOrm).order_by(PopularPluginOrm.rank).limit(limit).all()
+
+
+def plugin_stats(db: Session, plugin_name: str, days: int, today: date | None = None) -> dict:
+    '''Returns the downloads of a plugin over the last `days` days, by day and by version'''
+    since = (today or date.today()) - timedelta(days=days - 1)
+    rows = (
+        db
+        .query(DownloadStatOrm.day, DownloadStatOrm.version, DownloadStatOrm.downloads)
+        .filter(DownloadStatOrm.plugin_name == plugin_name, DownloadStatOrm.day >= since)
+        .all()
+    )
+    by_day: Counter[date] = Counter()
+    by_version: Counter[str] = Counter()
+    for day, version, downloads in rows:
+        by_day[day] += downloads
+        by_version[version] += downloads
+    return {
+        'since': since.isoformat(),
+        'downloads': sum(by_day.values()),
+        'days': [{'day': day.isoformat(), 'downloads': by_day[day]} for day in sorted(by_day)],
+        'versions': dict(by_version.most_common()),
+    }
+
+
+@tasks.periodic(STATS_FLUSH_INTERVAL)
+def flush_task():
+    db = SessionLocal()
+    try:
+        count = flush(db)
+    finally:
+        db.close()
+    if count:
+        logger.debug('Flushed %d downloads to the stats.', count)
+
+
+@tasks.periodic(POPULAR_REFRESH_INTERVAL)
+def rank_task():
+    db = SessionLocal()
+    try:
+        rank(db)
+    finally:
+        db.close()
@@ -0,0 +1,128 @@
+'''
+Layout of the files stored under BASE_PATH.
+
+Tarballs are sharded by a hash of the plugin name, then by a hash of the
+version, so that directories stay small with tens of thousands of plugins
+and plugins with thousands of versions:
+
+    plugins/<name hash[:2]>/<name hash[2:4]>/<name>/<version hash[:2]>/<version>.tar.gz
+
+Tarballs stored with the previous, flat layouts are still found until the
+`migrate-storage` command has moved them all, see `storage_migration`.
+Registries without any are marked as migrated on startup.
+'''
+import hashlib
+import itertools
+import os
+from pathlib import Path
+import uuid
+
+from cli_registry.config import BASE_PATH
+
+
+TARBALL_SUFFIX = '.tar.gz'
+MIGRATED_MARKER = '.layout-sharded'
+
+_migrated = False
+
+
+def _hash(value: str) -> str:
+    return hashlib.sha1(value.encode('utf8')).hexdigest()
+
+
+def is_path_segment(value: str) -> bool:
+    '''Whether a plugin name or version joined to a path stays a single segment of it'''
+    return value not in ('', '.', '..') and not any(char in value for char in '/\\\0')
+
+
+def check_segment(value: str) -> str:
+    '''Returns a plugin name or version to join to a path, raising ValueError if it could escape it'''
+    if not is_path_segment(value):
+        raise ValueError(f'{value!r} is not a single path segment.')
+    return value
+
+
+def plugin_dir(plugin_name: str) -> Path:
+    name_hash = _hash(check_segment(plugin_name))
+    return BASE_PATH / f'plugins/{name_hash[:2]}/{name_hash[2:4]}/{plugin_name}'
+
+
+def tarball_path(plugin_name: str, version: str) -> Path:
+    '''Returns the path where the tarball of a plugin's version is stored'''
+    return plugin_dir(plugin_name) / f'{_hash(version)[:2]}/{check_segment(version)}{TARBALL_SUFFIX}'
+
+
+def legacy_tarball_paths(plugin_name: str, version: str) -> list[Path]:
+    '''Returns the paths of a tarball in the layouts preceding the sharded one'''
+    check_segment(plugin_name)
+    # An empty version gives the directories of the plugin
+    if version:
+        check_segment(version)
+    return [
+        BASE_PATH / f'plugins/{plugin_name}/{version}{TARBALL_SUFFIX}',
+        BASE_PATH / f'{plugin_name}/{version}{TARBALL_SUFFIX}',
+    ]
+
+
+def is_migrated() -> bool:
+    global _migrated
+    if not _migrated:
+        _migrated = (BASE_PATH / MIGRATED_MARKER).exists()
+    return _migrated
+
+
+def has_legacy_tarballs() -> bool:
+    '''Whether any tarball is stored in the legacy layouts, found one directory under BASE_PATH or plugins/'''
+    paths = itertools.chain(BASE_PATH.glob(f'*/*{TARBALL_SUFFIX}'), BASE_PATH.glob(f'plugins/*/*{TARBALL_SUFFIX}'))
+    return next(paths, None) is not None
+
+
+def init_layout():
+    '''
+    Marks the storage as migrated when no tarball is stored in the legacy
+    layouts, as on new registries, so that tarballs are only looked up at their
+    sharded path rather than at every layout.
+    '''
+    if not is_migrated() and not has_legacy_tarballs():
+        BASE_PATH.mkdir(parents=True, exist_ok=True)
+        (BASE_PATH / MIGRATED_MARKER).touch()
+
+
+def resolve_tarball(plugin_name: str, version: str) -> Path:
+    '''
+    Returns the path of an existing tarball, looking it up in the legacy
+    layouts while the storage is being migrated. The sharded path is returned
+    when the tarball does not exist, as that is where it would be written.
+    '''
+    path = tarball_path(plugin_name, version)
+    if is_migrated() or path.exists():
+        return path
+    for legacy_path in legacy_tarball_paths(plugin_name, version):
+        if legacy_path.exists():
+            return legacy_path
+    # The tarball may have been moved by the migration between the lookups
+    return path
+
+
+def upload_path(upload_id: str) -> Path:
+    '''Returns the path to the partial file of an upload session'''
+    return BASE_PATH / f'uploads/{upload_id}.part'
+
+
+def staging_path(prefix: str) -> Path:
+    '''
+    Returns a new path to stage a file before it is moved in place. It is on
+    the same filesystem as the tarballs so that the move is an atomic rename.
+    '''
+    path = BASE_PATH / f'uploads/{prefix}-{uuid.uuid4().hex}.part'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def fsync_path(path: Path):
+    '''Flushes a file, or the entries of a directory, to disk'''
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,99 @@
+'''
+Online migration of the tarballs to the sharded layout of `storage`.
+
+Versions are migrated in id order, and the id of the last one migrated is
+saved after every batch, so that an interrupted migration resumes where it
+stopped. Each tarball is moved with an atomic rename, and `storage` keeps
+looking tarballs up in the legacy layouts until the migration completes,
+so the registry keeps serving them while they are moved.
+'''
+import json
+import logging
+import os
+
+from sqlalchemy.orm import Session, joinedload
+
+from cli_registry.config import BASE_PATH
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+from cli_registry import storage
+
+
+logger = logging.getLogger('cli_registry')
+
+STATE_FILE = '.storage-migration'
+
+
+def _load_cursor() -> int:
+    try:
+        return json.loads((BASE_PATH / STATE_FILE).read_text())['last_id']
+    except FileNotFoundError:
+        return 0
+
+
+def _save_cursor(last_id: int):
+    state_path = BASE_PATH / STATE_FILE
+    tmp_path = state_path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps({'last_id': last_id}))
+    os.replace(tmp_path, state_path)
+
+
+def migrate_version(plugin_name: str, version: str) -> bool:
+    '''Moves the tarball of a version to the sharded layout, returns whether it was moved'''
+    destination = storage.tarball_path(plugin_name, version)
+    moved = False
+    for legacy_path in storage.legacy_tarball_paths(plugin_name, version):
+        if not legacy_path.exists():
+            continue
+        if destination.exists():
+            # Already moved, or stored twice by the legacy layouts
+            legacy_path.unlink()
+            continue
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(legacy_path, destination)
+        moved = True
+    return moved
+
+
+def _remove_legacy_dirs(db: Session):
+    for (plugin_name,) in db.query(PluginOrm.name):
+        for legacy_path in storage.legacy_tarball_paths(plugin_name, ''):
+            try:
+                legacy_path.parent.rmdir()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logger.warning('Legacy directory %s is not empty, it was left in place.', legacy_path.parent)
+
+
+def migrate(db: Session, batch_size: int = 1000) -> int:
+    '''
+    Migrates the tarballs of every version to the sharded layout, resuming
+    from the last migration if it was interrupted. Returns the number of
+    tarballs moved.
+    '''
+    last_id = _load_cursor()
+    moved = 0
+    while True:
+        versions: list[PluginVersionOrm] = (
+            db
+            .query(PluginVersionOrm)
+            .options(joinedload(PluginVersionOrm.plugin))
+            .filter(PluginVersionOrm.id > last_id)
+            .order_by(PluginVersionOrm.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not versions:
+            break
+        for version in versions:
+            if version.plugin is not None and migrate_version(version.plugin.name, version.version):
+                moved += 1
+        last_id = versions[-1].id
+        _save_cursor(last_id)
+        db.expunge_all()
+        logger.info('Migrated tarballs up to version %d, %d moved so far.', last_id, moved)
+
+    _remove_legacy_dirs(db)
+    (BASE_PATH / storage.MIGRATED_MARKER).touch()
+    (BASE_PATH / STATE_FILE).unlink(missing_ok=True)
+    return moved
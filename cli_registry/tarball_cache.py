@@ -0,0 +1,136 @@
+'''
+In-memory cache of the most requested tarballs, within a memory budget.
+
+Tarballs up to TARBALL_CACHE_MMAP_THRESHOLD bytes are held as bytes, larger
+ones as read-only memory maps of their file, so that they are paged in by
+the OS rather than copied on the heap. The base85 encoded form embedded by
+the version routes is cached along with the tarball once it is requested,
+and counts against the budget too. The least recently used tarballs are
+evicted first.
+
+Entries are checked against the inode, size and modification time of their
+file on each hit, so that a tarball replaced or deleted by another worker
+is never served from the cache.
+'''
+from base64 import b85encode
+from collections import OrderedDict
+from dataclasses import dataclass
+import mmap
+import os
+from pathlib import Path
+import threading
+from typing import Iterator
+
+from cli_registry.config import TARBALL_CACHE_MMAP_THRESHOLD, TARBALL_CACHE_SIZE
+from cli_registry.utils import encode_file
+
+
+@dataclass
+class _Entry:
+    stat: tuple[int, int, int]
+    content: bytes | mmap.mmap
+    encoded: str | None = None
+
+    @property
+    def size(self) -> int:
+        return len(self.content) + len(self.encoded or '')
+
+
+class TarballCache:
+    '''Size-aware LRU cache of tarballs, and of their base85 encoded form'''
+    def __init__(
+        self, max_size: int = TARBALL_CACHE_SIZE, mmap_threshold: int = TARBALL_CACHE_MMAP_THRESHOLD,
+    ):
+        self.max_size = max_size
+        self.mmap_threshold = mmap_threshold
+        self.size = 0
+        self._entries: OrderedDict[Path, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, path: Path, size: int) -> bytes | mmap.mmap:
+        with open(path, 'rb') as f:
+            # Empty files cannot be mapped
+            if size <= self.mmap_threshold or size == 0:
+                return f.read()
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _evict(self):
+        # Memory maps are not closed, as they may still be read by a response,
+        # they are unmapped once the last reference to them is gone.
+        while self.size > self.max_size and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+
+    def _lookup(self, path: Path) -> _Entry | None:
+        '''
+        Returns the entry of a tarball, loading it if needed, or None if it
+        does not fit in the cache. Raises FileNotFoundError if it does not exist.
+        '''
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(path)
+            raise
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.stat == key:
+                self._entries.move_to_end(path)
+                return entry
+        if stat.st_size > self.max_size:
+            self.invalidate(path)
+            return None
+        entry = _Entry(key, self._load(path, stat.st_size))
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self.size -= previous.size
+            self._entries[path] = entry
+            self.size += entry.size
+            self._evict()
+        return entry
+
+    def get(self, path: Path) -> bytes | mmap.mmap | None:
+        '''
+        Returns the content of a tarball, or None if it is too large to be
+        cached. Raises FileNotFoundError if it does not exist.
+        '''
+        entry = self._lookup(path)
+        return None if entry is None else entry.content
+
+    def encoded(self, path: Path) -> str | None:
+        '''Returns the base85 encoded content of a tarball, or None if it does not exist'''
+        try:
+            entry = self._lookup(path)
+            if entry is None:
+                return encode_file(path)
+        except FileNotFoundError:
+            return None
+        if entry.encoded is not None:
+            return entry.encoded
+        encoded = b85encode(entry.content, True).decode('utf8')
+        with self._lock:
+            if self._entries.get(path) is entry and entry.encoded is None:
+                entry.encoded = encoded
+                self.size += len(encoded)
+                self._evict()
+        return encoded
+
+    def invalidate(self, path: Path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.size -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+cache = TarballCache()
+
+
+def iter_chunks(content: bytes | mmap.mmap, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    for start in range(0, len(content), chunk_size):
+        yield content[start:start + chunk_size]
@@ -0,0 +1,46 @@
+'''
+Periodic background tasks, started and stopped with the application.
+'''
+import asyncio
+import logging
+from typing import Callable
+
+from starlette.concurrency import run_in_threadpool
+
+
+logger = logging.getLogger('cli_registry')
+
+_periodic_tasks: list[tuple[float, Callable[[], None]]] = []
+_running: list[asyncio.Task] = []
+
+
+def periodic(interval: float):
+    '''
+    Registers a synchronous function to be run every `interval` seconds
+    in the threadpool while the application is running.
+    '''
+    def decorator(func: Callable[[], None]) -> Callable[[], None]:
+        _periodic_tasks.append((interval, func))
+        return func
+    return decorator
+
+
+async def _run_periodically(interval: float, func: Callable[[], None]):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(func)
+        except Exception:
+            logger.exception('Periodic task %s failed.', func.__name__)
+
+
+def start():
+    for interval, func in _periodic_tasks:
+        _running.append(asyncio.create_task(_run_periodically(interval, func)))
+
+
+async def stop():
+    for task in _running:
+        task.cancel()
+    await asyncio.gather(*_running, return_exceptions=True)
+    _running.clear()
@@ -0,0 +1,241 @@
+'''
+Resumable chunked uploads of plugin tarballs.
+
+An upload session is created for a given plugin version, then the client
+sends chunks of the raw (not base85 encoded) tarball along with the offset
+they start at. Chunks are appended to a partial file under BASE_PATH, whose
+size is the source of truth for the current offset, so that a client whose
+connection dropped can query it and resume from there. Finalizing the
+session verifies the digest of the assembled file before publishing it.
+'''
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO
+import uuid
+
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from cli_registry.config import UPLOAD_EXPIRY, UPLOAD_GC_INTERVAL
+from cli_registry.db import SessionLocal
+from cli_registry.models.plugin import PluginOrm
+from cli_registry.models.upload import UploadOrm
+from cli_registry.storage import staging_path, upload_path
+from cli_registry import tasks
+
+
+logger = logging.getLogger('cli_registry')
+
+
+class OffsetMismatch(Exception):
+    '''Raised when a chunk does not start at, or before, the current offset'''
+    def __init__(self, offset: int):
+        super().__init__(f'Upload is at offset {offset}.')
+        self.offset = offset
+
+
+def current_offset(upload: UploadOrm) -> int:
+    try:
+        return upload_path(upload.id).stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def stage_tarball(data: bytes) -> Path:
+    '''Writes a tarball published in one request next to the partial uploads, and syncs it to disk'''
+    path = staging_path('staged')
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return path
+
+
+@dataclass
+class StagedPart:
+    '''Part of a multipart body, staged to a file unless it is a plain field'''
+    field: str
+    path: Path | None = None
+    size: int = 0
+    digest: str = ''
+
+
+class MalformedMultipart(Exception):
+    '''Raised when a multipart body cannot be parsed, or has too many parts'''
+
+
+class MultipartStager:
+    '''
+    Parses a multipart body as it is received, and writes each file part
+    straight to a staged file next to the partial uploads, hashing it on the
+    way and syncing it to disk, rather than spooling the body before copying
+    it. Data of plain fields is discarded, only their name is kept. The body
+    is hashed as well, to be checked against the digest a signature covers.
+    '''
+
+    def __init__(self, content_type: str, max_parts: int):
+        mime_type, options = parse_options_header(content_type)
+        if mime_type != b'multipart/form-data' or not options.get(b'boundary'):
+            raise MalformedMultipart('Content-Type is not multipart/form-data with a boundary.')
+        self.parts: list[StagedPart] = []
+        self.body_digest = hashlib.sha256()
+        self._max_parts = max_parts
+        self._headers: dict[bytes, bytes] = {}
+        self._header_field = b''
+        self._header_value = b''
+        self._file: BinaryIO | None = None
+        self._digest = None
+        self._ended = False
+        self._parser = MultipartParser(options[b'boundary'], {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+            'on_end': self._on_end,
+        })
+
+    def write(self, chunk: bytes):
+        '''Parses the next chunk of the body, blocking on the writes of the staged files'''
+        self.body_digest.update(chunk)
+        try:
+            self._parser.write(chunk)
+        except MultipartParseError as e:
+            raise MalformedMultipart(f'Multipart body is not valid: {e}') from e
+
+    def finish(self):
+        self._parser.finalize()
+        if not self._ended:
+            raise MalformedMultipart('Multipart body is truncated.')
+
+    def close(self):
+        '''Unlinks the staged files, the ones which were published having been moved already'''
+        if self._file is not None:
+            self._file.close()
+        for part in self.parts:
+            if part.path is not None:
+                part.path.unlink(missing_ok=True)
+
+    def _on_part_begin(self):
+        if len(self.parts) >= self._max_parts:
+            raise MalformedMultipart(f'At most {self._max_parts} parts can be sent at once.')
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b''
+        self._header_value = b''
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        part = StagedPart(options.get(b'name', b'').decode('utf8', 'replace'))
+        self.parts.append(part)
+        if b'filename' in options:
+            part.path = staging_path('bulk')
+            self._file = open(part.path, 'wb')
+            self._digest = hashlib.sha256()
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._file is not None:
+            chunk = data[start:end]
+            self._file.write(chunk)
+            self._digest.update(chunk)
+            self.parts[-1].size += len(chunk)
+
+    def _on_part_end(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self.parts[-1].digest = self._digest.hexdigest()
+
+    def _on_end(self):
+        self._ended = True
+
+
+def create_upload(db: Session, plugin: PluginOrm, version: str) -> UploadOrm:
+    now = datetime.now()
+    upload = UploadOrm()
+    upload.id = uuid.uuid4().hex
+    upload.plugin = plugin
+    upload.version = version
+    upload.created_at = now
+    upload.expires_at = now + timedelta(seconds=UPLOAD_EXPIRY)
+    path = upload_path(upload.id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    db.add(upload)
+    return upload
+
+
+async def write_chunk(upload: UploadOrm, offset: int, chunks: AsyncIterator[bytes]) -> int:
+    '''
+    Writes the chunk streamed from `chunks` at `offset`, and returns the new offset.
+
+    The offset may be lower than the current one, in which case the data past
+    it is discarded: this allows to resend a chunk whose acknowledgement was lost.
+    '''
+    current = current_offset(upload)
+    if offset < 0 or offset > current:
+        raise OffsetMismatch(current)
+    # The file is written in the threadpool, not to block the event loop on the disk
+    fp = await run_in_threadpool(open, upload_path(upload.id), 'r+b')
+    try:
+        await run_in_threadpool(fp.truncate, offset)
+        fp.seek(offset)
+        async for chunk in chunks:
+            await run_in_threadpool(fp.write, chunk)
+        offset = fp.tell()
+    finally:
+        await run_in_threadpool(fp.close)
+    upload.expires_at = datetime.now() + timedelta(seconds=UPLOAD_EXPIRY)
+    return offset
+
+
+def discard_upload(db: Session, upload: UploadOrm):
+    try:
+        os.remove(upload_path(upload.id))
+    except FileNotFoundError:
+        pass
+    db.delete(upload)
+
+
+def collect_expired_uploads(db: Session, now: datetime | None = None) -> int:
+    '''Deletes the upload sessions that expired, and returns how many were deleted'''
+    now = now or datetime.now()
+    expired: list[UploadOrm] = (
+        db
+        .query(UploadOrm)
+        .filter(UploadOrm.expires_at < now)
+        .all()
+    )
+    for upload in expired:
+        discard_upload(db, upload)
+    db.commit()
+    return len(expired)
+
+
+@tasks.periodic(UPLOAD_GC_INTERVAL)
+def collect_expired_uploads_task():
+    db = SessionLocal()
+    try:
+        count = collect_expired_uploads(db)
+    finally:
+        db.close()
+    if count:
+        logger.info('Collected %d expired upload sessions.', count)
@@ -1,35 +1,86 @@
 from base64 import b64decode, b85encode
+from functools import lru_cache
+import hashlib
 from pathlib import Path
 
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization as crypto_serialization
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+
+
+@lru_cache(maxsize=1024)
+def load_public_key(authorization: str):
+    '''Parses an SSH public key, cached as it is sent with every authenticated request'''
+    return crypto_serialization.load_ssh_public_key(authorization.encode('utf8'))
 
 
 def check_auth(
     message: bytes, authorization: str, x_signature: str,
 ) -> bool:
-    '''Checks that the user is properly authorized and that the signature is valid'''
-    key = crypto_serialization.load_ssh_public_key(authorization.encode('utf8'))
+    '''
+    Checks that the user is properly authorized and that the signature is valid.
+    Ed25519 and RSA (signed with PSS padding and SHA256) keys are supported.
+    '''
+    try:
+        key = load_public_key(authorization)
+        signature = b64decode(x_signature)
+    except ValueError:
+        return False
     try:
-        key.verify(
-            b64decode(x_signature),
-            message,
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256(),
-        )
+        if isinstance(key, ed25519.Ed25519PublicKey):
+            key.verify(signature, message)
+        elif isinstance(key, rsa.RSAPublicKey):
+            key.verify(
+                signature,
+                message,
+                padding.PSS(
+                    mgf=padding.MGF1(hashes.SHA256()),
+                    salt_length=padding.PSS.MAX_LENGTH
+                ),
+                hashes.SHA256(),
+            )
+        else:
+            return False
     except InvalidSignature:
         return False
     return True
 
 
-def encode_file(file_path: Path) -> str:
+def request_message(method: str, path: str, content_sha256: str, timestamp: str) -> bytes:
+    '''
+    Returns the message signed for the routes exchanging a signature for
+    wider access, binding it to the method, the sha256 hex digest of the body
+    and the time of the request so that it cannot be replayed with another body.
+    '''
+    return '\n'.join((method.upper(), path, content_sha256.lower(), timestamp)).encode('utf8')
+
+
+def key_fingerprint(ssh_key: str) -> str:
+    '''
+    Returns the hex encoded sha256 digest of an SSH public key blob, ignoring
+    the key type and comment around it.
+    '''
+    parts = ssh_key.split()
     try:
-        with open(file_path, 'rb') as fp:
-            return b85encode(fp.read(), True).decode('utf8')
-    except FileNotFoundError:
-        return ''
+        blob = b64decode(parts[1], validate=True)
+    except (IndexError, ValueError):
+        blob = ssh_key.strip().encode('utf8')
+    return hashlib.sha256(blob).hexdigest()
+
+
+def encode_file(file_path: Path) -> str:
+    '''Returns the base85 encoded content of a file, raises FileNotFoundError if it does not exist'''
+    with open(file_path, 'rb') as fp:
+        return b85encode(fp.read(), True).decode('utf8')
+
+
+def file_digest(file_path: Path, chunk_size: int = 1024 * 1024) -> tuple[int, str]:
+    '''Returns the size and the hex encoded sha256 digest of a file, read in chunks'''
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, 'rb') as fp:
+        while chunk := fp.read(chunk_size):
+            digest.update(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
@@ -0,0 +1,160 @@
+'''
+Validation of the published tarballs, and extraction of their manifest.
+
+Plugins are gzipped tarballs containing a single python module built with
+typer. The manifest is read from a `plugin.json` member when there is one,
+otherwise it is extracted statically (without running any code) from the
+module docstring and its `__version__` attribute.
+
+Validation is CPU bound, and is meant to be run in the process pool through
+`workers.run_in_process(validate_tarball, path)`.
+'''
+import ast
+import json
+import os
+from pathlib import PurePosixPath
+import tarfile
+import zlib
+
+from cli_registry.config import (
+    MAX_COMPRESSION_RATIO, MAX_TARBALL_MEMBERS, MAX_UNCOMPRESSED_SIZE,
+)
+
+
+MANIFEST_NAME = 'plugin.json'
+MAX_MANIFEST_SIZE = 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+# Sizes of the matching columns of the versions table
+MAX_FIELD_LENGTHS = {'module': 255, 'description': 255, 'version': 20}
+MAX_DEPENDENCIES = 100
+MAX_PLUGIN_NAME_LENGTH = 255
+
+
+class InvalidTarball(Exception):
+    '''Raised when a tarball is corrupted, unsafe, or not a valid plugin'''
+
+
+def _drain(fileobj) -> int:
+    '''Reads a member to the end so that its data is decompressed and checked'''
+    size = 0
+    while chunk := fileobj.read(CHUNK_SIZE):
+        size += len(chunk)
+    return size
+
+
+def _check_member(member: tarfile.TarInfo):
+    path = PurePosixPath(member.name)
+    if path.is_absolute() or '..' in path.parts:
+        raise InvalidTarball(f'Member {member.name} has an unsafe path.')
+    if not (member.isfile() or member.isdir()):
+        raise InvalidTarball(f'Member {member.name} is not a regular file or directory.')
+
+
+def _manifest_from_module(name: str, source: bytes) -> dict:
+    try:
+        tree = ast.parse(source, filename=name)
+    except (SyntaxError, ValueError) as e:
+        raise InvalidTarball(f'Module {name} is not valid python: {e}')
+    docstring = ast.get_docstring(tree) or ''
+    declared_version = None
+    for node in tree.body:
+        if (
+            isinstance(node, ast.Assign)
+            and any(isinstance(t, ast.Name) and t.id == '__version__' for t in node.targets)
+            and isinstance(node.value, ast.Constant)
+        ):
+            declared_version = str(node.value.value)
+    return {
+        'module': PurePosixPath(name).stem,
+        'description': docstring.strip().splitlines()[0] if docstring.strip() else None,
+        'version': declared_version,
+    }
+
+
+def _dependencies(manifest: dict) -> list[str]:
+    '''Returns the names of the plugins a manifest depends on, as a list or as the keys of a mapping'''
+    declared = manifest.get('dependencies') or []
+    if not isinstance(declared, (list, dict)) or not all(isinstance(name, str) for name in declared):
+        raise InvalidTarball(f'Dependencies in {MANIFEST_NAME} must be a list of plugin names.')
+    if len(declared) > MAX_DEPENDENCIES:
+        raise InvalidTarball(f'Plugins cannot depend on more than {MAX_DEPENDENCIES} plugins.')
+    names = sorted({name.strip().lower() for name in declared})
+    if any(not name or len(name) > MAX_PLUGIN_NAME_LENGTH for name in names):
+        raise InvalidTarball(f'Dependencies in {MANIFEST_NAME} must be valid plugin names.')
+    return names
+
+
+def validate_tarball(path: str) -> dict:
+    '''
+    Stream decompresses the tarball at `path`, enforcing the size and member
+    limits from the configuration, and returns its manifest, a dict with the
+    `module`, `description`, `version` and `dependencies` keys.
+    '''
+    compressed_size = os.path.getsize(path)
+    max_size = min(MAX_UNCOMPRESSED_SIZE, max(compressed_size, 1) * MAX_COMPRESSION_RATIO)
+    manifest = None
+    module_manifest = None
+    total_size = 0
+    n_members = 0
+    try:
+        with tarfile.open(path, mode='r|gz') as tar:
+            for member in tar:
+                n_members += 1
+                if n_members > MAX_TARBALL_MEMBERS:
+                    raise InvalidTarball(f'Tarball has more than {MAX_TARBALL_MEMBERS} members.')
+                _check_member(member)
+                # Headers may lie about the size, so check it before and after reading
+                if total_size + member.size > max_size:
+                    raise InvalidTarball(f'Tarball uncompresses to more than {max_size} bytes.')
+                if not member.isfile():
+                    continue
+                fileobj = tar.extractfile(member)
+                is_manifest = member.name == MANIFEST_NAME
+                is_module = (
+                    module_manifest is None
+                    and len(PurePosixPath(member.name).parts) == 1
+                    and member.name.endswith('.py')
+                )
+                if is_manifest or is_module:
+                    data = fileobj.read() if member.size <= MAX_MANIFEST_SIZE else b''
+                    size = len(data) + _drain(fileobj)
+                    if is_manifest:
+                        try:
+                            manifest = json.loads(data)
+                        except ValueError as e:
+                            raise InvalidTarball(f'{MANIFEST_NAME} is not valid JSON: {e}')
+                    else:
+                        module_manifest = _manifest_from_module(member.name, data)
+                else:
+                    size = _drain(fileobj)
+                total_size += size
+                if total_size > max_size:
+                    raise InvalidTarball(f'Tarball uncompresses to more than {max_size} bytes.')
+    except (tarfile.TarError, zlib.error, EOFError, OSError) as e:
+        raise InvalidTarball(f'Tarball is not a valid gzipped tar archive: {e}')
+
+    if not isinstance(manifest, dict):
+        manifest = module_manifest
+    if manifest is None:
+        raise InvalidTarball(f'Tarball contains neither a {MANIFEST_NAME} nor a python module.')
+    return {
+        **{
+            key: None if manifest.get(key) is None else str(manifest[key])[:MAX_FIELD_LENGTHS[key]]
+            for key in ('module', 'description', 'version')
+        },
+        'dependencies': _dependencies(manifest),
+    }
+
+
+def manifest_warnings(manifest: dict, version: str) -> list[str]:
+    '''Returns warnings about a valid manifest, published as `version`'''
+    warnings = []
+    if manifest['version'] is None:
+        warnings.append('The plugin does not declare its version.')
+    elif manifest['version'] != version:
+        warnings.append(
+            f'The plugin declares version {manifest["version"]}, but is published as {version}.'
+        )
+    if manifest['description'] is None:
+        warnings.append('The plugin does not have a description.')
+    return warnings
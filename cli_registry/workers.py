@@ -0,0 +1,40 @@
+'''
+Process pool used to run CPU bound work without blocking the event loop.
+'''
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from cli_registry.config import PROCESS_POOL_WORKERS
+
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS)
+    return _executor
+
+
+async def run_in_process(func: Callable, *args) -> Any:
+    '''
+    Runs `func(*args)` in the process pool. Both the function and its
+    arguments must be picklable, so prefer passing paths over file contents.
+    '''
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_executor(), func, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM killed), start a fresh pool for the next calls
+        shutdown()
+        raise
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
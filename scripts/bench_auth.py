@@ -0,0 +1,58 @@
+'''
+Compares the cost of verifying the authentication of a request with an RSA
+signature, an Ed25519 signature, and a session token.
+
+    poetry run poe bench_auth
+'''
+from base64 import b64encode
+import timeit
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+
+from cli_registry import sessions
+from cli_registry.utils import check_auth, key_fingerprint, load_public_key
+
+
+MESSAGE = b'/v1/plugins/spam/versions/1.0.0'
+
+
+def openssh_public_key(priv_key) -> str:
+    return priv_key.public_key().public_bytes(
+        serialization.Encoding.OpenSSH, serialization.PublicFormat.OpenSSH
+    ).decode('utf8')
+
+
+def bench(name: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f'{name:<40} {seconds * 1e6:>10.1f} µs/verify {1 / seconds:>12.0f} verify/s')
+
+
+def main():
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    rsa_pub_key = openssh_public_key(rsa_key)
+    rsa_signature = b64encode(rsa_key.sign(
+        MESSAGE,
+        padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
+        hashes.SHA256(),
+    )).decode('utf8')
+
+    ed25519_key = ed25519.Ed25519PrivateKey.generate()
+    ed25519_pub_key = openssh_public_key(ed25519_key)
+    ed25519_signature = b64encode(ed25519_key.sign(MESSAGE)).decode('utf8')
+
+    token, _ = sessions.issue(key_fingerprint(rsa_pub_key))
+
+    def uncached(pub_key, signature):
+        load_public_key.cache_clear()
+        return check_auth(MESSAGE, pub_key, signature)
+
+    bench('RSA 2048 (key parsed on each request)', lambda: uncached(rsa_pub_key, rsa_signature), 500)
+    bench('RSA 2048', lambda: check_auth(MESSAGE, rsa_pub_key, rsa_signature), 500)
+    bench('Ed25519 (key parsed on each request)', lambda: uncached(ed25519_pub_key, ed25519_signature), 500)
+    bench('Ed25519', lambda: check_auth(MESSAGE, ed25519_pub_key, ed25519_signature), 500)
+    bench('Session token', lambda: sessions.verify(token), 20000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+'''
+Measures the throughput of `cli_registry.client` against a local registry,
+started in a temporary directory, compared to a request per connection as
+sent with urllib.
+
+    poetry run poe bench_client
+'''
+import io
+import json
+import os
+from pathlib import Path
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from urllib.request import urlopen
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from cli_registry.client import Client
+
+
+PLUGINS = 50
+VERSIONS = 4
+TARBALL_SIZE = 256 * 1024
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_registry(root: Path) -> tuple[str, subprocess.Popen]:
+    port = free_port()
+    env = {
+        **os.environ,
+        'SQL_DATABASE_PATH': str(root / 'database/app.db'),
+        'DIRECTORY_PATH': str(root / 'files'),
+        'HOST': '127.0.0.1',
+        'PORT': str(port),
+    }
+    subprocess.run([sys.executable, '-m', 'cli_registry'], env={**env, 'RUN_MIGRATIONS': 'true'}, check=True)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'cli_registry'], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        try:
+            urlopen(f'{url}/v1/replication', timeout=1).read()
+            return url, process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise TimeoutError('Registry did not start.')
+
+
+def make_tarball(path: Path, version: str) -> Path:
+    members = {
+        'plugin.json': json.dumps({'module': 'plugin', 'version': version}).encode('utf8'),
+        'plugin.py': f'__version__ = "{version}"'.encode('utf8'),
+        # Random, so that it does not compress
+        'data.bin': os.urandom(TARBALL_SIZE),
+    }
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def bench(name: str, func, count: int, size: int = 0):
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    throughput = f'{size / seconds / 1024 ** 2:>8.1f} MiB/s' if size else ''
+    print(f'{name:<45} {count / seconds:>8.0f} req/s {throughput}')
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        url, process = start_registry(root)
+        private_key = ed25519.Ed25519PrivateKey.generate().private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH, serialization.NoEncryption(),
+        )
+        try:
+            with Client(url, private_key, cache_dir=root / 'cache') as client:
+                names = [f'plugin-{i}' for i in range(PLUGINS)]
+                versions = [(name, f'1.0.{i}') for name in names for i in range(VERSIONS)]
+                tarballs = {
+                    version: make_tarball(root / f'{version}.tar.gz', version) for _, version in versions[:VERSIONS]
+                }
+
+                def publish():
+                    for name in names:
+                        client.create_plugin(name)
+                    for name, version in versions:
+                        client.publish(name, version, tarballs[version])
+                bench('Publish (session token)', publish, len(versions))
+                size = sum(path.stat().st_size for path in tarballs.values()) * PLUGINS
+
+                bench(
+                    'Metadata, a connection per request (urllib)',
+                    lambda: [urlopen(f'{url}/v1/plugins/{name}').read() for name in names], PLUGINS,
+                )
+                bench('Metadata, pooled connections', lambda: [client.plugin(name) for name in names], PLUGINS)
+                bench('Metadata, concurrent', lambda: client.plugins(names), PLUGINS)
+
+                bench(
+                    'Downloads, a connection per request (urllib)',
+                    lambda: [
+                        urlopen(f'{url}/v1/plugins/{name}/versions/{version}/download').read()
+                        for name, version in versions
+                    ],
+                    len(versions), size,
+                )
+                bench('Downloads, parallel', lambda: client.download_many(versions), len(versions), size)
+                bench('Downloads, parallel, revalidated', lambda: client.download_many(versions), len(versions))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,25 @@
 from datetime import datetime
+import os
 from pathlib import Path
-
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
 from fastapi.testclient import TestClient
 import pytest
+import requests
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session, Session
+from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.engine import Connection
 
 from cli_registry.app import app
 from cli_registry.db import Base
 from cli_registry import dependancies as deps
+from cli_registry import catalog, deltas, permissions, pipeline, tarball_cache
 from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
 from cli_registry.models.maintainer import MaintainerOrm
 
@@ -116,6 +126,7 @@ def seed_database(session: Session, data_dir: Path):
     for version in versions:
         db_version = PluginVersionOrm(**version)
         session.add(db_version)
+    catalog.rebuild(session)
 
     session.commit()
 
@@ -133,22 +144,26 @@ def setup_database(connection: Connection):
 @pytest.fixture
 def db_session(setup_database, connection: Connection, data_dir: Path):
     transaction = connection.begin()
-    session = scoped_session(
-        sessionmaker(autocommit=False, autoflush=False, bind=connection)
-    )
+    # A single session shared by every thread, as the sync dependencies run in a threadpool
+    session = sessionmaker(autocommit=False, autoflush=False, bind=connection)()
     seed_database(session, data_dir)
     yield session
     transaction.rollback()
 
 
 @pytest.fixture
-def client(db_session: Session) -> TestClient:
+def client(db_session: Session, monkeypatch: pytest.MonkeyPatch) -> TestClient:
     def override_get_db():
         return db_session
     app.dependency_overrides[deps.db] = override_get_db
+    monkeypatch.setattr(pipeline, 'session_factory', override_get_db)
+    monkeypatch.setattr(deltas, 'session_factory', override_get_db)
+    permissions.cache.clear()
+    tarball_cache.cache.clear()
     test_client = TestClient(app)
     yield test_client
 
+    pipeline.shutdown()
     db_session.close()
 
 
@@ -197,6 +212,13 @@ def priv_key_spameggs(data_dir: Path) -> str:
     return (data_dir / 'maintainers/spam.eggs').read_text()
 
 
+@pytest.fixture
+def private_key() -> bytes:
+    return ed25519.Ed25519PrivateKey.generate().private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH, serialization.NoEncryption(),
+    )
+
+
 @pytest.fixture
 def file(data_dir: Path) -> dict:
     data = (data_dir / 'plugin.tar.gz').read_bytes()
@@ -205,3 +227,64 @@ def file(data_dir: Path) -> dict:
             '3.0.0.tar.gz', data, 'application/tar+gzip'
         )
     }
+
+
+@pytest.fixture
+def base_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    '''Redirects the storage of the registry to a temporary directory'''
+    for name, module in list(sys.modules.items()):
+        if name.startswith('cli_registry') and hasattr(module, 'BASE_PATH'):
+            monkeypatch.setattr(module, 'BASE_PATH', tmp_path)
+    return tmp_path
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def live_server(tmp_path: Path) -> Callable[..., str]:
+    '''
+    Returns a function starting a registry in a separate process, with its own
+    database and storage, configured with the environment variables passed
+    as keyword arguments. It returns the URL of the registry.
+    '''
+    root_dir = Path(__file__).parent.parent
+    processes: list[subprocess.Popen] = []
+
+    def start(name: str, **env: str) -> str:
+        port = free_port()
+        environ = {
+            **os.environ,
+            'SQL_DATABASE_PATH': str(tmp_path / f'{name}/database/app.db'),
+            'DIRECTORY_PATH': str(tmp_path / f'{name}/files'),
+            'HOST': '127.0.0.1',
+            'PORT': str(port),
+            **env,
+        }
+        if not env.get('REPLICA_OF'):
+            subprocess.run(
+                [sys.executable, '-m', 'cli_registry'], env={**environ, 'RUN_MIGRATIONS': 'true'},
+                cwd=root_dir, check=True, capture_output=True,
+            )
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'cli_registry'], env=environ, cwd=root_dir,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+        url = f'http://127.0.0.1:{port}'
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                requests.get(f'{url}/v1/replication', timeout=1)
+                return url
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        raise TimeoutError(f'Registry {name} did not start.')
+
+    yield start
+
+    for process in processes:
+        process.terminate()
+        process.wait()
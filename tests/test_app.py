@@ -1,19 +1,26 @@
-from base64 import b64encode
+from base64 import b64encode, b85encode
+import hashlib
 from pathlib import Path
+import time
 
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import padding, rsa
 from fastapi.testclient import TestClient
 import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 
+from cli_registry import storage
+from cli_registry.utils import request_message
 
-def make_headers(url: str, priv_key_str: str, pub_key: str) -> dict:
+
+def make_headers(url: str, priv_key_str: str, pub_key: str, message: bytes | None = None) -> dict:
     priv_key: rsa.RSAPrivateKey = serialization.load_pem_private_key(
         priv_key_str.encode('utf8'), None
     )
     signature = b64encode(
         priv_key.sign(
-            url.encode('utf8'),
+            message if message is not None else url.encode('utf8'),
             padding.PSS(
                 mgf=padding.MGF1(hashes.SHA256()),
                 salt_length=padding.PSS.MAX_LENGTH
@@ -27,6 +34,16 @@ def make_headers(url: str, priv_key_str: str, pub_key: str) -> dict:
     }
 
 
+def make_request_headers(
+    method: str, url: str, body: bytes, priv_key_str: str, pub_key: str, timestamp: int | None = None,
+) -> dict:
+    '''Headers signing the method, path, body digest and time of a request, as for POST /v1/sessions'''
+    digest = hashlib.sha256(body).hexdigest()
+    timestamp = str(int(time.time()) if timestamp is None else timestamp)
+    headers = make_headers(url, priv_key_str, pub_key, request_message(method, url, digest, timestamp))
+    return {**headers, 'X-Timestamp': timestamp, 'X-Content-SHA256': digest}
+
+
 def test_list_plugins(client: TestClient):
     response = client.get('/v1/plugins?page=1&page_size=10')
     assert response.status_code == 200, response.text
@@ -106,6 +123,37 @@ def test_get_plugin_version(client: TestClient):
     assert response.json()['detail'] == 'Version 0.0.0 not found for plugin plugin_1.'
 
 
+def test_get_plugin_version_fields(client: TestClient, db_session: Session, base_path: Path):
+    statements = []
+
+    def record(*args):
+        statements.append(args[2])
+    event.listen(db_session.bind, 'before_cursor_execute', record)
+    try:
+        response = client.get('/v1/plugins/plugin_1/versions/latest?fields=version,digest')
+    finally:
+        event.remove(db_session.bind, 'before_cursor_execute', record)
+    assert response.status_code == 200, response.text
+    assert response.json()['data'] == {'version': '2.0.1', 'digest': None}
+    # Only the requested columns are loaded, and the tarball is not read
+    assert not any('versions.description' in statement for statement in statements)
+
+    path = storage.tarball_path('plugin_1', '2.0.1')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'spam')
+    response = client.get('/v1/plugins/plugin_1/versions/2.0.1?fields=id&include=file')
+    assert response.json()['data'] == {'id': 5, 'file': b85encode(b'spam', True).decode('utf8')}
+
+    response = client.get('/v1/plugins?fields=name')
+    assert response.json()['data'] == [{'name': f'plugin_{i}'} for i in range(1, 4)]
+    for url in (
+        '/v1/plugins/plugin_1/versions?fields=spam', '/v1/plugins/plugin_1?fields=',
+        '/v1/plugins/plugin_1/versions/latest?include=spam',
+    ):
+        response = client.get(url)
+        assert response.status_code == 422, response.text
+
+
 def test_create_plugin_ok(client: TestClient, pub_key_johndoe: str):
     payload = {
         'name': 'plugin_4'
@@ -143,6 +191,12 @@ def test_create_plugin_already_exists(client: TestClient, pub_key_johndoe: str):
     assert response.status_code == 406, response.text
 
 
+@pytest.mark.parametrize('name', ['..', 'plugin_1/..', 'plugin\\4'])
+def test_create_plugin_unsafe_name(client: TestClient, pub_key_johndoe: str, name: str):
+    response = client.post('/v1/plugins', json={'name': name}, headers={'Authorization': pub_key_johndoe})
+    assert response.status_code == 422, response.text
+
+
 def test_create_plugin_no_auth(client: TestClient):
     payload = {
         'name': 'plugin_4'
@@ -180,7 +234,6 @@ def test_create_plugin_create_maintainer(client: TestClient, pub_key_newguy: str
     assert 'new.guy@example.com' in [d['email'] for d in data], 'new.guy@example.com not in maintainers list.'  # noqa
 
 
-@pytest.mark.skip
 def test_add_new_maintainer_to_plugin(
     client: TestClient, pub_key_newguy: str, priv_key_johndoe: str, pub_key_johndoe: str
 ):
@@ -201,7 +254,6 @@ def test_add_new_maintainer_to_plugin(
     assert response.status_code == 201, response.text
 
 
-@pytest.mark.skip
 def test_add_existing_maintainer_to_plugin(
     client: TestClient, pub_key_johndoe: str, priv_key_spameggs: str, pub_key_spameggs: str
 ):
@@ -237,3 +289,41 @@ def test_create_plugin_version(
     )
 
     assert response.status_code == 201, response.text
+
+
+def test_create_plugin_version_json(
+    client: TestClient, base_path: Path, data_dir: Path,
+    pub_key_johndoe: str, priv_key_johndoe: str
+):
+    url = '/v1/plugins/plugin_1/versions/3.0.0'
+    tarball = b85encode((data_dir / 'plugin.tar.gz').read_bytes()).decode('utf8')
+    response = client.post(
+        url, json={'tarball': tarball},
+        headers=make_headers(url, priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 201, response.text
+    data = response.json()['data']
+    assert data['module'] == 'plugin'
+    assert data['description'] == 'Converts dates to different formats'
+    assert len(data['warnings']) == 1, data['warnings']
+
+
+def test_create_plugin_version_invalid_tarball(
+    client: TestClient, base_path: Path, pub_key_johndoe: str, priv_key_johndoe: str
+):
+    url = '/v1/plugins/plugin_1/versions/3.0.0'
+    response = client.post(
+        url, json={'tarball': b85encode(b'spam').decode('utf8')},
+        headers=make_headers(url, priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 422, response.text
+
+    response = client.get('/v1/plugins/plugin_1/versions/latest')
+    assert response.json()['data']['version'] == '2.0.1'
+
+
+def test_get_plugin_version_latest_no_version(client: TestClient, pub_key_johndoe: str):
+    client.post('/v1/plugins', json={'name': 'plugin_4'}, headers={'Authorization': pub_key_johndoe})
+    response = client.get('/v1/plugins/plugin_4/versions/latest')
+    assert response.status_code == 404, response.text
+    assert response.json()['detail'] == 'No version published for plugin plugin_4.'
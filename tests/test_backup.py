@@ -0,0 +1,111 @@
+import io
+from pathlib import Path
+import tarfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from cli_registry import backup, storage
+from cli_registry.db import Base
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+from tests.conftest import seed_database
+
+
+@pytest.fixture
+def registry(tmp_path: Path, base_path: Path, data_dir: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    '''Creates a database with the seeded versions, and stores a tarball for each of them'''
+    monkeypatch.setattr(storage, '_migrated', False)
+    database_path = tmp_path / 'registry.db'
+    engine = create_engine(f'sqlite:///{database_path}')
+    Base.metadata.create_all(engine)
+    db = Session(bind=engine)
+    seed_database(db, data_dir)
+    for version in db.query(PluginVersionOrm):
+        path = storage.tarball_path(version.plugin.name, version.version)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(f'{version.plugin.name} {version.version}'.encode('utf8') * 1000)
+    db.close()
+    engine.dispose()
+    return database_path
+
+
+def export(registry: Path, tmp_path: Path) -> Path:
+    archive_path = tmp_path / 'export.tar'
+    with open(archive_path, 'wb') as out:
+        backup.export(out, str(registry))
+    return archive_path
+
+
+def remove_tarballs(base_path: Path):
+    for path in (base_path / 'plugins').rglob(f'*{storage.TARBALL_SUFFIX}'):
+        path.unlink()
+
+
+def test_export_and_import(registry: Path, tmp_path: Path, base_path: Path):
+    archive_path = export(registry, tmp_path)
+    remove_tarballs(base_path)
+
+    restored_path = tmp_path / 'restored/app.db'
+    manifest = backup.restore(archive_path, str(restored_path), workers=4)
+    assert len(manifest['versions']) == 6
+    assert manifest['missing'] == []
+    engine = create_engine(f'sqlite:///{restored_path}')
+    db = Session(bind=engine)
+    try:
+        versions = db.query(PluginOrm.name, PluginVersionOrm.version).join(PluginOrm).all()
+        assert len(versions) == 6
+        for plugin_name, version in versions:
+            content = storage.tarball_path(plugin_name, version).read_bytes()
+            assert content == f'{plugin_name} {version}'.encode('utf8') * 1000
+    finally:
+        db.close()
+        engine.dispose()
+    assert (base_path / storage.MIGRATED_MARKER).exists()
+
+
+def test_export_is_streamed(registry: Path, base_path: Path):
+    class Stream(io.RawIOBase):
+        '''Non-seekable output'''
+        def __init__(self):
+            self.data = bytearray()
+
+        def writable(self):
+            return True
+
+        def write(self, data):
+            self.data += data
+            return len(data)
+
+    storage.tarball_path('plugin_1', '1.0.0').unlink()
+    out = Stream()
+    manifest = backup.export(out, str(registry))
+    assert manifest['missing'] == [{'plugin_name': 'plugin_1', 'version': '1.0.0'}]
+    with tarfile.open(fileobj=io.BytesIO(out.data)) as archive:
+        names = archive.getnames()
+    assert names[0] == backup.DATABASE_MEMBER and names[-1] == backup.MANIFEST_MEMBER
+    assert len(names) == 7
+    # The snapshot of the database was removed
+    assert not list((base_path / 'uploads').iterdir())
+
+
+def test_import_verifies_digests(registry: Path, tmp_path: Path, base_path: Path):
+    archive_path = export(registry, tmp_path)
+    remove_tarballs(base_path)
+    with tarfile.open(archive_path) as archive:
+        member = archive.getmember(backup.tarball_member('plugin_2', '1.0.0'))
+    with open(archive_path, 'r+b') as fp:
+        fp.seek(member.offset_data)
+        fp.write(b'spam')
+
+    restored_path = tmp_path / 'restored/app.db'
+    with pytest.raises(backup.BackupError, match='plugin_2 1.0.0'):
+        backup.restore(archive_path, str(restored_path))
+    assert not restored_path.exists()
+    assert not storage.tarball_path('plugin_2', '1.0.0').exists()
+
+
+def test_import_into_existing_registry(registry: Path, tmp_path: Path):
+    archive_path = export(registry, tmp_path)
+    with pytest.raises(backup.BackupError, match='already exists'):
+        backup.restore(archive_path, str(registry))
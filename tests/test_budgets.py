@@ -0,0 +1,279 @@
+'''
+Runs every route against seeded datasets of increasing size, and checks
+that they stay within the budget declared next to them in app.py.
+'''
+from base64 import b64encode, b85encode
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+import hashlib
+import json
+from pathlib import Path
+import tracemalloc
+from typing import Callable
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from urllib3 import encode_multipart_formdata
+
+from cli_registry.app import app
+from cli_registry.budgets import get_budget
+from cli_registry.db import Base
+from cli_registry import dependancies as deps
+from cli_registry import catalog, deltas, events, permissions, pipeline, profiling
+from cli_registry.models.dependency import PluginClosureOrm, VersionDependencyOrm
+from cli_registry.models.maintainer import MaintainerOrm
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+from cli_registry.models.scrub import ScrubFindingOrm
+from cli_registry.models.stats import DownloadStatOrm, PopularPluginOrm
+from cli_registry.models.upload import UploadOrm
+from cli_registry.uploads import upload_path
+from tests.test_app import make_headers, make_request_headers
+
+
+SIZES = (3, 12)
+UPLOAD_ID = '0' * 32
+PROFILE_ID = '1' * 32
+
+
+@dataclass
+class Context:
+    '''What the requests of the cases need to know about the seeded dataset'''
+    pub_key: str
+    priv_key: str
+    new_pub_key: str
+    tarball: bytes
+
+    def signed(self, path: str) -> dict:
+        return make_headers(path, self.priv_key, self.pub_key)
+
+    def signed_request(self, method: str, path: str, body: bytes, content_type: str) -> dict:
+        '''Request signing its method, path, body and time, with the body sent as is'''
+        headers = make_request_headers(method, path, body, self.priv_key, self.pub_key)
+        return {'data': body, 'headers': {**headers, 'Content-Type': content_type}}
+
+
+def seed(db: Session, size: int, ctx: Context):
+    '''
+    Seeds `size` plugins, each with `size` versions downloaded on `size` days
+    and maintained by `size` maintainers, and depending on the previous one.
+    The first maintainer holds the key used to sign requests.
+    '''
+    maintainers = [MaintainerOrm(email='john.doe@example.com', ssh_key=ctx.pub_key)]
+    for i in range(1, size):
+        key = b64encode(f'maintainer {i}'.encode('utf8')).decode('utf8')
+        maintainers.append(MaintainerOrm(email=f'maintainer.{i}@example.com', ssh_key=f'ssh-rsa {key}'))
+    db.add_all(maintainers)
+    for i in range(size):
+        plugin = PluginOrm(name=f'plugin_{i}')
+        plugin.maintainers.extend(maintainers)
+        db.add(plugin)
+        for j in range(size):
+            version = PluginVersionOrm(
+                version=f'1.0.{j}', upload_date=datetime(2022, 1, 1) + timedelta(days=j),
+                size=len(ctx.tarball), digest=hashlib.sha256(ctx.tarball).hexdigest(),
+            )
+            version.plugin = plugin
+            db.add(version)
+            if i > 0:
+                db.flush()
+                db.add(VersionDependencyOrm(version_id=version.id, dependency_name=f'plugin_{i - 1}'))
+            version.file_path.parent.mkdir(parents=True, exist_ok=True)
+            version.file_path.write_bytes(ctx.tarball)
+            db.add_all(
+                DownloadStatOrm(plugin_name=plugin.name, version=version.version, day=date.today() - timedelta(days=k))
+                for k in range(size)
+            )
+        db.add_all(
+            PluginClosureOrm(plugin_name=plugin.name, dependency_name=f'plugin_{k}', depth=i - k) for k in range(i)
+        )
+        db.add(PopularPluginOrm(rank=i + 1, plugin_name=plugin.name, downloads=size - i, computed_at=datetime.now()))
+        db.flush()
+        db.add(ScrubFindingOrm(
+            version_id=version.id, plugin_name=plugin.name, version=version.version, problem='missing',
+            found_at=datetime.now(),
+        ))
+        if i == 1:
+            upload = UploadOrm(
+                id=UPLOAD_ID, version='2.0.0',
+                created_at=datetime.now(), expires_at=datetime.now() + timedelta(days=1),
+            )
+            upload.plugin = plugin
+            db.add(upload)
+    upload_path(UPLOAD_ID).parent.mkdir(parents=True, exist_ok=True)
+    upload_path(UPLOAD_ID).write_bytes(ctx.tarball)
+    catalog.rebuild(db)
+    db.commit()
+
+
+def upload_headers(ctx: Context, path: str) -> dict:
+    return {**ctx.signed(path), 'Upload-Offset': '0'}
+
+
+PROFILE = {'X-Profile-Secret': 'spam'}
+
+# Route name: function returning the method, the URL and the keyword arguments of a request
+CASES: dict[str, Callable[[Context], tuple[str, str, dict]]] = {
+    'list_plugins': lambda ctx: ('GET', '/v1/plugins', {}),
+    'get_plugin': lambda ctx: ('GET', '/v1/plugins/plugin_1', {}),
+    'list_plugin_versions': lambda ctx: ('GET', '/v1/plugins/plugin_1/versions', {}),
+    'get_plugin_version_latest': lambda ctx: ('GET', '/v1/plugins/plugin_1/versions/latest?include=file', {}),
+    'get_plugin_version': lambda ctx: ('GET', '/v1/plugins/plugin_1/versions/1.0.1?include=file', {}),
+    'download_plugin_version': lambda ctx: ('GET', '/v1/plugins/plugin_1/versions/1.0.1/download', {}),
+    'get_plugin_version_closure': lambda ctx: ('GET', '/v1/plugins/plugin_2/versions/1.0.1/closure', {}),
+    'get_plugin_stats': lambda ctx: ('GET', '/v1/plugins/plugin_1/stats', {}),
+    'list_popular_plugins': lambda ctx: ('GET', '/v1/popular', {}),
+    'list_changes': lambda ctx: ('GET', '/v1/changes', {}),
+    'stream_events': lambda ctx: ('GET', '/v1/events', {'headers': {'Last-Event-ID': '0'}}),
+    'get_replication_status': lambda ctx: ('GET', '/v1/replication', {}),
+    'create_plugin': lambda ctx: (
+        'POST', '/v1/plugins',
+        {'json': {'name': 'spam'}, 'headers': {'Authorization': ctx.new_pub_key}},
+    ),
+    'create_session': lambda ctx: (
+        'POST', '/v1/sessions',
+        ctx.signed_request('POST', '/v1/sessions', b'{"plugins": ["plugin_1"]}', 'application/json'),
+    ),
+    'list_plugin_maintainers': lambda ctx: ('GET', '/v1/plugins/plugin_1/maintainers', {}),
+    'add_maintainer_to_plugin': lambda ctx: (
+        'POST', '/v1/plugins/plugin_1/maintainers',
+        {
+            'json': {'email': 'new.guy@example.com', 'ssh_key': ctx.new_pub_key},
+            'headers': ctx.signed('/v1/plugins/plugin_1/maintainers'),
+        },
+    ),
+    'create_plugin_version': lambda ctx: (
+        'POST', '/v1/plugins/plugin_1/versions/2.0.0',
+        {
+            'json': {'tarball': b85encode(ctx.tarball).decode('utf8')},
+            'headers': ctx.signed('/v1/plugins/plugin_1/versions/2.0.0'),
+        },
+    ),
+    'create_plugin_versions': lambda ctx: (
+        'POST', '/v1/bulk/versions',
+        ctx.signed_request('POST', '/v1/bulk/versions', *encode_multipart_formdata({
+            'plugin_0/2.0.0': ('plugin_0-2.0.0.tar.gz', ctx.tarball),
+            'plugin_1/2.0.0': ('plugin_1-2.0.0.tar.gz', ctx.tarball),
+        })),
+    ),
+    'create_plugin_version_upload': lambda ctx: (
+        'POST', '/v1/plugins/plugin_1/versions/2.0.0/uploads',
+        {'headers': ctx.signed('/v1/plugins/plugin_1/versions/2.0.0/uploads')},
+    ),
+    'get_plugin_version_upload': lambda ctx: ('GET', f'/v1/plugins/plugin_1/uploads/{UPLOAD_ID}', {}),
+    'write_plugin_version_upload': lambda ctx: (
+        'PUT', f'/v1/plugins/plugin_1/uploads/{UPLOAD_ID}',
+        {'data': ctx.tarball, 'headers': upload_headers(ctx, f'/v1/plugins/plugin_1/uploads/{UPLOAD_ID}')},
+    ),
+    'finalize_plugin_version_upload': lambda ctx: (
+        'POST', f'/v1/plugins/plugin_1/uploads/{UPLOAD_ID}/finalize',
+        {
+            'json': {'digest': hashlib.sha256(ctx.tarball).hexdigest()},
+            'headers': ctx.signed(f'/v1/plugins/plugin_1/uploads/{UPLOAD_ID}/finalize'),
+        },
+    ),
+    'delete_plugin_version_upload': lambda ctx: (
+        'DELETE', f'/v1/plugins/plugin_1/uploads/{UPLOAD_ID}',
+        {'headers': ctx.signed(f'/v1/plugins/plugin_1/uploads/{UPLOAD_ID}')},
+    ),
+    'delete_plugin': lambda ctx: (
+        'DELETE', '/v1/plugins/plugin_1', {'headers': ctx.signed('/v1/plugins/plugin_1')},
+    ),
+    'delete_plugin_version': lambda ctx: (
+        'DELETE', '/v1/plugins/plugin_1/versions/1.0.1',
+        {'headers': ctx.signed('/v1/plugins/plugin_1/versions/1.0.1')},
+    ),
+    'list_profiles': lambda ctx: ('GET', '/v1/admin/profiles', {'headers': PROFILE}),
+    'get_profile': lambda ctx: ('GET', f'/v1/admin/profiles/{PROFILE_ID}', {'headers': PROFILE}),
+    'list_slow_queries': lambda ctx: ('GET', '/v1/admin/slow-queries', {'headers': PROFILE}),
+    'get_retention_status': lambda ctx: ('GET', '/v1/admin/retention', {'headers': PROFILE}),
+    'get_scrub_status': lambda ctx: ('GET', '/v1/admin/scrub', {'headers': PROFILE}),
+}
+
+ROUTES = [route for route in app.routes if isinstance(route, APIRoute)]
+
+
+@dataclass
+class Measure:
+    status_code: int
+    queries: int
+    memory: int
+
+
+@pytest.fixture
+def context(data_dir: Path) -> Context:
+    return Context(
+        pub_key=(data_dir / 'maintainers/john.doe.pub').read_text(),
+        priv_key=(data_dir / 'maintainers/john.doe').read_text(),
+        new_pub_key=(data_dir / 'maintainers/new.guy.pub').read_text(),
+        tarball=(data_dir / 'plugin.tar.gz').read_bytes(),
+    )
+
+
+@pytest.fixture
+def measure(
+    context: Context, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, base_path: Path,
+) -> Callable[[str, int], Measure]:
+    '''Returns a function measuring a request to a route, against a fresh dataset of the given size'''
+    monkeypatch.setattr(profiling, 'PROFILE_SECRET', 'spam')
+    # Streams end once they replayed the past events
+    monkeypatch.setattr(events, 'EVENTS_MAX_DURATION', 0)
+    monkeypatch.setattr(profiling, 'PROFILES_PATH', tmp_path / 'profiles')
+    (tmp_path / 'profiles').mkdir()
+    (tmp_path / f'profiles/{PROFILE_ID}.json').write_text(json.dumps({'id': PROFILE_ID, 'stacks': {}}))
+
+    def run(route_name: str, size: int) -> Measure:
+        engine = create_engine(
+            'sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool,
+        )
+        Base.metadata.create_all(engine)
+        db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        seed(db, size, context)
+        app.dependency_overrides[deps.db] = lambda: db
+        monkeypatch.setattr(pipeline, 'session_factory', lambda: db)
+        monkeypatch.setattr(deltas, 'session_factory', lambda: db)
+        monkeypatch.setattr(events, 'session_factory', lambda: db)
+        permissions.cache.clear()
+        client = TestClient(app)
+        method, url, kwargs = CASES[route_name](context)
+        # Warm up the imports and caches that are not part of serving the request
+        client.get('/v1/replication')
+
+        statements = []
+        event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        tracemalloc.start()
+        try:
+            response = client.request(method, url, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            pipeline.shutdown()
+            events.shutdown()
+            db.close()
+            engine.dispose()
+            app.dependency_overrides.pop(deps.db)
+        return Measure(response.status_code, len(statements), peak)
+
+    return run
+
+
+def test_every_route_has_a_budget_and_a_case():
+    for route in ROUTES:
+        assert get_budget(route.endpoint) is not None, f'Route {route.name} does not declare a budget.'
+        assert route.name in CASES, f'Route {route.name} is not exercised by the budget tests.'
+
+
+@pytest.mark.parametrize('route', ROUTES, ids=[route.name for route in ROUTES])
+def test_route_budget(route: APIRoute, measure: Callable[[str, int], Measure]):
+    budget = get_budget(route.endpoint)
+    small, large = (measure(route.name, size) for size in SIZES)
+    assert small.status_code < 400 and large.status_code < 400, (small.status_code, large.status_code)
+    assert large.queries <= small.queries, (
+        f'{route.name} runs {small.queries} queries for {SIZES[0]} items, '
+        f'but {large.queries} for {SIZES[1]} items.'
+    )
+    assert large.queries <= budget.queries, f'{route.name} runs {large.queries} queries.'
+    assert large.memory <= budget.memory, f'{route.name} allocates {large.memory} bytes.'
@@ -0,0 +1,152 @@
+from pathlib import Path
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+from urllib3 import encode_multipart_formdata
+
+from cli_registry import sessions
+from cli_registry.models.change import ChangeOrm
+from cli_registry.models.plugin import PluginVersionOrm
+from cli_registry.utils import key_fingerprint
+from tests.test_app import make_headers, make_request_headers
+
+
+URL = '/v1/bulk/versions'
+
+
+def bulk_publish(
+    client: TestClient, files: dict[str, bytes], keys: tuple[str, str] | None = None, headers: dict | None = None,
+    **kwargs,
+):
+    '''Sends a bulk request, signing its body with the (private, public) keys if given'''
+    body, content_type = encode_multipart_formdata(
+        {field: (f'{field}.tar.gz', data) for field, data in files.items()},
+    )
+    headers = {**(headers or {}), 'Content-Type': content_type}
+    if keys is not None:
+        headers.update(make_request_headers('POST', URL, body, *keys, **kwargs))
+    return client.post(URL, data=body, headers=headers)
+
+
+def published(db_session: Session) -> set[tuple[str, str]]:
+    return {(version.plugin.name, version.version) for version in db_session.query(PluginVersionOrm)}
+
+
+def test_bulk_publish(
+    client: TestClient, db_session: Session, base_path: Path, data_dir: Path,
+    pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    tarball = (data_dir / 'plugin.tar.gz').read_bytes()
+    response = bulk_publish(
+        client, {'plugin_1/3.0.0': tarball, 'plugin_3/3.0.0': tarball},
+        (priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 201, response.text
+    assert [version['version'] for version in response.json()['data']] == ['3.0.0', '3.0.0']
+
+    assert {('plugin_1', '3.0.0'), ('plugin_3', '3.0.0')} <= published(db_session)
+    for plugin_name in ('plugin_1', 'plugin_3'):
+        response = client.get(f'/v1/plugins/{plugin_name}/versions/3.0.0/download')
+        assert response.content == tarball
+    assert db_session.query(ChangeOrm).filter(ChangeOrm.version == '3.0.0').count() == 2
+    assert not list((base_path / 'uploads').iterdir())
+
+
+def test_bulk_publish_is_all_or_nothing(
+    client: TestClient, db_session: Session, base_path: Path, data_dir: Path,
+    pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    before = published(db_session)
+    response = bulk_publish(
+        client, {'plugin_1/3.0.0': (data_dir / 'plugin.tar.gz').read_bytes(), 'plugin_3/3.0.0': b'spam'},
+        (priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 422, response.text
+    assert response.json()['detail'][0].startswith('plugin_3/3.0.0')
+    assert published(db_session) == before
+    assert not list((base_path / 'uploads').iterdir())
+
+
+def test_bulk_publish_unauthorized(
+    client: TestClient, db_session: Session, base_path: Path, data_dir: Path,
+    pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    tarball = (data_dir / 'plugin.tar.gz').read_bytes()
+    response = bulk_publish(
+        client, {'plugin_1/3.0.0': tarball, 'plugin_2/3.0.0': tarball},
+        (priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 403, response.text
+    assert 'plugin_2' in response.json()['detail']
+
+    token, _ = sessions.issue(key_fingerprint(pub_key_johndoe), ['plugin_1'])
+    response = bulk_publish(
+        client, {'plugin_1/3.0.0': tarball, 'plugin_3/3.0.0': tarball}, headers={'Authorization': f'Bearer {token}'},
+    )
+    assert response.status_code == 403, response.text
+    assert 'plugin_3' in response.json()['detail']
+
+
+def test_bulk_publish_existing_version(
+    client: TestClient, base_path: Path, data_dir: Path, pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    tarball = (data_dir / 'plugin.tar.gz').read_bytes()
+    response = bulk_publish(
+        client, {'plugin_1/3.0.0': tarball, 'plugin_3/1.0.0': tarball},
+        (priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 406, response.text
+    assert 'plugin_3/1.0.0' in response.json()['detail']
+
+
+def test_bulk_publish_malformed(client: TestClient, base_path: Path, pub_key_johndoe: str, priv_key_johndoe: str):
+    body, content_type = encode_multipart_formdata({'plugin_1/3.0.0': 'spam', 'spam': ('spam', b'')})
+    headers = make_request_headers('POST', URL, body, priv_key_johndoe, pub_key_johndoe)
+    response = client.post(URL, data=body, headers={**headers, 'Content-Type': content_type})
+    assert response.status_code == 422, response.text
+    assert response.json()['detail'] == 'Field plugin_1/3.0.0 is not a tarball named <plugin name>/<version>.'
+
+    headers = make_request_headers('POST', URL, b'--spam\r\n', priv_key_johndoe, pub_key_johndoe)
+    headers['Content-Type'] = 'multipart/form-data; boundary=spam'
+    response = client.post(URL, data=b'--spam\r\n', headers=headers)
+    assert response.status_code == 422, response.text
+    assert response.json()['detail'] == 'Multipart body is truncated.'
+    assert not list((base_path / 'uploads').iterdir())
+
+
+def test_bulk_publish_requires_signed_body(
+    client: TestClient, db_session: Session, base_path: Path, data_dir: Path,
+    pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    before = published(db_session)
+    files = {'plugin_1/3.0.0': (data_dir / 'plugin.tar.gz').read_bytes()}
+    # A signature of the path only, as for the other routes, is not accepted
+    response = bulk_publish(client, files, headers=make_headers(URL, priv_key_johndoe, pub_key_johndoe))
+    assert response.status_code == 403, response.text
+
+    response = bulk_publish(client, files, (priv_key_johndoe, pub_key_johndoe), timestamp=int(time.time()) - 3600)
+    assert response.status_code == 403, response.text
+
+    # Replayed with other tarballs
+    body, content_type = encode_multipart_formdata({'plugin_1/3.0.0': ('plugin.tar.gz', b'spam')}, 'spam')
+    headers = make_request_headers('POST', URL, body, priv_key_johndoe, pub_key_johndoe)
+    other, _ = encode_multipart_formdata({'plugin_1/3.0.0': ('plugin.tar.gz', files['plugin_1/3.0.0'])}, 'spam')
+    response = client.post(URL, data=other, headers={**headers, 'Content-Type': content_type})
+    assert response.status_code == 403, response.text
+    assert response.json()['detail'] == 'Request body does not match X-Content-SHA256.'
+    assert published(db_session) == before
+    assert not list((base_path / 'uploads').iterdir())
+
+
+def test_bulk_publish_unsafe_version(
+    client: TestClient, db_session: Session, base_path: Path, data_dir: Path,
+    pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    before = published(db_session)
+    tarball = (data_dir / 'plugin.tar.gz').read_bytes()
+    for field in ('plugin_1/../../../../escaped', 'plugin_1/..', 'plugin_1/3.0.0\\..', 'plugin_1/' + '1' * 21):
+        response = bulk_publish(client, {field: tarball}, (priv_key_johndoe, pub_key_johndoe))
+        assert response.status_code == 422, response.text
+    assert published(db_session) == before
+    assert not list((base_path / 'uploads').iterdir())
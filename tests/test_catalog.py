@@ -0,0 +1,62 @@
+from base64 import b85encode
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from cli_registry import catalog
+from cli_registry.models.catalog import CatalogEntryOrm
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+from tests.test_app import make_headers
+
+
+def test_catalog_follows_writes(
+    client: TestClient, base_path: Path, data_dir: Path,
+    pub_key_johndoe: str, priv_key_johndoe: str, pub_key_newguy: str,
+):
+    url = '/v1/plugins/plugin_1/versions/3.0.0'
+    tarball = b85encode((data_dir / 'plugin.tar.gz').read_bytes()).decode('utf8')
+    response = client.post(
+        url, json={'tarball': tarball}, headers=make_headers(url, priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 201, response.text
+    data = client.get('/v1/plugins/plugin_1').json()['data']
+    assert data['latest_version'] == '3.0.0'
+    assert data['version_count'] == 5
+    versions = client.get('/v1/plugins/plugin_1/versions').json()['data']
+    assert versions[-1]['version'] == '3.0.0'
+    assert versions[-1]['module'] == 'plugin'
+
+    response = client.delete(url, headers=make_headers(url, priv_key_johndoe, pub_key_johndoe))
+    assert response.status_code == 204, response.text
+    data = client.get('/v1/plugins/plugin_1').json()['data']
+    assert data['latest_version'] == '2.0.1'
+    assert data['version_count'] == 4
+
+    url = '/v1/plugins/plugin_1/maintainers'
+    response = client.post(
+        url, json={'email': 'new.guy@example.com', 'ssh_key': pub_key_newguy},
+        headers=make_headers(url, priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 201, response.text
+    data = client.get('/v1/plugins/plugin_1?fields=maintainers').json()['data']
+    assert data == {'maintainers': ['john.doe@example.com', 'spam.eggs@example.com', 'new.guy@example.com']}
+
+    response = client.post('/v1/plugins', json={'name': 'plugin_4'}, headers={'Authorization': pub_key_newguy})
+    assert response.status_code == 201, response.text
+    data = client.get('/v1/plugins/plugin_4').json()['data']
+    assert data['latest_version'] is None
+    assert data['version_count'] == 0
+    assert client.get('/v1/plugins/plugin_4/versions').json()['data'] == []
+
+
+def test_rebuild(db_session: Session):
+    db_session.query(CatalogEntryOrm).delete()
+    db_session.query(PluginVersionOrm).filter(PluginVersionOrm.id == 5).delete()
+    assert catalog.rebuild(db_session) == 3
+
+    for plugin in db_session.query(PluginOrm):
+        entry = db_session.query(CatalogEntryOrm).filter(CatalogEntryOrm.name == plugin.name).one()
+        assert entry.dict() == plugin.dict()
+        assert entry.versions == [version.dict(with_file=False) for version in plugin.versions]
+    assert db_session.query(CatalogEntryOrm).get(1).latest_version == '2.0.0'
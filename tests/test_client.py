@@ -0,0 +1,71 @@
+import json
+from pathlib import Path
+from typing import Callable
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.orm import Session
+
+from cli_registry.client import Client, RegistryError
+from cli_registry.models.plugin import PluginVersionOrm
+from tests.test_validation import make_tarball
+
+
+def tarball(tmp_path: Path, version: str, content: str = '') -> Path:
+    manifest = {'module': 'plugin', 'version': version}
+    return make_tarball(tmp_path / f'{version}-{content}.tar.gz', {
+        'plugin.json': json.dumps(manifest).encode('utf8'),
+        'plugin.py': f'__version__ = "{version}"\n{content}'.encode('utf8'),
+    })
+
+
+def test_client(live_server: Callable[..., str], tmp_path: Path, private_key: bytes):
+    url = live_server('registry')
+    with Client(url, private_key, cache_dir=tmp_path / 'cache', max_connections=4) as client:
+        client.create_plugin('spam', 'john.doe@example.com')
+        client.create_plugin('eggs')
+        published = tarball(tmp_path, '1.0.0')
+        client.publish('spam', '1.0.0', published)
+        client.publish('spam', '1.1.0', tarball(tmp_path, '1.1.0'))
+        client.publish('eggs', '1.0.0', tarball(tmp_path, '1.0.0', 'eggs'))
+
+        plugins = client.plugins(['spam', 'eggs', 'bacon'], fields=['name', 'latest_version'])
+        assert plugins['spam']['latest_version'] == '1.1.0'
+        assert plugins['bacon'] is None
+        assert [v['version'] for v in client.versions('spam', fields=['version'])] == ['1.0.0', '1.1.0']
+
+        paths = client.download_many([('spam', '1.0.0'), ('spam', 'latest'), ('eggs', '1.0.0')])
+        assert paths[('spam', '1.0.0')].read_bytes() == published.read_bytes()
+        assert paths[('spam', 'latest')].parent.name == '1.1.0'
+        digest = client.version('eggs', '1.0.0', fields=['digest'])['digest']
+        assert paths[('eggs', '1.0.0')].name == f'{digest}.tar.gz'
+
+        # Revalidated, and downloaded again once republished with another tarball
+        mtime = paths[('spam', '1.0.0')].stat().st_mtime_ns
+        assert client.download('spam', '1.0.0') == paths[('spam', '1.0.0')]
+        assert paths[('spam', '1.0.0')].stat().st_mtime_ns == mtime
+        client.delete_version('spam', '1.0.0')
+        republished = tarball(tmp_path, '1.0.0', 'republished')
+        client.publish('spam', '1.0.0', republished)
+        path = client.download('spam', '1.0.0')
+        assert path.read_bytes() == republished.read_bytes()
+        assert not paths[('spam', '1.0.0')].exists()
+
+        with pytest.raises(RegistryError) as e:
+            client.download('spam', '2.0.0')
+        assert e.value.status == 404
+
+
+def test_download_revalidation(client: TestClient, db_session: Session, base_path: Path):
+    version = db_session.query(PluginVersionOrm).get(1)
+    version.file_path.parent.mkdir(parents=True, exist_ok=True)
+    version.file_path.write_bytes(b'spam')
+    version.digest = 'a' * 64
+    db_session.commit()
+
+    url = '/v1/plugins/plugin_1/versions/1.0.0/download'
+    response = client.get(url)
+    assert response.headers['etag'] == f'"{"a" * 64}"'
+    response = client.get(url, headers={'If-None-Match': f'"{"b" * 64}", "{"a" * 64}"'})
+    assert response.status_code == 304
+    assert response.content == b''
@@ -0,0 +1,80 @@
+from base64 import b85encode
+import json
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.orm import Session
+
+from cli_registry.models.dependency import PluginClosureOrm
+from tests.test_app import make_headers
+from tests.test_validation import make_tarball
+
+
+@pytest.fixture
+def publish(
+    client: TestClient, base_path: Path, tmp_path: Path, pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    '''Publishes a version of a plugin maintained by John Doe, depending on the given plugins'''
+    def publish(plugin_name: str, version: str, dependencies: list[str]):
+        manifest = {'module': 'plugin', 'version': version, 'dependencies': dependencies}
+        path = make_tarball(tmp_path / f'{plugin_name}-{version}.tar.gz', {
+            'plugin.json': json.dumps(manifest).encode('utf8'),
+            'plugin.py': f'__version__ = "{version}"'.encode('utf8'),
+        })
+        url = f'/v1/plugins/{plugin_name}/versions/{version}'
+        return client.post(
+            url, json={'tarball': b85encode(path.read_bytes()).decode('utf8')},
+            headers=make_headers(url, priv_key_johndoe, pub_key_johndoe),
+        )
+    return publish
+
+
+def closure(client: TestClient, plugin_name: str, version: str) -> list[tuple[str, int, str | None]]:
+    response = client.get(f'/v1/plugins/{plugin_name}/versions/{version}/closure')
+    assert response.status_code == 200, response.text
+    return [
+        (dependency['plugin_name'], dependency['depth'], dependency['version'])
+        for dependency in response.json()['data']
+    ]
+
+
+def test_transitive_dependencies(client: TestClient, db_session: Session, publish):
+    assert publish('plugin_3', '3.0.0', ['plugin_2']).status_code == 201
+    assert publish('plugin_1', '3.0.0', ['plugin_3']).status_code == 201
+
+    assert closure(client, 'plugin_1', '3.0.0') == [('plugin_3', 1, '3.0.0'), ('plugin_2', 2, '1.0.0')]
+    assert closure(client, 'plugin_1', '2.0.1') == []
+    assert {
+        (row.plugin_name, row.dependency_name, row.depth) for row in db_session.query(PluginClosureOrm)
+    } == {('plugin_3', 'plugin_2', 1), ('plugin_1', 'plugin_3', 1), ('plugin_1', 'plugin_2', 2)}
+
+
+def test_closures_follow_the_latest_versions(
+    client: TestClient, publish, pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    publish('plugin_3', '3.0.0', ['plugin_2'])
+    publish('plugin_1', '3.0.0', ['plugin_3'])
+    # The dependencies of plugin_3 changed, and so did the closure of plugin_1
+    publish('plugin_3', '4.0.0', [])
+    assert closure(client, 'plugin_1', '3.0.0') == [('plugin_3', 1, '4.0.0')]
+
+    url = '/v1/plugins/plugin_3/versions/4.0.0'
+    response = client.delete(url, headers=make_headers(url, priv_key_johndoe, pub_key_johndoe))
+    assert response.status_code == 204, response.text
+    assert closure(client, 'plugin_1', '3.0.0') == [('plugin_3', 1, '3.0.0'), ('plugin_2', 2, '1.0.0')]
+
+
+def test_dependency_cycles_are_refused(client: TestClient, publish):
+    publish('plugin_3', '3.0.0', ['plugin_2'])
+    publish('plugin_1', '3.0.0', ['plugin_3'])
+
+    response = publish('plugin_3', '4.0.0', ['plugin_1'])
+    assert response.status_code == 422, response.text
+    assert 'plugin_3 -> plugin_1 -> plugin_3' in response.json()['detail']
+    response = publish('plugin_1', '4.0.0', ['plugin_1'])
+    assert response.status_code == 422, response.text
+    response = publish('plugin_1', '4.0.0', ['spam'])
+    assert response.status_code == 422, response.text
+    assert 'Unknown dependencies: spam' in response.json()['detail']
+    assert closure(client, 'plugin_1', '3.0.0') == [('plugin_3', 1, '3.0.0'), ('plugin_2', 2, '1.0.0')]
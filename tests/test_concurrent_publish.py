@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import requests
+
+from cli_registry.client import Client, RegistryError
+from tests.test_client import tarball
+
+
+PLUGINS = 10
+VERSIONS = 10
+# Publishes of each version, sent at once, with different tarballs
+RACERS = 2
+
+
+def test_concurrent_publishes(live_server: Callable[..., str], tmp_path: Path, private_key: bytes):
+    url = live_server('registry')
+    names = [f'plugin-{i}' for i in range(PLUGINS)]
+    versions = [(name, f'1.0.{i}') for name in names for i in range(VERSIONS)]
+    attempts = [(name, version, racer) for name, version in versions for racer in range(RACERS)]
+    tarballs = {
+        (name, version, racer): tarball(tmp_path, version, f'{name}-{racer}')
+        for name, version, racer in attempts
+    }
+    with Client(url, private_key, cache_dir=tmp_path / 'cache', max_connections=32) as client, \
+            ThreadPoolExecutor(32) as executor:
+        def create(name: str) -> bool:
+            try:
+                client.create_plugin(name)
+            except RegistryError as e:
+                assert e.status == 406, e
+                return False
+            return True
+
+        def publish(attempt: tuple[str, str, int]) -> bool:
+            try:
+                client.publish(*attempt[:2], tarballs[attempt])
+            except RegistryError as e:
+                assert e.status == 406, e
+                return False
+            return True
+
+        assert sum(executor.map(create, names * 4)) == PLUGINS
+        published = [attempt for attempt, ok in zip(attempts, executor.map(publish, attempts)) if ok]
+
+        # A single publish of each version succeeded, and its tarball is the one served
+        assert sorted((name, version) for name, version, _ in published) == sorted(versions)
+        paths = client.download_many(versions)
+        for name, version, racer in published:
+            assert paths[name, version].read_bytes() == tarballs[name, version, racer].read_bytes()
+
+    data = requests.get(f'{url}/v1/plugins?page_size=100').json()['data']
+    assert sorted(plugin['name'] for plugin in data) == sorted(names)
+    assert {plugin['version_count'] for plugin in data} == {VERSIONS}
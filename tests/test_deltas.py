@@ -0,0 +1,86 @@
+from base64 import b85encode
+import gzip
+import json
+import os
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+import pytest
+
+from cli_registry import deltas, storage
+from tests.test_app import make_headers
+from tests.test_validation import make_tarball
+
+
+def make_plugin(path: Path, version: str, files: dict[str, bytes]) -> Path:
+    return make_tarball(path, {
+        'plugin.json': json.dumps({'module': 'plugin', 'version': version}).encode('utf8'),
+        'plugin.py': f'__version__ = "{version}"'.encode('utf8'),
+        **files,
+    })
+
+
+@pytest.fixture
+def files() -> dict[str, bytes]:
+    # Random contents, that compression does not shrink
+    return {f'data/{i}.bin': os.urandom(20 * 1024) for i in range(20)}
+
+
+def test_delta_of_a_routine_upgrade(tmp_path: Path, files: dict[str, bytes]):
+    source = make_plugin(tmp_path / 'source.tar.gz', '2.0.0', files)
+    target = make_plugin(tmp_path / 'target.tar.gz', '2.0.1', {**files, 'data/3.bin': os.urandom(20 * 1024)})
+
+    size = deltas.compute(str(source), str(target), str(tmp_path / 'delta'))
+    assert size is not None and size * 10 < target.stat().st_size
+    patched = deltas.apply(gzip.decompress(source.read_bytes()), (tmp_path / 'delta').read_bytes())
+    assert patched == gzip.decompress(target.read_bytes())
+
+
+def test_deltas_not_worth_it_are_not_kept(tmp_path: Path, files: dict[str, bytes]):
+    source = make_plugin(tmp_path / 'source.tar.gz', '1.0.0', {})
+    target = make_plugin(tmp_path / 'target.tar.gz', '2.0.0', files)
+    assert deltas.compute(str(source), str(target), str(tmp_path / 'delta')) is None
+    assert not (tmp_path / 'delta').exists()
+
+
+def test_delta_from_another_archive_is_refused(tmp_path: Path, files: dict[str, bytes]):
+    source = make_plugin(tmp_path / 'source.tar.gz', '2.0.0', files)
+    target = make_plugin(tmp_path / 'target.tar.gz', '2.0.1', files)
+    deltas.compute(str(source), str(target), str(tmp_path / 'delta'))
+    other = make_plugin(tmp_path / 'other.tar.gz', '1.0.0', {})
+    with pytest.raises(deltas.DeltaError):
+        deltas.apply(gzip.decompress(other.read_bytes()), (tmp_path / 'delta').read_bytes())
+
+
+def test_download_delta_after_publish(
+    client: TestClient, base_path: Path, tmp_path: Path, files: dict[str, bytes],
+    pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    for version, contents in (('3.0.0', files), ('3.0.1', {**files, 'data/0.bin': b'spam'})):
+        tarball = make_plugin(tmp_path / f'{version}.tar.gz', version, contents)
+        url = f'/v1/plugins/plugin_1/versions/{version}'
+        response = client.post(
+            url, json={'tarball': b85encode(tarball.read_bytes()).decode('utf8')},
+            headers=make_headers(url, priv_key_johndoe, pub_key_johndoe),
+        )
+        assert response.status_code == 201, response.text
+    assert deltas.delta_path('plugin_1', '3.0.0', '3.0.1').exists()
+
+    response = client.get('/v1/plugins/plugin_1/versions/3.0.1/download', params={'from': '3.0.0'})
+    assert response.status_code == 200, response.text
+    assert response.headers['content-type'] == deltas.MEDIA_TYPE
+    source = gzip.decompress((tmp_path / '3.0.0.tar.gz').read_bytes())
+    assert deltas.apply(source, response.content) == gzip.decompress((tmp_path / '3.0.1.tar.gz').read_bytes())
+
+    # Without a delta from that version, the tarball is served
+    response = client.get('/v1/plugins/plugin_1/versions/3.0.1/download', params={'from': '2.0.1'})
+    assert response.headers['content-type'] == 'application/gzip'
+    assert response.content == storage.tarball_path('plugin_1', '3.0.1').read_bytes()
+
+    for source in ('..', '../../plugin_1/3.0.0', '..\\3.0.0', '3.0.0\0'):
+        response = client.get('/v1/plugins/plugin_1/versions/3.0.1/download', params={'from': source})
+        assert response.status_code == 422, response.text
+
+    url = '/v1/plugins/plugin_1/versions/3.0.0'
+    client.delete(url, headers=make_headers(url, priv_key_johndoe, pub_key_johndoe))
+    assert not deltas.delta_path('plugin_1', '3.0.0', '3.0.1').exists()
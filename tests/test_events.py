@@ -0,0 +1,151 @@
+import asyncio
+import json
+from pathlib import Path
+import threading
+from typing import Callable
+
+import pytest
+import requests
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cli_registry import changes, events
+from cli_registry.db import Base
+
+
+@pytest.fixture
+def factory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> sessionmaker:
+    engine = create_engine(f'sqlite:///{tmp_path / "app.db"}', connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(events, 'session_factory', factory)
+    # Changes must be notified to be seen
+    monkeypatch.setattr(events, 'EVENTS_POLL_INTERVAL', 60)
+    yield factory
+    events.shutdown()
+    engine.dispose()
+
+
+def record(factory: sessionmaker, action: str, plugin_name: str, version: str | None = None):
+    with factory() as db:
+        changes.record(db, action, plugin_name, version)
+        db.commit()
+
+
+def parse(chunks: list[str]) -> list[tuple[int, str, str]]:
+    '''Returns the id, the action and the plugin name of the events'''
+    parsed = []
+    for chunk in chunks:
+        if chunk.startswith(':'):
+            continue
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+        parsed.append((int(fields['id']), fields['event'], json.loads(fields['data'])['plugin_name']))
+    return parsed
+
+
+async def collect(plugins: list[str] | None, last_event_id: int | None, count: int) -> list[str]:
+    chunks = []
+    async for chunk in events.stream(plugins, last_event_id):
+        chunks.append(chunk)
+        if len(chunks) == count:
+            break
+    return chunks
+
+
+def test_replay_from_last_event_id(factory: sessionmaker, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(events, 'EVENTS_MAX_DURATION', 0)
+    record(factory, changes.PLUGIN_CREATED, 'spam')
+    record(factory, changes.MAINTAINER_ADDED, 'spam')
+    record(factory, changes.VERSION_PUBLISHED, 'spam', '1.0.0')
+    record(factory, changes.PLUGIN_CREATED, 'eggs')
+    record(factory, changes.VERSION_DELETED, 'spam', '1.0.0')
+
+    chunks = asyncio.run(collect(None, 1, 10))
+    assert parse(chunks) == [
+        (3, 'version-published', 'spam'), (4, 'plugin-created', 'eggs'), (5, 'version-deleted', 'spam'),
+    ]
+    chunks = asyncio.run(collect(['spam'], 0, 10))
+    assert [event_id for event_id, _, _ in parse(chunks)] == [1, 3, 5]
+
+
+def test_new_events_are_pushed_when_notified(factory: sessionmaker, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(events, 'EVENTS_MAX_DURATION', 10)
+    record(factory, changes.PLUGIN_CREATED, 'spam')
+
+    async def publish_later():
+        await asyncio.sleep(0.2)
+        await asyncio.to_thread(record, factory, changes.PLUGIN_CREATED, 'eggs')
+        await asyncio.to_thread(record, factory, changes.VERSION_PUBLISHED, 'spam', '1.0.0')
+        events.notify()
+
+    async def run() -> list[str]:
+        publisher = asyncio.create_task(publish_later())
+        chunks = await asyncio.wait_for(collect(['spam'], None, 1), 5)
+        await publisher
+        return chunks
+
+    assert parse(asyncio.run(run())) == [(3, 'version-published', 'spam')]
+
+
+def test_slow_subscribers_are_disconnected(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(events, 'EVENTS_QUEUE_SIZE', 2)
+
+    async def run() -> events.Subscriber:
+        subscriber = events.Subscriber(None, asyncio.get_running_loop())
+        for event_id in range(3):
+            subscriber.offer({'id': event_id, 'action': changes.PLUGIN_CREATED, 'plugin_name': 'spam'})
+        return subscriber
+
+    subscriber = asyncio.run(run())
+    assert subscriber.overflowed
+    assert subscriber.queue.qsize() == 2
+
+
+def test_events_of_a_live_registry(live_server: Callable[..., str], pub_key_johndoe: str):
+    url = live_server('registry', EVENTS_POLL_INTERVAL='60')
+    received: list[str] = []
+
+    def listen():
+        # Resuming from the start, the events committed before subscribing are replayed
+        with requests.get(
+            f'{url}/v1/events', params={'plugin': 'spam'}, headers={'Last-Event-ID': '0'}, stream=True, timeout=10,
+        ) as response:
+            assert response.headers['content-type'].startswith('text/event-stream')
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith('event: '):
+                    received.append(line.removeprefix('event: '))
+                    return
+
+    listener = threading.Thread(target=listen)
+    listener.start()
+    for name in ('eggs', 'spam'):
+        response = requests.post(
+            f'{url}/v1/plugins', json={'name': name},
+            headers={'X-Maintainer-Email': 'john.doe@example.com', 'Authorization': pub_key_johndoe},
+        )
+        assert response.status_code == 201, response.text
+    listener.join(10)
+    assert received == ['plugin-created']
+
+
+def test_events_of_a_replica(live_server: Callable[..., str], pub_key_johndoe: str):
+    primary = live_server('primary')
+    replica = live_server('replica', REPLICA_OF=primary, REPLICA_POLL_INTERVAL='0.2', EVENTS_POLL_INTERVAL='60')
+    for name in ('eggs', 'spam'):
+        response = requests.post(
+            f'{primary}/v1/plugins', json={'name': name},
+            headers={'X-Maintainer-Email': 'john.doe@example.com', 'Authorization': pub_key_johndoe},
+        )
+        assert response.status_code == 201, response.text
+    primary_changes = requests.get(f'{primary}/v1/changes').json()['data']
+
+    # The pulled changes are replayed under their ids on the primary
+    received: list[str] = []
+    with requests.get(
+        f'{replica}/v1/events', params={'plugin': 'spam'}, headers={'Last-Event-ID': '0'}, stream=True, timeout=10,
+    ) as response:
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('id: '):
+                received.append(line.removeprefix('id: '))
+                break
+    assert received == [str(change['id']) for change in primary_changes if change['plugin_name'] == 'spam']
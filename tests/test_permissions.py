@@ -0,0 +1,57 @@
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from cli_registry import permissions
+from cli_registry.utils import key_fingerprint
+from tests.test_app import make_headers
+
+
+def test_key_fingerprint(pub_key_johndoe: str):
+    key_type, blob, *_ = pub_key_johndoe.split()
+    assert key_fingerprint(pub_key_johndoe) == key_fingerprint(f'{key_type} {blob} another comment\n')
+    assert key_fingerprint(pub_key_johndoe) != key_fingerprint(f'{key_type} {blob[:-4]}AAAA')
+
+
+def test_is_maintainer(db_session: Session, pub_key_johndoe: str, pub_key_foobar: str):
+    permissions.cache.clear()
+    assert permissions.is_maintainer(db_session, 1, key_fingerprint(pub_key_johndoe))
+    assert not permissions.is_maintainer(db_session, 1, key_fingerprint(pub_key_foobar))
+    assert permissions.cache.get(1, key_fingerprint(pub_key_foobar)) is False
+    assert permissions.cache.get(2, key_fingerprint(pub_key_foobar)) is None
+
+
+def test_authorization_cache_lru():
+    cache = permissions.AuthorizationCache(ttl=60, max_size=2)
+    cache.set(1, 'spam', True)
+    cache.set(1, 'eggs', False)
+    assert cache.get(1, 'spam') is True
+    cache.set(2, 'spam', True)
+    assert cache.get(1, 'eggs') is None
+    assert cache.get(1, 'spam') is True
+    cache.invalidate(1)
+    assert cache.get(1, 'spam') is None
+    assert cache.get(2, 'spam') is True
+
+
+def test_add_maintainer_invalidates_cache(
+    client: TestClient, base_path: Path, pub_key_johndoe: str, priv_key_johndoe: str,
+    pub_key_foobar: str, priv_key_foobar: str,
+):
+    url = '/v1/plugins/plugin_1/maintainers'
+    response = client.post(
+        url, json={'email': 'spam@example.com', 'ssh_key': pub_key_johndoe},
+        headers=make_headers(url, priv_key_foobar, pub_key_foobar),
+    )
+    assert response.status_code == 403, response.text
+
+    response = client.post(
+        url, json={'email': 'foo.bar@example.com', 'ssh_key': pub_key_foobar},
+        headers=make_headers(url, priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 200, response.text
+
+    url = '/v1/plugins/plugin_1/versions/0.0.0/uploads'
+    response = client.post(url, headers=make_headers(url, priv_key_foobar, pub_key_foobar))
+    assert response.status_code == 201, response.text
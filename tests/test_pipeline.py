@@ -0,0 +1,82 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session, sessionmaker
+
+from cli_registry import changes, pipeline
+from cli_registry.db import Base, create_writer_engine
+from cli_registry.models.change import ChangeOrm
+
+
+@pytest.fixture
+def writer(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> sessionmaker:
+    engine = create_writer_engine(f'sqlite:///{tmp_path / "app.db"}')
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(pipeline, 'session_factory', factory)
+    monkeypatch.setattr(pipeline, 'WRITE_BATCH_WINDOW', 0.05)
+    monkeypatch.setattr(pipeline, 'stats', {'commits': 0, 'writes': 0})
+    yield factory
+    pipeline.shutdown()
+    engine.dispose()
+
+
+def record(plugin_name: str):
+    def apply(db: Session) -> int:
+        change = changes.record(db, changes.PLUGIN_CREATED, plugin_name)
+        db.flush()
+        return change.id
+    return apply
+
+
+def fail(db: Session):
+    changes.record(db, changes.PLUGIN_CREATED, 'failed')
+    db.flush()
+    raise ValueError('spam')
+
+
+async def submit_all(*applies) -> list:
+    return await asyncio.gather(*(pipeline.submit(apply) for apply in applies), return_exceptions=True)
+
+
+def test_concurrent_writes_are_committed_together(writer: sessionmaker):
+    results = asyncio.run(submit_all(*(record(f'plugin_{i}') for i in range(50))))
+
+    assert len(set(results)) == 50
+    assert pipeline.stats['writes'] == 50
+    assert pipeline.stats['commits'] < 50
+    with writer() as db:
+        assert db.query(ChangeOrm).count() == 50
+
+
+def test_failing_write_is_rolled_back_alone(writer: sessionmaker):
+    first, failed, last = asyncio.run(submit_all(record('plugin_1'), fail, record('plugin_2')))
+
+    assert isinstance(first, int) and isinstance(last, int)
+    assert isinstance(failed, ValueError)
+    with writer() as db:
+        assert {change.plugin_name for change in db.query(ChangeOrm)} == {'plugin_1', 'plugin_2'}
+
+
+def test_failed_group_commit_is_undone(writer: sessionmaker, monkeypatch: pytest.MonkeyPatch):
+    def failing_factory() -> Session:
+        db = writer()
+
+        @event.listens_for(db, 'before_commit')
+        def fail_group_commit(session: Session):
+            if not session.in_nested_transaction():
+                raise ValueError('spam')
+        return db
+    monkeypatch.setattr(pipeline, 'session_factory', failing_factory)
+    undone = []
+
+    async def submit():
+        return await pipeline.submit(record('plugin_1'), lambda: undone.append('plugin_1'))
+
+    with pytest.raises(ValueError):
+        asyncio.run(submit())
+    assert undone == ['plugin_1']
+    with writer() as db:
+        assert db.query(ChangeOrm).count() == 0
@@ -0,0 +1,92 @@
+from pathlib import Path
+import time
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from cli_registry import profiling
+from cli_registry.utils import file_digest
+
+
+@pytest.fixture
+def profiles_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(profiling, 'PROFILE_SECRET', 'spam')
+    monkeypatch.setattr(profiling, 'PROFILES_PATH', tmp_path)
+    return tmp_path
+
+
+def test_sampler(data_dir: Path):
+    sampler = profiling.Sampler(0.001)
+    sampler.start()
+    deadline = time.monotonic() + 0.1
+    while time.monotonic() < deadline:
+        file_digest(data_dir / 'plugin.tar.gz')
+    sampler.stop()
+    assert sampler.samples > 0
+    assert any('file_digest' in stack for stack in sampler.stacks)
+
+
+def test_profile_request(client: TestClient, profiles_path: Path):
+    response = client.get('/v1/plugins/plugin_1')
+    assert 'X-Profile-Id' not in response.headers
+
+    response = client.get('/v1/plugins/plugin_1', headers={'X-Profile-Secret': 'spam'})
+    assert response.status_code == 200, response.text
+    profile_id = response.headers['X-Profile-Id']
+
+    response = client.get(f'/v1/admin/profiles/{profile_id}', headers={'X-Profile-Secret': 'spam'})
+    assert response.status_code == 200, response.text
+    profile = response.json()['data']
+    assert profile['route'] == '/v1/plugins/{plugin_name}'
+    assert profile['method'] == 'GET'
+
+    response = client.get(f'/v1/admin/profiles/{profile_id}?format=folded', headers={'X-Profile-Secret': 'spam'})
+    assert response.status_code == 200, response.text
+
+    response = client.get('/v1/admin/profiles', headers={'X-Profile-Secret': 'spam'})
+    assert [p['id'] for p in response.json()['data']] == [profile_id]
+
+
+def test_profile_sampled_requests(client: TestClient, profiles_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 1)
+    response = client.get('/v1/plugins')
+    assert 'X-Profile-Id' in response.headers
+
+
+def test_profiles_are_pruned(client: TestClient, profiles_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(profiling, 'PROFILES_MAX', 2)
+    profile_ids = []
+    for _ in range(3):
+        profile_ids.append(client.get('/v1/plugins', headers={'X-Profile-Secret': 'spam'}).headers['X-Profile-Id'])
+        # Distinct modification times
+        time.sleep(0.01)
+    assert {path.stem for path in profiles_path.glob('*.json')} == set(profile_ids[1:])
+
+
+def test_admin_requires_secret(client: TestClient, profiles_path: Path):
+    assert client.get('/v1/admin/profiles').status_code == 403
+    assert client.get('/v1/admin/profiles', headers={'X-Profile-Secret': 'eggs'}).status_code == 403
+    response = client.get('/v1/admin/profiles/0123', headers={'X-Profile-Secret': 'spam'})
+    assert response.status_code == 404
+
+
+def test_slow_query_log(client: TestClient, profiles_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(profiling, 'SLOW_QUERY_THRESHOLD', 1e-9)
+    monkeypatch.setattr(profiling, 'slow_queries', profiling.deque(maxlen=10))
+    client.get('/v1/plugins/plugin_1')
+    response = client.get('/v1/admin/slow-queries', headers={'X-Profile-Secret': 'spam'})
+    queries = response.json()['data']
+    assert any(
+        q['route'] == 'GET /v1/plugins/{plugin_name}' and "'plugin_1'" in q['parameters']
+        for q in queries
+    ), queries
+
+
+def test_failed_query_timer(db_session: Session):
+    connection = db_session.connection()
+    with pytest.raises(OperationalError):
+        connection.execute(text('SELECT * FROM spam'))
+    assert connection.info['query_start_time'] == []
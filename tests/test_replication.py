@@ -0,0 +1,130 @@
+import hashlib
+from pathlib import Path
+import sys
+import time
+from typing import Callable
+
+from fastapi.testclient import TestClient
+import pytest
+import requests
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cli_registry.db import Base
+from cli_registry.models.plugin import PluginOrm
+from cli_registry import changes, replication, storage
+from tests.test_app import make_headers
+
+
+def wait_for(predicate: Callable[[], bool], timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return
+        time.sleep(0.1)
+    raise TimeoutError('Condition not met in time.')
+
+
+def publish(url: str, plugin_name: str, version: str, tarball: bytes, priv_key: str, pub_key: str):
+    path = f'/v1/plugins/{plugin_name}/versions/{version}/uploads'
+    response = requests.post(url + path, headers=make_headers(path, priv_key, pub_key))
+    assert response.status_code == 201, response.text
+    upload_id = response.json()['data']['id']
+
+    path = f'/v1/plugins/{plugin_name}/uploads/{upload_id}'
+    headers = make_headers(path, priv_key, pub_key)
+    headers['Upload-Offset'] = '0'
+    response = requests.put(url + path, data=tarball, headers=headers)
+    assert response.status_code == 200, response.text
+
+    path += '/finalize'
+    response = requests.post(
+        url + path, json={'digest': hashlib.sha256(tarball).hexdigest()},
+        headers=make_headers(path, priv_key, pub_key),
+    )
+    assert response.status_code == 201, response.text
+
+
+def test_list_changes(client: TestClient, pub_key_johndoe: str):
+    last_id = client.get('/v1/changes').json()['last_id']
+    response = client.post(
+        '/v1/plugins', json={'name': 'plugin_4'},
+        headers={'X-Maintainer-Email': 'john.doe@example.com', 'Authorization': pub_key_johndoe},
+    )
+    assert response.status_code == 201, response.text
+
+    response = client.get(f'/v1/changes?since={last_id}')
+    assert response.status_code == 200, response.text
+    data = response.json()['data']
+    assert [(c['action'], c['plugin_name']) for c in data] == [('plugin-created', 'plugin_4')]
+    assert data[0]['data']['maintainer']['email'] == 'john.doe@example.com'
+    assert response.json()['last_id'] == data[0]['id']
+
+
+def test_replica_redirects_writes(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(sys.modules['cli_registry.app'], 'REPLICA_OF', 'http://primary:8000')
+    response = client.post('/v1/plugins?spam=eggs', json={'name': 'plugin_4'}, allow_redirects=False)
+    assert response.status_code == 307, response.text
+    assert response.headers['location'] == 'http://primary:8000/v1/plugins?spam=eggs'
+    assert client.get('/v1/plugins').status_code == 200
+
+
+def test_replica_follows_primary(
+    live_server: Callable[..., str], data_dir: Path, pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    primary = live_server('primary')
+    replica = live_server('replica', REPLICA_OF=primary, REPLICA_POLL_INTERVAL='0.2')
+
+    response = requests.post(
+        f'{primary}/v1/plugins', json={'name': 'spam'},
+        headers={'X-Maintainer-Email': 'john.doe@example.com', 'Authorization': pub_key_johndoe},
+    )
+    assert response.status_code == 201, response.text
+    tarball = (data_dir / 'plugin.tar.gz').read_bytes()
+    publish(primary, 'spam', '1.0.0', tarball, priv_key_johndoe, pub_key_johndoe)
+
+    wait_for(lambda: requests.get(f'{replica}/v1/plugins/spam/versions/1.0.0').status_code == 200)
+    assert requests.get(f'{replica}/v1/plugins/spam/versions/1.0.0/download').content == tarball
+    maintainers = requests.get(f'{replica}/v1/plugins/spam/maintainers').json()['data']
+    assert [m['email'] for m in maintainers] == ['john.doe@example.com']
+    status = requests.get(f'{replica}/v1/replication').json()['data']
+    assert status['role'] == 'replica'
+    assert status['lag_changes'] == 0
+
+    response = requests.post(f'{replica}/v1/plugins', json={'name': 'eggs'}, allow_redirects=False)
+    assert response.status_code == 307, response.text
+    assert response.headers['location'] == f'{primary}/v1/plugins'
+
+    path = '/v1/plugins/spam/versions/1.0.0'
+    response = requests.delete(primary + path, headers=make_headers(path, priv_key_johndoe, pub_key_johndoe))
+    assert response.status_code == 204, response.text
+    wait_for(lambda: requests.get(f'{replica}/v1/plugins/spam/versions/1.0.0').status_code == 404)
+
+
+def test_failed_pull_moves_tarballs_back(base_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # A database of its own, as the pull rolls back on failure
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.add(PluginOrm(id=1, name='spam'))
+    db.commit()
+
+    version = {
+        'id': 1, 'version': '1.0.0', 'upload_date': '2026-01-01T00:00:00', 'size': 4, 'digest': None,
+        'module': 'spam', 'description': None,
+    }
+    pulled = [
+        {'id': 1, 'action': changes.VERSION_PUBLISHED, 'plugin_name': 'spam', 'version': '1.0.0',
+         'data': {'version': version}, 'created_at': '2026-01-01T00:00:00'},
+        {'id': 2, 'action': 'spam', 'plugin_name': 'spam', 'version': None, 'data': {},
+         'created_at': '2026-01-01T00:00:00'},
+    ]
+    staged = storage.staging_path('replicated')
+    staged.write_bytes(b'spam')
+    monkeypatch.setattr(replication, '_get_json', lambda url: {'data': pulled, 'last_id': 2})
+    monkeypatch.setattr(replication, '_fetch_tarball', lambda primary_url, change: staged)
+
+    with pytest.raises(replication.ReplicationError):
+        replication.pull_changes(db, 'http://primary')
+    assert not storage.tarball_path('spam', '1.0.0').exists()
+    assert not staged.exists()
@@ -0,0 +1,100 @@
+from datetime import date, datetime
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.orm import Session
+
+from cli_registry import profiling, retention
+from cli_registry.models.change import ChangeOrm
+from cli_registry.models.plugin import PluginOrm, PluginVersionOrm
+from cli_registry.models.stats import DownloadStatOrm
+
+
+@pytest.fixture
+def tarballs(db_session: Session, base_path: Path) -> dict[str, Path]:
+    '''Stores a tarball of 100 bytes for each version of plugin_1'''
+    paths = {}
+    for version in db_session.query(PluginVersionOrm).join(PluginOrm).filter(PluginOrm.name == 'plugin_1'):
+        version.size = 100
+        version.file_path.parent.mkdir(parents=True, exist_ok=True)
+        version.file_path.write_bytes(b'0' * 100)
+        paths[version.version] = version.file_path
+    db_session.commit()
+    return paths
+
+
+@pytest.fixture
+def policies(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(retention, 'RETENTION_BATCH_SIZE', 1)
+    monkeypatch.setattr(retention, 'RETENTION_BATCH_PAUSE', 0)
+
+    def set_policies(keep_versions: int = 0, keep_days: int = 0, disk_quota: int = 0):
+        monkeypatch.setattr(retention, 'RETENTION_KEEP_VERSIONS', keep_versions)
+        monkeypatch.setattr(retention, 'RETENTION_KEEP_DAYS', keep_days)
+        monkeypatch.setattr(retention, 'DISK_QUOTA', disk_quota)
+    return set_policies
+
+
+def versions(db_session: Session) -> list[str]:
+    return [
+        version.version for version in
+        db_session.query(PluginVersionOrm).join(PluginOrm).filter(PluginOrm.name == 'plugin_1')
+        .order_by(PluginVersionOrm.upload_date)
+    ]
+
+
+def test_keep_last_versions(db_session: Session, tarballs: dict[str, Path], policies):
+    policies(keep_versions=2)
+    report = retention.collect(db_session)
+
+    assert versions(db_session) == ['2.0.0', '2.0.1']
+    assert report['versions'] == 2
+    assert report['reclaimed'] == 200
+    assert not tarballs['1.0.0'].exists() and not tarballs['1.1.0'].exists()
+    assert tarballs['2.0.0'].exists()
+    deleted = db_session.query(ChangeOrm.version).filter(ChangeOrm.action == 'version-deleted')
+    assert sorted(version for version, in deleted) == ['1.0.0', '1.1.0']
+
+
+def test_keep_recent_versions(db_session: Session, tarballs: dict[str, Path], policies):
+    now = datetime(2022, 1, 6)
+    policies(keep_days=2)
+    retention.collect(db_session, now)
+    # The latest version is kept, however old
+    assert versions(db_session) == ['2.0.1']
+    assert db_session.query(PluginVersionOrm).count() == 3
+
+
+def test_versions_kept_by_either_policy_are_kept(db_session: Session, tarballs: dict[str, Path], policies):
+    policies(keep_versions=2, keep_days=3)
+    retention.collect(db_session, datetime(2022, 1, 6))
+    assert versions(db_session) == ['2.0.0', '2.0.1']
+
+
+def test_disk_quota_evicts_least_recently_downloaded(
+    db_session: Session, tarballs: dict[str, Path], policies,
+):
+    db_session.add(DownloadStatOrm(plugin_name='plugin_1', version='1.0.0', day=date.today(), downloads=1))
+    db_session.add(DownloadStatOrm(plugin_name='plugin_1', version='2.0.0', day=date(2022, 1, 10), downloads=5))
+    db_session.commit()
+    policies(disk_quota=250)
+
+    pruned, usage = retention.plan(db_session)
+    assert [candidate.version for candidate in pruned] == ['1.1.0', '2.0.0']
+    assert usage == 200
+    report = retention.collect(db_session)
+    assert versions(db_session) == ['1.0.0', '2.0.1']
+    assert report['reclaimed'] == 200
+
+
+def test_no_policy_prunes_nothing(db_session: Session, tarballs: dict[str, Path], policies):
+    policies()
+    assert retention.plan(db_session) == ([], 400)
+
+
+def test_retention_status(client: TestClient, tarballs: dict[str, Path], monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(profiling, 'PROFILE_SECRET', 'spam')
+    response = client.get('/v1/admin/retention', headers={'X-Profile-Secret': 'spam'})
+    assert response.status_code == 200, response.text
+    assert response.json()['data']['usage'] == 400
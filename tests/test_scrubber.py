@@ -0,0 +1,113 @@
+from datetime import datetime
+import hashlib
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.orm import Session
+
+from cli_registry import profiling, scrubber, storage
+from cli_registry.models.plugin import PluginVersionOrm
+from cli_registry.models.scrub import ScrubFindingOrm, ScrubStateOrm
+
+
+@pytest.fixture
+def tarballs(db_session: Session, base_path: Path, monkeypatch: pytest.MonkeyPatch) -> dict[str, Path]:
+    '''Stores a tarball for each version, with its size and digest, and returns those of plugin_1'''
+    monkeypatch.setattr(storage, '_migrated', False)
+    paths = {}
+    for version in db_session.query(PluginVersionOrm):
+        content = version.version.encode('utf8') * 100
+        version.size = len(content)
+        version.digest = hashlib.sha256(content).hexdigest()
+        version.file_path.parent.mkdir(parents=True, exist_ok=True)
+        version.file_path.write_bytes(content)
+        if version.plugin.name == 'plugin_1':
+            paths[version.version] = version.file_path
+    db_session.commit()
+    return paths
+
+
+def scrub_pass(db_session: Session, batch_size: int = 2) -> list[dict]:
+    '''Scrubs batches until the end of a pass, and returns their reports'''
+    reports = []
+    while True:
+        reports.append(scrubber.scrub(db_session, batch_size=batch_size, rate=1024 ** 3))
+        if not db_session.query(ScrubStateOrm).get(1).last_version_id:
+            return reports
+
+
+def findings(db_session: Session) -> dict[str, ScrubFindingOrm]:
+    return {finding.version: finding for finding in db_session.query(ScrubFindingOrm)}
+
+
+def test_scrub(db_session: Session, tarballs: dict[str, Path], base_path: Path):
+    tarballs['1.0.0'].write_bytes(b'spam')
+    content = bytearray(tarballs['1.1.0'].read_bytes())
+    content[0] ^= 1
+    tarballs['1.1.0'].write_bytes(content)
+    tarballs['2.0.0'].unlink()
+
+    reports = scrub_pass(db_session)
+    # Six versions in batches of two, the last batch ending the pass
+    assert [report['checked'] for report in reports] == [2, 2, 2, 0]
+    assert sum(report['findings'] for report in reports) == 3
+    found = findings(db_session)
+    assert sorted(found) == ['1.0.0', '1.1.0', '2.0.0']
+    assert (found['1.0.0'].problem, found['1.0.0'].expected, found['1.0.0'].actual) == ('size', '500', '4')
+    assert found['1.1.0'].problem == scrubber.DIGEST_MISMATCH
+    assert found['2.0.0'].problem == scrubber.MISSING and found['2.0.0'].quarantine_path is None
+    # Corrupted tarballs are not served anymore
+    assert not tarballs['1.1.0'].exists()
+    assert Path(found['1.1.0'].quarantine_path).read_bytes() == content
+    assert Path(found['1.1.0'].quarantine_path).is_relative_to(base_path / scrubber.QUARANTINE_DIR)
+
+    # Findings are kept until the tarballs are restored
+    tarballs['2.0.0'].write_bytes(b'2.0.0' * 100)
+    scrub_pass(db_session)
+    assert sorted(findings(db_session)) == ['1.0.0', '1.1.0']
+    assert findings(db_session)['1.1.0'].quarantine_path is not None
+
+
+def test_findings_of_deleted_versions_are_removed(db_session: Session, tarballs: dict[str, Path]):
+    tarballs['2.0.1'].unlink()
+    scrub_pass(db_session)
+    assert list(findings(db_session)) == ['2.0.1']
+    db_session.query(PluginVersionOrm).filter(PluginVersionOrm.id == 5).delete()
+    db_session.commit()
+    scrub_pass(db_session)
+    assert findings(db_session) == {}
+
+
+def test_scrub_is_incremental(db_session: Session, tarballs: dict[str, Path]):
+    now = datetime(2022, 1, 10)
+    scrubber.scrub(db_session, now, batch_size=4)
+    state = db_session.query(ScrubStateOrm).get(1)
+    assert (state.last_version_id, state.checked, state.pass_started_at) == (4, 4, now)
+    assert state.last_pass_finished_at is None
+    # Another worker already moved past this position
+    assert scrubber._claim(db_session, now, 4) == (4, [5, 6])
+    assert scrubber.scrub(db_session, now, batch_size=4)['checked'] == 0
+    assert db_session.query(ScrubStateOrm).get(1).last_pass_finished_at == now
+
+
+def test_throttle(monkeypatch: pytest.MonkeyPatch):
+    delays = []
+    monkeypatch.setattr(scrubber.time, 'sleep', delays.append)
+    throttle = scrubber.Throttle(1000)
+    throttle.consume(500)
+    throttle.consume(1500)
+    assert 0.4 < delays[0] <= 0.5
+    assert 1.9 < delays[1] <= 2
+
+
+def test_scrub_status(client: TestClient, db_session: Session, tarballs: dict[str, Path], monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_SECRET', 'spam')
+    tarballs['1.0.0'].unlink()
+    scrubber.scrub(db_session, batch_size=2)
+    response = client.get('/v1/admin/scrub', headers={'X-Profile-Secret': 'spam'})
+    assert response.status_code == 200, response.text
+    data = response.json()['data']
+    assert (data['last_version_id'], data['checked'], data['remaining']) == (2, 2, 4)
+    assert data['findings_count'] == 1
+    assert data['findings'][0]['version'] == '1.0.0'
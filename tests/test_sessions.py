@@ -0,0 +1,107 @@
+from base64 import b64encode
+import json
+from pathlib import Path
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from fastapi.testclient import TestClient
+import pytest
+
+from cli_registry import sessions
+from tests.test_app import make_headers, make_request_headers
+
+
+def post_session(client: TestClient, priv_key: str, pub_key: str, plugins: list[str] | None = None, **kwargs):
+    body = json.dumps({'plugins': plugins}).encode('utf8')
+    headers = make_request_headers('POST', '/v1/sessions', body, priv_key, pub_key, **kwargs)
+    return client.post('/v1/sessions', data=body, headers={**headers, 'Content-Type': 'application/json'})
+
+
+def create_session(client: TestClient, priv_key: str, pub_key: str, plugins: list[str] | None = None) -> str:
+    response = post_session(client, priv_key, pub_key, plugins)
+    assert response.status_code == 201, response.text
+    return response.json()['data']['token']
+
+
+def test_issue_and_verify():
+    token, expires_at = sessions.issue('spam', ['plugin_1'])
+    data = sessions.verify(token)
+    assert data == {'fp': 'spam', 'plugins': ['plugin_1'], 'exp': expires_at}
+    assert sessions.allows(data, 'plugin_1')
+    assert not sessions.allows(data, 'plugin_2')
+
+    payload, _, signature = token.partition('.')
+    assert sessions.verify(f'{payload}.{signature[:-2]}AA') is None
+    forged, _ = sessions.issue('eggs', None)
+    assert sessions.verify(f'{forged.partition(".")[0]}.{signature}') is None
+
+    assert sessions.verify('abc.\xe9') is None
+
+    expired, _ = sessions.issue('spam', None, ttl=-1)
+    assert sessions.verify(expired) is None
+
+
+def test_session_authentication(client: TestClient, base_path: Path, pub_key_johndoe: str, priv_key_johndoe: str):
+    token = create_session(client, priv_key_johndoe, pub_key_johndoe)
+    for plugin_name in ('plugin_1', 'plugin_3'):
+        response = client.post(
+            f'/v1/plugins/{plugin_name}/versions/3.0.0/uploads',
+            headers={'Authorization': f'Bearer {token}'},
+        )
+        assert response.status_code == 201, response.text
+
+    # john.doe does not maintain plugin_2
+    response = client.post('/v1/plugins/plugin_2/versions/3.0.0/uploads', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 403, response.text
+
+
+@pytest.mark.parametrize('token', ['spam', 'spam.eggs'])
+def test_session_invalid_token(client: TestClient, token: str):
+    response = client.post('/v1/plugins/plugin_1/versions/3.0.0/uploads', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 403, response.text
+
+
+def test_session_scope(client: TestClient, pub_key_johndoe: str, priv_key_johndoe: str):
+    token = create_session(client, priv_key_johndoe, pub_key_johndoe, ['plugin_3'])
+    response = client.post('/v1/plugins/plugin_1/versions/3.0.0/uploads', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 403, response.text
+    assert response.json()['detail'] == 'Session token is not valid for plugin plugin_1.'
+
+
+def test_session_requires_signature(
+    client: TestClient, pub_key_johndoe: str, priv_key_johndoe: str, priv_key_foobar: str,
+):
+    response = post_session(client, priv_key_foobar, pub_key_johndoe)
+    assert response.status_code == 403, response.text
+
+    # A signature of the path only, as for the other routes, is not accepted
+    response = client.post('/v1/sessions', headers=make_headers('/v1/sessions', priv_key_johndoe, pub_key_johndoe))
+    assert response.status_code == 403, response.text
+
+    response = post_session(client, priv_key_johndoe, pub_key_johndoe, timestamp=int(time.time()) - 3600)
+    assert response.status_code == 403, response.text
+    assert 'X-Timestamp' in response.json()['detail']
+
+
+def test_session_scope_is_signed(client: TestClient, pub_key_johndoe: str, priv_key_johndoe: str):
+    body = json.dumps({'plugins': ['plugin_3']}).encode('utf8')
+    headers = make_request_headers('POST', '/v1/sessions', body, priv_key_johndoe, pub_key_johndoe)
+    # Replayed with another scope
+    response = client.post('/v1/sessions', json={'plugins': None}, headers=headers)
+    assert response.status_code == 403, response.text
+    assert response.json()['detail'] == 'Request body does not match X-Content-SHA256.'
+
+
+def test_ed25519_maintainer(client: TestClient, base_path: Path):
+    priv_key = ed25519.Ed25519PrivateKey.generate()
+    pub_key = priv_key.public_key().public_bytes(
+        serialization.Encoding.OpenSSH, serialization.PublicFormat.OpenSSH
+    ).decode('utf8')
+    response = client.post('/v1/plugins', json={'name': 'plugin_4'}, headers={'Authorization': pub_key})
+    assert response.status_code == 201, response.text
+
+    url = '/v1/plugins/plugin_4/versions/1.0.0/uploads'
+    headers = {'Authorization': pub_key, 'X-Signature': b64encode(priv_key.sign(url.encode('utf8'))).decode('utf8')}
+    response = client.post(url, headers=headers)
+    assert response.status_code == 201, response.text
@@ -0,0 +1,67 @@
+from collections import Counter
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy.orm import Session
+
+from cli_registry import stats
+from cli_registry.models.stats import DownloadStatOrm
+
+
+@pytest.fixture(autouse=True)
+def counts(monkeypatch: pytest.MonkeyPatch) -> Counter:
+    counts = Counter()
+    monkeypatch.setattr(stats, '_counts', counts)
+    return counts
+
+
+def test_downloads_are_counted_in_memory(client: TestClient, db_session: Session, counts: Counter):
+    client.get('/v1/plugins/plugin_1/versions/1.0.0?include=file')
+    client.get('/v1/plugins/plugin_1/versions/1.0.0?include=file')
+    client.get('/v1/plugins/plugin_1/versions/latest?include=file')
+    # Reading the metadata of a version is not a download
+    client.get('/v1/plugins/plugin_1/versions/latest')
+
+    assert counts == {('plugin_1', '1.0.0', date.today()): 2, ('plugin_1', '2.0.1', date.today()): 1}
+    assert db_session.query(DownloadStatOrm).count() == 0
+
+
+def test_flush_adds_to_daily_buckets(client: TestClient, db_session: Session, counts: Counter):
+    yesterday = date.today() - timedelta(days=1)
+    counts.update({('plugin_1', '1.0.0', yesterday): 4, ('plugin_1', '2.0.1', date.today()): 1})
+    assert stats.flush(db_session) == 5
+    counts.update({('plugin_1', '2.0.1', date.today()): 2})
+    assert stats.flush(db_session) == 2
+    assert stats.flush(db_session) == 0
+
+    response = client.get('/v1/plugins/plugin_1/stats?days=7')
+    assert response.status_code == 200, response.text
+    data = response.json()['data']
+    assert data['downloads'] == 7
+    assert data['days'] == [
+        {'day': yesterday.isoformat(), 'downloads': 4},
+        {'day': date.today().isoformat(), 'downloads': 3},
+    ]
+    assert data['versions'] == {'1.0.0': 4, '2.0.1': 3}
+
+    response = client.get('/v1/plugins/plugin_1/stats?days=1')
+    assert response.json()['data']['downloads'] == 3
+
+
+def test_popular_plugins(client: TestClient, db_session: Session, counts: Counter):
+    counts.update({
+        ('plugin_1', '1.0.0', date.today()): 2,
+        ('plugin_3', '1.0.0', date.today()): 5,
+        ('deleted_plugin', '1.0.0', date.today()): 10,
+        ('plugin_2', '1.0.0', date.today() - timedelta(days=60)): 100,
+    })
+    stats.flush(db_session)
+    stats.rank(db_session)
+
+    response = client.get('/v1/popular')
+    assert response.status_code == 200, response.text
+    assert response.json()['data'] == [
+        {'rank': 1, 'plugin_name': 'plugin_3', 'downloads': 5},
+        {'rank': 2, 'plugin_name': 'plugin_1', 'downloads': 2},
+    ]
@@ -0,0 +1,75 @@
+import json
+from pathlib import Path
+
+import pytest
+from sqlalchemy.orm import Session
+
+from cli_registry import deltas, storage, storage_migration
+from cli_registry.models.plugin import PluginVersionOrm
+
+
+@pytest.fixture(autouse=True)
+def not_migrated(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(storage, '_migrated', False)
+
+
+def test_tarball_path(base_path: Path):
+    path = storage.tarball_path('plugin_1', '1.0.0')
+    assert path.relative_to(base_path).parts[0] == 'plugins'
+    assert len(path.relative_to(base_path).parts) == 6
+    assert path.name == '1.0.0.tar.gz'
+    assert path.parent.parent.name == 'plugin_1'
+    assert storage.tarball_path('plugin_1', '1.1.0').parent.parent == path.parent.parent
+
+
+@pytest.mark.parametrize('name', ['', '.', '..', '../plugin_1', 'plugin_1/1.0.0', '..\\plugin_1', 'plugin\0'])
+def test_unsafe_path_segments(base_path: Path, name: str):
+    with pytest.raises(ValueError):
+        storage.tarball_path('plugin_1', name)
+    with pytest.raises(ValueError):
+        storage.plugin_dir(name)
+    with pytest.raises(ValueError):
+        deltas.delta_path('plugin_1', name, '1.0.0')
+
+
+def test_resolve_legacy_tarball(base_path: Path):
+    assert storage.resolve_tarball('plugin_1', '1.0.0') == storage.tarball_path('plugin_1', '1.0.0')
+    legacy_path = base_path / 'plugin_1/1.0.0.tar.gz'
+    legacy_path.parent.mkdir()
+    legacy_path.write_bytes(b'spam')
+    assert storage.resolve_tarball('plugin_1', '1.0.0') == legacy_path
+
+
+def test_init_layout(base_path: Path):
+    legacy_path = base_path / 'plugins/plugin_1/1.0.0.tar.gz'
+    legacy_path.parent.mkdir(parents=True)
+    legacy_path.write_bytes(b'spam')
+    storage.tarball_path('plugin_1', '1.1.0').parent.mkdir(parents=True)
+    storage.tarball_path('plugin_1', '1.1.0').write_bytes(b'spam')
+    storage.init_layout()
+    assert not storage.is_migrated()
+
+    legacy_path.unlink()
+    storage.init_layout()
+    assert storage.is_migrated()
+
+
+def test_migrate(db_session: Session, base_path: Path):
+    versions = db_session.query(PluginVersionOrm).order_by(PluginVersionOrm.id).all()
+    for i, version in enumerate(versions):
+        legacy_path = storage.legacy_tarball_paths(version.plugin.name, version.version)[i % 2]
+        legacy_path.parent.mkdir(parents=True, exist_ok=True)
+        legacy_path.write_bytes(version.plugin.name.encode('utf8') + version.version.encode('utf8'))
+
+    # Resume after the first two versions
+    for version in versions[:2]:
+        storage_migration.migrate_version(version.plugin.name, version.version)
+    (base_path / storage_migration.STATE_FILE).write_text(json.dumps({'last_id': versions[1].id}))
+
+    assert storage_migration.migrate(db_session, batch_size=2) == len(versions) - 2
+    assert storage.is_migrated()
+    for version in versions:
+        assert version.file_path == storage.tarball_path(version.plugin.name, version.version)
+        assert version.file_path.read_bytes() == version.plugin.name.encode('utf8') + version.version.encode('utf8')
+    assert sorted(path.name for path in base_path.iterdir()) == sorted(['plugins', storage.MIGRATED_MARKER])
+    assert all(len(path.name) == 2 for path in (base_path / 'plugins').iterdir())
@@ -0,0 +1,99 @@
+from base64 import b85encode
+import mmap
+import os
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+import pytest
+
+from cli_registry import storage, tarball_cache
+from cli_registry.tarball_cache import TarballCache
+
+
+def write(path: Path, size: int) -> bytes:
+    content = os.urandom(size)
+    path.write_bytes(content)
+    return content
+
+
+def test_small_tarballs_are_held_as_bytes(tmp_path: Path):
+    cache = TarballCache(max_size=1000, mmap_threshold=500)
+    content = write(tmp_path / 'small.tar.gz', 100)
+
+    assert cache.get(tmp_path / 'small.tar.gz') == content
+    assert isinstance(cache.get(tmp_path / 'small.tar.gz'), bytes)
+    assert cache.size == 100
+
+
+def test_large_tarballs_are_memory_mapped(tmp_path: Path):
+    cache = TarballCache(max_size=1000, mmap_threshold=500)
+    content = write(tmp_path / 'large.tar.gz', 600)
+
+    cached = cache.get(tmp_path / 'large.tar.gz')
+    assert isinstance(cached, mmap.mmap)
+    assert cached[:] == content
+    assert b''.join(tarball_cache.iter_chunks(cached, chunk_size=64)) == content
+
+
+def test_least_recently_used_tarballs_are_evicted(tmp_path: Path):
+    cache = TarballCache(max_size=1000, mmap_threshold=1000)
+    for name in 'abc':
+        write(tmp_path / name, 400)
+    cache.get(tmp_path / 'a')
+    cache.get(tmp_path / 'b')
+    cache.get(tmp_path / 'a')
+    cache.get(tmp_path / 'c')
+
+    assert list(cache._entries) == [tmp_path / 'a', tmp_path / 'c']
+    assert cache.size == 800
+    # Too large to be cached
+    write(tmp_path / 'd', 2000)
+    assert cache.get(tmp_path / 'd') is None
+    assert cache.size == 800
+
+
+def test_encoded_form_is_cached_within_budget(tmp_path: Path):
+    cache = TarballCache(max_size=1000, mmap_threshold=1000)
+    content = write(tmp_path / 'a', 400)
+    write(tmp_path / 'b', 400)
+    cache.get(tmp_path / 'b')
+
+    encoded = cache.encoded(tmp_path / 'a')
+    assert encoded == b85encode(content, True).decode('utf8')
+    assert cache.encoded(tmp_path / 'a') is encoded
+    # The encoded form made room by evicting b
+    assert list(cache._entries) == [tmp_path / 'a']
+    assert cache.size == 400 + len(encoded)
+
+
+def test_replaced_and_deleted_tarballs_are_not_served(tmp_path: Path):
+    cache = TarballCache(max_size=1000, mmap_threshold=1000)
+    write(tmp_path / 'a', 100)
+    cache.get(tmp_path / 'a')
+    content = write(tmp_path / 'replaced', 200)
+    os.replace(tmp_path / 'replaced', tmp_path / 'a')
+
+    assert cache.get(tmp_path / 'a') == content
+    assert cache.size == 200
+    os.remove(tmp_path / 'a')
+    with pytest.raises(FileNotFoundError):
+        cache.get(tmp_path / 'a')
+    assert cache.encoded(tmp_path / 'a') is None
+    assert cache.size == 0
+
+
+def test_download_from_cache(
+    client: TestClient, base_path: Path, monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(tarball_cache, 'cache', TarballCache(max_size=10000, mmap_threshold=1000))
+    for version, size in (('1.0.0', 500), ('1.1.0', 5000), ('2.0.0', 50000)):
+        path = storage.tarball_path('plugin_1', version)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        content = write(path, size)
+
+        response = client.get(f'/v1/plugins/plugin_1/versions/{version}/download')
+        assert response.status_code == 200, response.text
+        assert response.content == content
+        assert response.headers['content-type'] == 'application/gzip'
+        assert f'plugin_1-{version}.tar.gz' in response.headers['content-disposition']
+    assert tarball_cache.cache.size == 5500
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+import hashlib
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from cli_registry import uploads
+from cli_registry.models.upload import UploadOrm
+from tests.test_app import make_headers
+
+
+def create_upload(client: TestClient, priv_key: str, pub_key: str) -> str:
+    url = '/v1/plugins/plugin_1/versions/3.0.0/uploads'
+    response = client.post(url, headers=make_headers(url, priv_key, pub_key))
+    assert response.status_code == 201, response.text
+    assert response.json()['data']['offset'] == 0
+    return response.json()['data']['id']
+
+
+def put_chunk(client: TestClient, upload_id: str, offset: int, chunk: bytes, priv_key: str, pub_key: str):
+    url = f'/v1/plugins/plugin_1/uploads/{upload_id}'
+    headers = make_headers(url, priv_key, pub_key)
+    headers['Upload-Offset'] = str(offset)
+    return client.put(url, data=chunk, headers=headers)
+
+
+def test_resumable_upload(
+    client: TestClient, base_path: Path, data_dir: Path,
+    pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    tarball = (data_dir / 'plugin.tar.gz').read_bytes()
+    upload_id = create_upload(client, priv_key_johndoe, pub_key_johndoe)
+
+    response = put_chunk(client, upload_id, 0, tarball[:300], priv_key_johndoe, pub_key_johndoe)
+    assert response.status_code == 200, response.text
+    assert response.json()['data']['offset'] == 300
+
+    # The acknowledgement was lost, the client queries the offset and resends part of the chunk
+    response = client.get(f'/v1/plugins/plugin_1/uploads/{upload_id}')
+    assert response.json()['data']['offset'] == 300
+    response = put_chunk(client, upload_id, 200, tarball[200:], priv_key_johndoe, pub_key_johndoe)
+    assert response.status_code == 200, response.text
+    assert response.json()['data']['offset'] == len(tarball)
+
+    url = f'/v1/plugins/plugin_1/uploads/{upload_id}/finalize'
+    response = client.post(
+        url, json={'digest': hashlib.sha256(tarball).hexdigest()},
+        headers=make_headers(url, priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 201, response.text
+    assert response.json()['data']['size'] == len(tarball)
+
+    response = client.get('/v1/plugins/plugin_1/versions/latest')
+    assert response.json()['data']['version'] == '3.0.0'
+    assert not uploads.upload_path(upload_id).exists()
+    response = client.get(f'/v1/plugins/plugin_1/uploads/{upload_id}')
+    assert response.status_code == 404, response.text
+
+
+def test_upload_offset_mismatch(
+    client: TestClient, base_path: Path, pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    upload_id = create_upload(client, priv_key_johndoe, pub_key_johndoe)
+    response = put_chunk(client, upload_id, 10, b'spam', priv_key_johndoe, pub_key_johndoe)
+    assert response.status_code == 409, response.text
+
+
+def test_upload_digest_mismatch(
+    client: TestClient, base_path: Path, pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    upload_id = create_upload(client, priv_key_johndoe, pub_key_johndoe)
+    put_chunk(client, upload_id, 0, b'spam', priv_key_johndoe, pub_key_johndoe)
+    url = f'/v1/plugins/plugin_1/uploads/{upload_id}/finalize'
+    response = client.post(
+        url, json={'digest': hashlib.sha256(b'eggs').hexdigest()},
+        headers=make_headers(url, priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 422, response.text
+
+
+def test_collect_expired_uploads(
+    client: TestClient, db_session: Session, base_path: Path,
+    pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    upload_id = create_upload(client, priv_key_johndoe, pub_key_johndoe)
+    assert uploads.collect_expired_uploads(db_session) == 0
+    assert uploads.collect_expired_uploads(db_session, datetime.now() + timedelta(days=2)) == 1
+    assert db_session.query(UploadOrm).filter(UploadOrm.id == upload_id).first() is None
+    assert not uploads.upload_path(upload_id).exists()
+
+
+def test_expired_upload_is_refused(
+    client: TestClient, db_session: Session, base_path: Path, data_dir: Path,
+    pub_key_johndoe: str, priv_key_johndoe: str,
+):
+    tarball = (data_dir / 'plugin.tar.gz').read_bytes()
+    upload_id = create_upload(client, priv_key_johndoe, pub_key_johndoe)
+    upload = db_session.get(UploadOrm, upload_id)
+    upload.expires_at = datetime.now() - timedelta(seconds=1)
+    db_session.flush()
+
+    # Not collected yet, but neither resumed nor extended
+    response = put_chunk(client, upload_id, 0, tarball, priv_key_johndoe, pub_key_johndoe)
+    assert response.status_code == 410, response.text
+    url = f'/v1/plugins/plugin_1/uploads/{upload_id}/finalize'
+    response = client.post(
+        url, json={'digest': hashlib.sha256(tarball).hexdigest()},
+        headers=make_headers(url, priv_key_johndoe, pub_key_johndoe),
+    )
+    assert response.status_code == 410, response.text
+    assert db_session.get(UploadOrm, upload_id).expires_at < datetime.now()
+    assert uploads.current_offset(upload) == 0
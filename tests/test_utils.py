@@ -2,7 +2,7 @@ from base64 import b64encode
 from pathlib import Path
 
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
 
 from cli_registry.utils import check_auth, encode_file
 
@@ -43,3 +43,16 @@ def test_check_auth(data_dir: Path):
     ).decode('utf8')
 
     assert check_auth(message, pub_key, signature), signature
+
+
+def test_check_auth_ed25519():
+    message = b'Hello, World!'
+    priv_key = ed25519.Ed25519PrivateKey.generate()
+    pub_key = priv_key.public_key().public_bytes(
+        serialization.Encoding.OpenSSH, serialization.PublicFormat.OpenSSH
+    ).decode('utf8')
+    signature = b64encode(priv_key.sign(message)).decode('utf8')
+
+    assert check_auth(message, pub_key, signature), signature
+    assert not check_auth(b'Goodbye, World!', pub_key, signature)
+    assert not check_auth(message, pub_key, 'not base64')
@@ -0,0 +1,85 @@
+import io
+from pathlib import Path
+import tarfile
+
+import pytest
+
+from cli_registry import validation
+from cli_registry.validation import InvalidTarball, validate_tarball
+
+
+def make_tarball(path: Path, members: dict[str, bytes]) -> Path:
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def test_validate_tarball(data_dir: Path):
+    manifest = validate_tarball(str(data_dir / 'plugin.tar.gz'))
+    assert manifest == {
+        'module': 'plugin',
+        'description': 'Converts dates to different formats',
+        'version': '1.0.0',
+        'dependencies': [],
+    }
+
+
+def test_validate_tarball_manifest(tmp_path: Path):
+    path = make_tarball(tmp_path / 'plugin.tar.gz', {
+        'plugin.json': (
+            b'{"module": "spam", "description": "Eggs", "version": "2.0.0", '
+            b'"dependencies": ["Foo", "bar"]}'
+        ),
+        'spam.py': b'__version__ = "1.0.0"',
+    })
+    assert validate_tarball(str(path)) == {
+        'module': 'spam', 'description': 'Eggs', 'version': '2.0.0', 'dependencies': ['bar', 'foo'],
+    }
+
+
+def test_validate_tarball_invalid_dependencies(tmp_path: Path):
+    path = make_tarball(tmp_path / 'plugin.tar.gz', {'plugin.json': b'{"module": "spam", "dependencies": [1]}'})
+    with pytest.raises(InvalidTarball, match='Dependencies'):
+        validate_tarball(str(path))
+
+
+def test_validate_tarball_not_gzip(tmp_path: Path):
+    path = tmp_path / 'plugin.tar.gz'
+    path.write_bytes(b'spam' * 100)
+    with pytest.raises(InvalidTarball):
+        validate_tarball(str(path))
+
+
+def test_validate_tarball_truncated(tmp_path: Path, data_dir: Path):
+    path = tmp_path / 'plugin.tar.gz'
+    path.write_bytes((data_dir / 'plugin.tar.gz').read_bytes()[:-100])
+    with pytest.raises(InvalidTarball):
+        validate_tarball(str(path))
+
+
+def test_validate_tarball_bomb(tmp_path: Path):
+    path = make_tarball(tmp_path / 'plugin.tar.gz', {'plugin.py': b'', 'zeros': bytes(10 * 1024 * 1024)})
+    with pytest.raises(InvalidTarball, match='uncompresses to more than'):
+        validate_tarball(str(path))
+
+
+def test_validate_tarball_too_many_members(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(validation, 'MAX_TARBALL_MEMBERS', 3)
+    path = make_tarball(tmp_path / 'plugin.tar.gz', {f'{i}.py': b'' for i in range(4)})
+    with pytest.raises(InvalidTarball, match='more than 3 members'):
+        validate_tarball(str(path))
+
+
+def test_validate_tarball_unsafe_path(tmp_path: Path):
+    path = make_tarball(tmp_path / 'plugin.tar.gz', {'../plugin.py': b''})
+    with pytest.raises(InvalidTarball, match='unsafe path'):
+        validate_tarball(str(path))
+
+
+def test_manifest_warnings():
+    manifest = {'module': 'plugin', 'description': None, 'version': '1.0.0'}
+    assert len(validation.manifest_warnings(manifest, '1.0.0')) == 1
+    assert len(validation.manifest_warnings(manifest, '2.0.0')) == 2